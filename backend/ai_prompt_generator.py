@@ -1,6 +1,8 @@
 """AI Prompt生成器 - 根据公司类型生成不同的Prompt"""
 from models import CompanyType
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Union
+from quarter_metrics import QuarterMetrics
+from instrumentation import timed
 
 
 class AIPromptGenerator:
@@ -16,14 +18,16 @@ class AIPromptGenerator:
     }
     
     @staticmethod
+    @timed("prompt")
     def generate_quarter_prompt(
         company_name: str,
         company_type: CompanyType,
         quarter: str,
-        quarter_data: Dict,
+        quarter_data: Union[QuarterMetrics, Dict],
         labels: List[str]
     ) -> str:
-        """生成单季度AI分析Prompt"""
+        """生成单季度AI分析Prompt（缺失指标显示为 N/A）"""
+        quarter_data = QuarterMetrics.from_mapping(quarter_data)
         company_type_name = AIPromptGenerator.COMPANY_TYPE_NAMES.get(company_type, "未知类型")
         
         if company_type == CompanyType.TECH_PLATFORM:
@@ -36,7 +40,7 @@ class AIPromptGenerator:
             )
         elif company_type == CompanyType.PHARMA_INNOVATION:
             return AIPromptGenerator._pharma_innovation_quarter_prompt(
-                quarter, quarter_data, labels
+                company_name, quarter, quarter_data, labels
             )
         elif company_type == CompanyType.PHARMA_MATURE:
             return AIPromptGenerator._pharma_mature_quarter_prompt(
@@ -56,7 +60,7 @@ class AIPromptGenerator:
             )
     
     @staticmethod
-    def _tech_platform_quarter_prompt(company_name: str, quarter: str, data: Dict, labels: List[str]) -> str:
+    def _tech_platform_quarter_prompt(company_name: str, quarter: str, data: QuarterMetrics, labels: List[str]) -> str:
         roic = data.get("roic", "N/A")
         wacc = data.get("wacc", "N/A")
         roic_wacc = (roic - wacc) if (roic != "N/A" and wacc != "N/A") else "N/A"
@@ -85,7 +89,7 @@ ROIC={roic}%  WACC={wacc}%  ROIC-WACC={roic_wacc}%
 - 语言客观、严谨，200字以内"""
     
     @staticmethod
-    def _tech_mature_quarter_prompt(company_name: str, quarter: str, data: Dict, labels: List[str]) -> str:
+    def _tech_mature_quarter_prompt(company_name: str, quarter: str, data: QuarterMetrics, labels: List[str]) -> str:
         roic = data.get("roic", "N/A")
         wacc = data.get("wacc", "N/A")
         roic_wacc = (roic - wacc) if (roic != "N/A" and wacc != "N/A") else "N/A"
@@ -114,7 +118,7 @@ ROIC={roic}%  WACC={wacc}%  ROIC-WACC={roic_wacc}%
 - 语言客观、严谨，200字以内"""
     
     @staticmethod
-    def _pharma_innovation_quarter_prompt(company_name: str, quarter: str, data: Dict, labels: List[str]) -> str:
+    def _pharma_innovation_quarter_prompt(company_name: str, quarter: str, data: QuarterMetrics, labels: List[str]) -> str:
         return f"""你是一名专注创新药领域的长期投资分析师。
 公司类型：医药创新型
 
@@ -137,7 +141,7 @@ ROIC={data.get('roic', 'N/A')}%  WACC={data.get('wacc', 'N/A')}%  PB={data.get('
 - 客观分析，200字以内"""
     
     @staticmethod
-    def _pharma_mature_quarter_prompt(company_name: str, quarter: str, data: Dict, labels: List[str]) -> str:
+    def _pharma_mature_quarter_prompt(company_name: str, quarter: str, data: QuarterMetrics, labels: List[str]) -> str:
         return f"""你是一名专注成熟制药公司的长期投资分析师。
 公司类型：医药成熟型
 
@@ -160,7 +164,7 @@ ROE={data.get('roe', 'N/A')}%  自由现金流率={data.get('fcf_margin', 'N/A')
 - 客观分析，200字以内"""
     
     @staticmethod
-    def _financial_quarter_prompt(company_name: str, quarter: str, data: Dict, labels: List[str]) -> str:
+    def _financial_quarter_prompt(company_name: str, quarter: str, data: QuarterMetrics, labels: List[str]) -> str:
         return f"""你是一名专注金融行业的长期投资分析师。
 公司类型：金融型
 
@@ -182,7 +186,7 @@ PB={data.get('pb', 'N/A')}  ROE={data.get('roe', 'N/A')}%  自由现金流率={d
 - 客观分析，200字以内"""
     
     @staticmethod
-    def _manufacturing_quarter_prompt(company_name: str, quarter: str, data: Dict, labels: List[str]) -> str:
+    def _manufacturing_quarter_prompt(company_name: str, quarter: str, data: QuarterMetrics, labels: List[str]) -> str:
         return f"""你是一名专注制造业的长期投资分析师。
 公司类型：制造业型
 
@@ -206,9 +210,10 @@ ROIC={data.get('roic', 'N/A')}%  毛利率={data.get('gross_margin', 'N/A')}%  
     
     @staticmethod
     def _generic_quarter_prompt(
+        company_name: str,
         company_type_name: str,
         quarter: str,
-        data: Dict,
+        data: QuarterMetrics,
         labels: List[str]
     ) -> str:
         return f"""你是一名长期价值投资分析师。
@@ -229,6 +234,7 @@ ROIC={data.get('roic', 'N/A')}%  ROE={data.get('roe', 'N/A')}%
 - 客观分析，200字以内"""
     
     @staticmethod
+    @timed("prompt")
     def generate_comprehensive_prompt(
         ticker: str,
         company_name: str,
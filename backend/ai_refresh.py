@@ -0,0 +1,295 @@
+"""综合AI分析的定时刷新 - 在刷新时段内按过期程度重新生成，限制并发与每日 token 预算
+
+综合AI分析原先只在季度写入时顺带生成：没人编辑的公司文本长期不更新，频繁编辑的公司
+被反复生成。启用 AI_REFRESH_ENABLED 后：
+- 写入请求不再同步生成综合分析（AI_REFRESH_DEFER_WRITES），公司被判为过期后由调度器处理
+- 调度器每 AI_REFRESH_TICK_SECONDS 检查一次，只在刷新时段（AI_REFRESH_WINDOW，服务器本地
+  时间，可跨午夜）内按 crud.stale_comprehensive_companies 的顺序提交生成任务，同时运行的任务
+  不超过 AI_REFRESH_CONCURRENCY
+- 每日 token 预算（AI_REFRESH_DAILY_TOKEN_BUDGET）随时段进度线性放开：时段过去一半时最多
+  用掉一半预算，成本均匀分布在整个时段内。用量记录在 ai_token_usage 表，跨进程、跨重启有效
+- 多进程部署时每个 worker 都会启动调度器，ai_generation_locks 中的租约行保证同一时间只有
+  一个在提交任务；持有者退出后租约到期由其他 worker 接管
+"""
+import os
+import socket
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from datetime import datetime, date, time, timedelta
+from typing import Optional, Dict, Tuple
+from sqlalchemy import or_
+import crud
+import models
+from ai_service import token_meter
+from config import settings
+from database import SessionLocal, dialect_insert
+
+logger = logging.getLogger(__name__)
+
+LEASE_KEY = "scheduler:comprehensive-refresh"
+USAGE_SCOPE = "comprehensive-refresh"
+DEFAULT_JOB_TOKENS = 2000  # 尚无样本时单次生成的 token 估计
+EWMA_ALPHA = 0.2
+
+
+def parse_window(value: Optional[str]) -> Optional[Tuple[time, time]]:
+    """'01:00-06:00' → (开始, 结束)；空值表示全天"""
+    if not value or not value.strip():
+        return None
+    try:
+        start, end = (datetime.strptime(part.strip(), "%H:%M").time() for part in value.split("-", 1))
+    except ValueError:
+        raise ValueError(f"Invalid AI_REFRESH_WINDOW {value!r}, expected HH:MM-HH:MM")
+    return start, end
+
+
+def current_window(now: datetime, window: Optional[Tuple[time, time]]) -> Optional[Tuple[datetime, datetime]]:
+    """包含 now 的刷新时段 [开始, 结束)；不在时段内返回 None"""
+    if window is None:
+        start = datetime.combine(now.date(), time())
+        return start, start + timedelta(days=1)
+
+    start_time, end_time = window
+    today_start = datetime.combine(now.date(), start_time)
+    today_end = datetime.combine(now.date(), end_time)
+    if start_time < end_time:
+        return (today_start, today_end) if today_start <= now < today_end else None
+    # 跨午夜（如 22:00-06:00）；开始与结束相同表示从该时刻起的全天
+    if now >= today_start:
+        return today_start, today_end + timedelta(days=1)
+    if now < today_end:
+        return today_start - timedelta(days=1), today_end
+    return None
+
+
+def tokens_used(day: date) -> int:
+    db = SessionLocal()
+    try:
+        used = db.query(models.AITokenUsage.tokens)\
+            .filter(models.AITokenUsage.usage_date == day, models.AITokenUsage.scope == USAGE_SCOPE)\
+            .scalar()
+        db.commit()
+        return used or 0
+    finally:
+        db.close()
+
+
+def record_usage(day: date, tokens: int, calls: int) -> None:
+    usage = models.AITokenUsage
+    db = SessionLocal()
+    try:
+        insert = dialect_insert(db)(usage).values(
+            usage_date=day, scope=USAGE_SCOPE, tokens=tokens, calls=calls, updated_at=datetime.utcnow()
+        )
+        db.execute(insert.on_conflict_do_update(
+            index_elements=["usage_date", "scope"],
+            set_={
+                "tokens": usage.tokens + insert.excluded.tokens,
+                "calls": usage.calls + insert.excluded.calls,
+                "updated_at": insert.excluded.updated_at,
+            }
+        ))
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"Failed to record AI refresh token usage: {e}")
+    finally:
+        db.close()
+
+
+class RefreshScheduler:
+    def __init__(self):
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._running: Dict[int, Future] = {}
+        self._lock = threading.Lock()
+        self._owner = f"{socket.gethostname()}:{os.getpid()}:ai-refresh"
+        self.job_tokens = float(DEFAULT_JOB_TOKENS)
+        self.is_leader = False
+        self.last_tick: Optional[datetime] = None
+        self.completed = 0
+        self.failed = 0
+
+    def start(self) -> None:
+        parse_window(settings.ai_refresh_window)  # 配置错误在启动时暴露
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._owner = f"{socket.gethostname()}:{os.getpid()}:ai-refresh"
+        self._thread = threading.Thread(target=self._loop, name="eie-ai-refresh", daemon=True)
+        self._thread.start()
+        logger.info(
+            f"AI refresh scheduler started: window={settings.ai_refresh_window or 'all day'}, "
+            f"concurrency={settings.ai_refresh_concurrency}, budget={settings.ai_refresh_daily_token_budget}"
+        )
+
+    def stop(self) -> None:
+        """停止提交新任务；进行中的生成由关闭时的 LLM 调用等待逻辑兜底"""
+        self._stop.set()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        if self.is_leader:
+            self._release_lease()
+
+    def drain(self) -> None:
+        """等待已提交的任务完成（manage.py 单次运行时使用）"""
+        with self._lock:
+            futures = list(self._running.values())
+        for future in futures:
+            future.exception()
+        self._reap()
+
+    def _loop(self) -> None:
+        while not self._stop.wait(settings.ai_refresh_tick_seconds):
+            try:
+                self.tick()
+            except Exception:
+                logger.exception("AI refresh tick failed")
+
+    def tick(self, ignore_window: bool = False) -> int:
+        """检查一次并提交任务，返回本次提交的任务数
+
+        ignore_window 时不受刷新时段限制，并可使用当日全部剩余预算。
+        """
+        now = datetime.now()
+        self.last_tick = now
+        window = current_window(now, parse_window(settings.ai_refresh_window))
+        if window is None and not ignore_window:
+            return 0
+        if not self._hold_lease():
+            return 0
+
+        self._reap()
+        with self._lock:
+            running = set(self._running)
+        free = settings.ai_refresh_concurrency - len(running)
+        if free <= 0:
+            return 0
+
+        day = window[0].date() if window is not None else now.date()
+        budget = settings.ai_refresh_daily_token_budget
+        allowance = budget if ignore_window or window is None else self._allowance(now, window, budget)
+        used = tokens_used(day)
+
+        db = SessionLocal()
+        try:
+            candidates = crud.stale_comprehensive_companies(
+                db, timedelta(days=settings.ai_refresh_max_age_days), free, exclude=running
+            )
+            db.commit()
+        finally:
+            db.close()
+
+        submitted = 0
+        for candidate in candidates:
+            # 进行中的任务按平均消耗预占预算
+            expected = used + (len(running) + submitted + 1) * self.job_tokens
+            if expected > allowance or expected > budget:
+                break
+            self._submit(candidate["company_id"], day)
+            submitted += 1
+        return submitted
+
+    def _allowance(self, now: datetime, window: Tuple[datetime, datetime], budget: int) -> float:
+        """时段进度对应的可用预算，额外放开一个任务的量，保证时段开始时就能运行"""
+        start, end = window
+        progress = (now - start).total_seconds() / max((end - start).total_seconds(), 1.0)
+        return min(budget, budget * progress + self.job_tokens)
+
+    def _submit(self, company_id: int, day: date) -> None:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=settings.ai_refresh_concurrency, thread_name_prefix="eie-ai-refresh-job"
+            )
+        with self._lock:
+            self._running[company_id] = self._executor.submit(self._refresh, company_id, day)
+
+    def _reap(self) -> None:
+        with self._lock:
+            for company_id in [cid for cid, future in self._running.items() if future.done()]:
+                del self._running[company_id]
+
+    def _refresh(self, company_id: int, day: date) -> None:
+        db = SessionLocal()
+        try:
+            with token_meter.measure() as usage:
+                crud.generate_company_comprehensive_ai(db, company_id)
+            if usage.calls:
+                record_usage(day, usage.tokens, usage.calls)
+                self.job_tokens = EWMA_ALPHA * usage.tokens + (1 - EWMA_ALPHA) * self.job_tokens
+            self.completed += 1
+        except Exception:
+            self.failed += 1
+            logger.exception(f"Scheduled comprehensive AI refresh failed for company {company_id}")
+        finally:
+            db.close()
+
+    def _hold_lease(self) -> bool:
+        """获取或续期调度租约；锁表不可用（如未执行 migrate）时不运行"""
+        lock = models.AIGenerationLock
+        now = datetime.utcnow()
+        lease = timedelta(seconds=settings.ai_refresh_tick_seconds * 2 + 30)
+        db = SessionLocal()
+        try:
+            insert = dialect_insert(db)(lock).values(
+                lock_key=LEASE_KEY, owner=self._owner, acquired_at=now, expires_at=now + lease,
+                result_text=None, completed_at=None
+            )
+            statement = insert.on_conflict_do_update(
+                index_elements=["lock_key"],
+                set_={"owner": insert.excluded.owner, "expires_at": insert.excluded.expires_at},
+                where=or_(lock.owner == self._owner, lock.expires_at < now)
+            ).returning(lock.owner)
+            self.is_leader = db.execute(statement).first() is not None
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"AI refresh lease unavailable: {e}")
+            self.is_leader = False
+        finally:
+            db.close()
+        return self.is_leader
+
+    def _release_lease(self) -> None:
+        lock = models.AIGenerationLock
+        db = SessionLocal()
+        try:
+            db.query(lock).filter(lock.lock_key == LEASE_KEY, lock.owner == self._owner)\
+                .delete(synchronize_session=False)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"Failed to release AI refresh lease: {e}")
+        finally:
+            db.close()
+        self.is_leader = False
+
+    def status(self) -> Dict:
+        now = datetime.now()
+        window = current_window(now, parse_window(settings.ai_refresh_window))
+        day = window[0].date() if window is not None else now.date()
+        budget = settings.ai_refresh_daily_token_budget
+        with self._lock:
+            running = sorted(cid for cid, future in self._running.items() if not future.done())
+        return {
+            "enabled": settings.ai_refresh_enabled,
+            "window": settings.ai_refresh_window or None,
+            "in_window": window is not None,
+            "leader": self.is_leader,
+            "running": running,
+            "concurrency": settings.ai_refresh_concurrency,
+            "budget_day": day.isoformat(),
+            "daily_token_budget": budget,
+            "tokens_used": tokens_used(day),
+            "allowance": round(self._allowance(now, window, budget)) if window is not None else 0,
+            "job_tokens_estimate": round(self.job_tokens),
+            "completed": self.completed,
+            "failed": self.failed,
+            "last_tick": self.last_tick.isoformat() if self.last_tick else None,
+        }
+
+
+scheduler = RefreshScheduler()
@@ -1,121 +1,147 @@
-import json
 import re
-import time
-import random
 import logging
-import requests
+import threading
+from contextlib import contextmanager
 from typing import Optional, Dict, List
-from config import settings
+from instrumentation import timed
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class InflightCalls:
+    """进行中的LLM调用计数；进程退出前等待这些调用完成，避免生成结果丢失"""
+
+    def __init__(self):
+        self._count = 0
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def track(self):
+        with self._condition:
+            self._count += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._count -= 1
+                self._condition.notify_all()
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    def wait_idle(self, timeout: float) -> bool:
+        """等待所有调用结束，超时返回 False"""
+        with self._condition:
+            return self._condition.wait_for(lambda: self._count == 0, timeout=timeout)
+
+
+inflight_calls = InflightCalls()
+
+# 生成失败时 generate_analysis 返回的提示文本（不是分析结果，不应被复用）
+NO_API_KEY_TEXT = "AI分析功能需要配置API Key。"
+GENERATION_FAILED_TEXT = "AI分析生成失败，请检查后端日志。"
+
+
+def is_fallback_text(text: Optional[str]) -> bool:
+    return text in (NO_API_KEY_TEXT, GENERATION_FAILED_TEXT)
+
+
+class TokenUsage:
+    __slots__ = ("tokens", "calls")
+
+    def __init__(self):
+        self.tokens = 0
+        self.calls = 0
+
+
+class TokenMeter:
+    """按线程累计LLM token 用量：调用方用 measure() 统计一段代码内本线程发起的调用
+
+    single-flight 复用其他调用的结果时没有发起请求，不计入。
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    @contextmanager
+    def measure(self):
+        stack = self._stack()
+        usage = TokenUsage()
+        stack.append(usage)
+        try:
+            yield usage
+        finally:
+            stack.remove(usage)
+
+    def record(self, tokens: int) -> None:
+        for usage in self._stack():
+            usage.tokens += tokens
+            usage.calls += 1
+
+    def _stack(self) -> list:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+
+token_meter = TokenMeter()
+
+
 class AIService:
-    """AI服务类 - 使用自定义 requests 方式调用"""
-    
+    """AI服务类 - 经 llm_router 在已配置的供应商间路由"""
+
     def __init__(self):
-        # 从配置中读取参数
-        self.api_key = settings.ai_service_api_key or settings.openai_api_key
-        self.base_url = settings.ai_service_url or "https://api.openai.com/v1"
-        self.model = settings.ai_service_model or "gpt-4"
-        
-        # 预清理 URL
-        if self.base_url:
-            self.base_url = self.base_url.rstrip('/')
-            
-        print(f"DEBUG: URL={self.base_url}, Key={self.api_key[:10] if self.api_key else 'None'}..., Model={self.model}")
+        # httpx 与路由模块导入较慢，只在实际使用AI服务时导入
+        from llm_router import router
+        self.router = router
+        logger.debug(f"AI service configured: providers={[p.name for p in router.providers]}")
 
-    def chat_with_openai(
+    def chat(
         self,
         messages: List[Dict],
         temperature: float = 0.7,
         max_tokens: int = 2500
     ) -> Optional[str]:
         """
-        底层请求逻辑：Chat with OpenAI-compatible API
+        底层请求逻辑：路由到最健康的供应商，失败时转给其他供应商
         """
-        if not self.api_key:
+        from llm_router import LLMUnavailable
+
+        if not self.router.providers:
             logger.error("API Key is missing.")
             return None
-
         try:
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {self.api_key}",
-                # 额外添加 User-Agent 避免被 WAF 拦截
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
-            }
-            
-            payload = {
-                "model": self.model,
-                "messages": messages,
-                "temperature": temperature,
-                "max_tokens": max_tokens
-            }
-            
-            api_endpoint = f"{self.base_url}/chat/completions"
-            logger.info(f"Calling API: {api_endpoint} (model: {self.model})")
-            
-            max_retries = 3
-            for attempt in range(max_retries):
-                try:
-                    response = requests.post(
-                        api_endpoint,
-                        headers=headers,
-                        json=payload,
-                        timeout=60,
-                        verify=False  # 对应你需求中的禁用 SSL 验证
-                    )
-                    
-                    if response.status_code == 200:
-                        result = response.json()
-                        return result['choices'][0]['message']['content'].strip()
-                    
-                    elif response.status_code == 429:
-                        wait_time = (2 ** attempt) + random.uniform(0, 1)
-                        logger.warning(f"Rate limited, retrying in {wait_time:.1f}s...")
-                        time.sleep(wait_time)
-                        continue
-                    
-                    else:
-                        error_detail = response.text
-                        logger.error(f"API Error {response.status_code}: {error_detail}")
-                        return f"Error: {response.status_code} - {error_detail}"
-
-                except requests.RequestException as req_err:
-                    if attempt < max_retries - 1:
-                        time.sleep((2 ** attempt) + 1)
-                        continue
-                    logger.error(f"Request failed: {req_err}")
-                    return f"Request Error: {str(req_err)}"
-            
-            return None
-
-        except Exception as e:
-            logger.error(f"Unexpected error: {e}")
+            completion = self.router.complete(messages, temperature=temperature, max_tokens=max_tokens)
+        except LLMUnavailable as e:
+            logger.error(f"All LLM providers failed: {e}")
             return None
+        token_meter.record(completion.tokens)
+        return completion.text
 
+    @timed("llm")
     def generate_analysis(self, prompt: str) -> str:
         """生成AI分析文本（业务逻辑层）"""
-        if not self.api_key:
-            return "AI分析功能需要配置API Key。"
+        if not self.router.providers:
+            return NO_API_KEY_TEXT
 
         messages = [
             {"role": "system", "content": "你是一名专业的长期价值投资分析师，专注于客观分析和风险评估，从不给出买卖建议或目标价。"},
             {"role": "user", "content": prompt}
         ]
         
-        # 调用上面替换的请求方法
-        result = self.chat_with_openai(
-            messages=messages,
-            temperature=0.7,
-            max_tokens=500  # 根据业务调整
-        )
+        with inflight_calls.track():
+            result = self.chat(
+                messages=messages,
+                temperature=0.7,
+                max_tokens=500  # 根据业务调整
+            )
         
         if result:
             return result
-        return "AI分析生成失败，请检查后端日志。"
+        return GENERATION_FAILED_TEXT
 
     def parse_comprehensive_analysis(self, text: str) -> Dict[str, Optional[str]]:
         """解析综合AI分析的输出（保持原样）"""
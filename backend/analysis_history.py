@@ -0,0 +1,154 @@
+"""AI分析版本历史 - 压缩存储、内容哈希去重与当前版本指针
+
+每次生成（单季度或综合）都在 ai_analysis_versions 追加一个版本，热表行的
+current_version_id 指向它，热表中的 analysis_text 仍是当前文本，因此详情页等热读取
+路径不变。历史文本按 zstd（安装了 zstandard 时）或 zlib 压缩（压缩无收益的短文本存原文），
+编码方式逐行记录，读取时按行解压；同一对象再次生成出相同内容（标签与依据季度也相同）时复用已有版本，只移动指针。
+
+在本功能之前生成的分析没有版本记录：首次写入新版本前，先把热表中的现有文本存为
+一个版本，历史从那里开始。
+"""
+import zlib
+import hashlib
+from typing import Optional, List, Dict, Any
+from sqlalchemy.orm import Session
+from sqlalchemy import desc
+import models
+
+try:
+    import zstandard
+except ImportError:  # 未安装 zstandard 时使用标准库 zlib
+    zstandard = None
+
+ZSTD_LEVEL = 10
+ZLIB_LEVEL = 9
+
+# 版本列表只读取这些列，不加载文本
+SUMMARY_COLUMNS = (
+    "id", "kind", "company_id", "quarter_id", "content_hash", "codec",
+    "raw_size", "stored_size", "main_label", "risk_label", "based_quarters", "created_at",
+)
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def compress(text: str) -> tuple:
+    """返回 (codec, 压缩后的字节)"""
+    raw = text.encode("utf-8")
+    if zstandard is not None:
+        codec, blob = "zstd", zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(raw)
+    else:
+        codec, blob = "zlib", zlib.compress(raw, ZLIB_LEVEL)
+    # 很短的文本压缩后反而更大，直接存原文
+    if len(blob) >= len(raw):
+        return "raw", raw
+    return codec, blob
+
+
+def decompress(codec: str, blob: bytes) -> str:
+    if codec == "raw":
+        return bytes(blob).decode("utf-8")
+    if codec == "zlib":
+        return zlib.decompress(blob).decode("utf-8")
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read zstd-compressed analysis versions")
+        return zstandard.ZstdDecompressor().decompress(blob).decode("utf-8")
+    raise ValueError(f"unknown codec: {codec}")
+
+
+def record_version(
+    db: Session,
+    kind: str,
+    company_id: int,
+    quarter_id: Optional[int],
+    text: str,
+    current=None,
+    main_label: Optional[str] = None,
+    risk_label: Optional[str] = None,
+    based_quarters: Optional[List[str]] = None,
+) -> models.AIAnalysisVersion:
+    """追加一个版本（同一对象内容相同时复用已有版本）并返回，不提交
+
+    current 为对应的热表行（可为 None）；它尚无版本指针但已有文本时，先把现有文本存为一个版本。
+    """
+    if current is not None and current.current_version_id is None and current.analysis_text:
+        _find_or_add(
+            db, kind, company_id, quarter_id, current.analysis_text,
+            getattr(current, "main_label", None), getattr(current, "risk_label", None),
+            getattr(current, "based_quarters", None)
+        )
+    return _find_or_add(db, kind, company_id, quarter_id, text, main_label, risk_label, based_quarters)
+
+
+def _find_or_add(db: Session, kind: str, company_id: int, quarter_id: Optional[int], text: str,
+                 main_label: Optional[str], risk_label: Optional[str],
+                 based_quarters: Optional[List[str]]) -> models.AIAnalysisVersion:
+    version_model = models.AIAnalysisVersion
+    digest = content_hash(text)
+    candidates = db.query(version_model)\
+        .filter(
+            version_model.company_id == company_id,
+            version_model.kind == kind,
+            version_model.quarter_id == quarter_id if quarter_id is not None else version_model.quarter_id.is_(None),
+            version_model.content_hash == digest,
+            version_model.main_label.is_not_distinct_from(main_label),
+            version_model.risk_label.is_not_distinct_from(risk_label)
+        )\
+        .order_by(desc(version_model.id))\
+        .all()
+    # 依据季度不同的同文版本要单独保留；数组列在 SQLite 上存为 JSON，在 Python 中比较
+    for existing in candidates:
+        if list(existing.based_quarters or []) == list(based_quarters or []):
+            return existing
+
+    codec, blob = compress(text)
+    version = version_model(
+        kind=kind,
+        company_id=company_id,
+        quarter_id=quarter_id,
+        content_hash=digest,
+        codec=codec,
+        text_blob=blob,
+        raw_size=len(text.encode("utf-8")),
+        stored_size=len(blob),
+        main_label=main_label,
+        risk_label=risk_label,
+        based_quarters=based_quarters,
+    )
+    db.add(version)
+    db.flush()
+    return version
+
+
+def list_versions(db: Session, kind: str, company_id: int, quarter_id: Optional[int] = None,
+                  current_version_id: Optional[int] = None) -> List[Dict[str, Any]]:
+    """版本列表（新到旧），只含元数据"""
+    version_model = models.AIAnalysisVersion
+    query = db.query(*[getattr(version_model, name) for name in SUMMARY_COLUMNS])\
+        .filter(version_model.company_id == company_id, version_model.kind == kind)
+    if quarter_id is not None:
+        query = query.filter(version_model.quarter_id == quarter_id)
+    return [
+        {**row._asdict(), "is_current": row.id == current_version_id}
+        for row in query.order_by(desc(version_model.id)).all()
+    ]
+
+
+def get_version(db: Session, kind: str, version_id: int, company_id: int,
+                quarter_id: Optional[int] = None, current_version_id: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """读取并解压一个版本；不属于该对象时返回 None"""
+    version_model = models.AIAnalysisVersion
+    query = db.query(version_model)\
+        .filter(version_model.id == version_id, version_model.company_id == company_id, version_model.kind == kind)
+    if quarter_id is not None:
+        query = query.filter(version_model.quarter_id == quarter_id)
+    version = query.first()
+    if version is None:
+        return None
+    result = {name: getattr(version, name) for name in SUMMARY_COLUMNS}
+    result["is_current"] = version.id == current_version_id
+    result["analysis_text"] = decompress(version.codec, version.text_blob)
+    return result
@@ -0,0 +1,6 @@
+"""性能基准 - 分析引擎、Prompt生成与crud读取路径
+
+在 backend 目录下运行：
+    python -m benchmarks.run --database-url postgresql://... --sizes 20x8,200x12 --output bench.json
+    python -m benchmarks.compare base.json head.json
+"""
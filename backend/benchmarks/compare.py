@@ -0,0 +1,54 @@
+"""对比两次基准结果
+
+    python -m benchmarks.compare base.json head.json --threshold 10
+
+任一基准的 mean_ms 变慢超过阈值（百分比）或SQL条数增加时，以退出码 1 结束。
+"""
+import argparse
+import json
+import sys
+
+
+def load(path: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        report = json.load(f)
+    return {
+        (item["benchmark"], json.dumps(item.get("params", {}), sort_keys=True)): item
+        for item in report["results"]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比两次基准结果")
+    parser.add_argument("base")
+    parser.add_argument("head")
+    parser.add_argument("--threshold", type=float, default=10.0, help="判定为回退的变慢百分比")
+    args = parser.parse_args()
+
+    base, head = load(args.base), load(args.head)
+    regressions = 0
+
+    print(f"{'benchmark':<36} {'params':<40} {'base ms':>12} {'head ms':>12} {'delta':>9}  queries")
+    for key in sorted(base.keys() & head.keys()):
+        old, new = base[key], head[key]
+        delta = (new["mean_ms"] - old["mean_ms"]) / old["mean_ms"] * 100 if old["mean_ms"] else 0.0
+
+        queries = ""
+        if "queries_per_call" in old and "queries_per_call" in new:
+            queries = f"{old['queries_per_call']} -> {new['queries_per_call']}"
+
+        flag = ""
+        if key[0] != "seed" and (delta > args.threshold or new.get("queries_per_call", 0) > old.get("queries_per_call", 0)):
+            flag = "  REGRESSION"
+            regressions += 1
+
+        print(f"{key[0]:<36} {key[1]:<40} {old['mean_ms']:>12.4f} {new['mean_ms']:>12.4f} {delta:>+8.1f}%  {queries}{flag}")
+
+    for key in sorted(base.keys() ^ head.keys()):
+        print(f"{key[0]:<36} {key[1]:<40} 仅存在于{'base' if key in base else 'head'}")
+
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
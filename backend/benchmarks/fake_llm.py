@@ -0,0 +1,125 @@
+"""本地假LLM服务 - 负载测试时代替真实供应商，按配置的延迟与错误率返回固定文本
+
+同时提供 OpenAI 兼容的 /chat/completions 与 Anthropic 的 /messages，返回 usage 字段，
+token 预算与用量统计照常工作。可单独运行：
+    python -m benchmarks.fake_llm --port 9100 --latency 1.5 --jitter 0.5
+然后把 AI_SERVICE_URL 指向 http://127.0.0.1:9100/v1。
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+# 不从 benchmarks.seed 导入：seed 依赖 models，单独运行时不需要数据库配置
+RESPONSE_TEXT = (
+    "公司当前处于增长兑现阶段，ROIC 持续高于 WACC，资本开支占收入比例有所回落，"
+    "自由现金流质量改善。需关注毛利率变化与新业务投入节奏，主要风险在于行业竞争加剧。"
+)
+
+
+class FakeLLMServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 1.0,
+                 jitter: float = 0.0, error_rate: float = 0.0, seed: Optional[int] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.requests = 0
+        self.errors = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "FakeLLMServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-llm", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _next_call(self) -> tuple:
+        """返回 (延迟秒数, 是否返回错误)"""
+        with self._lock:
+            self.requests += 1
+            delay = max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter))
+            failed = self._rng.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        return delay, failed
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                try:
+                    payload = json.loads(self.rfile.read(length) or b"{}")
+                except ValueError:
+                    payload = {}
+                delay, failed = server._next_call()
+                time.sleep(delay)
+
+                if failed:
+                    return self._reply(503, {"error": {"message": "fake upstream error"}})
+                prompt_tokens = sum(len(str(m.get("content", ""))) for m in payload.get("messages", [])) // 2
+                completion_tokens = len(RESPONSE_TEXT) // 2
+                if self.path.rstrip("/").endswith("/messages"):
+                    return self._reply(200, {
+                        "content": [{"type": "text", "text": RESPONSE_TEXT}],
+                        "usage": {"input_tokens": prompt_tokens, "output_tokens": completion_tokens},
+                    })
+                if self.path.rstrip("/").endswith("/chat/completions"):
+                    return self._reply(200, {
+                        "choices": [{"message": {"role": "assistant", "content": RESPONSE_TEXT}}],
+                        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens},
+                    })
+                self._reply(404, {"error": {"message": f"unknown path {self.path}"}})
+
+            def _reply(self, status: int, body: dict):
+                data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地假LLM服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", type=float, default=1.0, help="每次调用的平均延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="延迟在 ±jitter 秒内均匀抖动")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 503 的比例")
+    args = parser.parse_args()
+
+    server = FakeLLMServer(args.host, args.port, args.latency, args.jitter, args.error_rate).start()
+    print(f"Fake LLM listening on {server.base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,390 @@
+"""端到端负载测试 - 合成数据 + 假LLM + 真实应用进程，按目标并发驱动读写混合场景
+
+示例：
+    python -m benchmarks.load --companies 50 --quarters 8 --concurrency 8 --duration 30
+    python -m benchmarks.load --database-url postgresql://user:pw@localhost/eie_bench \
+        --companies 200 --quarters 12 --concurrency 32 --duration 60 \
+        --mix home=40,detail=30,series=10,screen=5,upsert=15 --llm-latency 1.5 --output load.json
+
+流程：重建表结构并写入 公司数×季度数 的合成数据 → 启动本地假LLM服务 → 以 uvicorn 子进程
+启动应用（AI_SERVICE_URL 指向假LLM）→ concurrency 个客户端各自循环发请求（闭环，每个客户端
+同一时间只有一个请求）→ 输出各场景的 p50/p95/p99 与吞吐，以及连接池使用情况（定期抓取
+/metrics 中的 eie_db_pool_*）。warmup 秒内的请求不计入结果。
+
+未指定数据库时使用临时目录下的 SQLite 文件库（WAL），不需要数据库服务即可运行；SQLite
+同一时间只有一个写事务，写入比例高时的数字不代表 PostgreSQL 部署。
+
+--app-url 指向已运行的应用时只驱动请求，不重建数据、不启动假LLM与应用进程。多 worker
+时 /metrics 每次只反映应答该次请求的 worker，连接池数据仅供参考。
+
+注意：会在目标库中重建表结构，请使用专用的基准数据库。结果中的 results 与
+benchmarks.compare 兼容，可对比两次运行的平均耗时。
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+import httpx
+
+from benchmarks.fake_llm import FakeLLMServer
+from benchmarks.run import git_commit
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+METRIC_LINE = re.compile(r"^(eie_db_pool_\w+)(?:\{[^}]*\})? ([-+0-9.eE]+)$")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Equity Insight Engine 端到端负载测试")
+    parser.add_argument("--database-url", default=os.environ.get("BENCH_DATABASE_URL"),
+                        help="专用基准数据库（默认读取 BENCH_DATABASE_URL，均未设置时使用临时 SQLite 文件库）")
+    parser.add_argument("--app-url", help="驱动已运行的应用（不重建数据、不启动应用与假LLM）")
+    parser.add_argument("--companies", type=int, default=200)
+    parser.add_argument("--quarters", type=int, default=12)
+    parser.add_argument("--skip-seed", action="store_true", help="沿用库中已有数据")
+    parser.add_argument("--concurrency", type=int, default=16, help="同时发请求的客户端数")
+    parser.add_argument("--duration", type=float, default=60, help="计入结果的压测秒数")
+    parser.add_argument("--warmup", type=float, default=5, help="开始计入结果前的预热秒数")
+    parser.add_argument("--mix", default="home=40,detail=30,series=10,screen=5,upsert=15",
+                        help="场景及权重，可选 " + ",".join(sorted(SCENARIOS)))
+    parser.add_argument("--llm-latency", type=float, default=1.5, help="假LLM每次调用的平均延迟（秒）")
+    parser.add_argument("--llm-jitter", type=float, default=0.5)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--workers", type=int, default=1, help="应用的 uvicorn worker 数")
+    parser.add_argument("--port", type=int, default=8765, help="应用监听端口")
+    parser.add_argument("--pool-size", type=int, help="覆盖 DB_POOL_SIZE")
+    parser.add_argument("--max-overflow", type=int, help="覆盖 DB_MAX_OVERFLOW")
+    parser.add_argument("--request-timeout", type=float, default=120)
+    parser.add_argument("--sample-interval", type=float, default=0.5, help="抓取 /metrics 的间隔秒数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="结果JSON文件路径（默认输出到stdout）")
+    return parser.parse_args()
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    mix = {}
+    for part in text.split(","):
+        if not part.strip():
+            continue
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise SystemExit(f"未知场景 {name}，可选：{', '.join(sorted(SCENARIOS))}")
+        mix[name] = float(weight or 1)
+    if not mix or sum(mix.values()) <= 0:
+        raise SystemExit("--mix 至少需要一个权重大于 0 的场景")
+    return mix
+
+
+# 场景：(客户端, 随机数, 上下文) → 响应；上下文含 company_ids 与 quarter_labels
+def _home(client: httpx.Client, rng: random.Random, ctx: Dict) -> httpx.Response:
+    return client.get("/api/companies")
+
+
+def _detail(client: httpx.Client, rng: random.Random, ctx: Dict) -> httpx.Response:
+    return client.get(f"/api/companies/{rng.choice(ctx['company_ids'])}")
+
+
+def _series(client: httpx.Client, rng: random.Random, ctx: Dict) -> httpx.Response:
+    return client.get(f"/api/companies/{rng.choice(ctx['company_ids'])}/series")
+
+
+def _screen(client: httpx.Client, rng: random.Random, ctx: Dict) -> httpx.Response:
+    return client.get("/api/screen", params={"q": "roic - wacc > 0", "sort": "-quality_score", "limit": 50})
+
+
+def _upsert(client: httpx.Client, rng: random.Random, ctx: Dict) -> httpx.Response:
+    """改写一个已有季度的指标：触发系统分析、单季度与综合AI生成"""
+    from benchmarks.seed import random_metrics
+    company_id = rng.choice(ctx["company_ids"])
+    label = rng.choice(ctx["quarter_labels"])
+    return client.put(f"/api/companies/{company_id}/quarters/{label}", json=random_metrics(rng))
+
+
+SCENARIOS: Dict[str, Callable[[httpx.Client, random.Random, Dict], httpx.Response]] = {
+    "home": _home,
+    "detail": _detail,
+    "series": _series,
+    "screen": _screen,
+    "upsert": _upsert,
+}
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """最近秩百分位"""
+    index = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def seed_database(args) -> None:
+    from database import Base, engine, SessionLocal
+    from benchmarks.seed import seed_synthetic
+
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        start = time.perf_counter()
+        seed_synthetic(db, args.companies, args.quarters, seed=args.seed)
+        print(f"Seeded {args.companies}x{args.quarters} in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+    finally:
+        db.close()
+    engine.dispose()
+
+
+def start_app(args, llm_url: str) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.update({
+        "DATABASE_URL": args.database_url,
+        "AI_SERVICE_URL": llm_url,
+        "AI_SERVICE_API_KEY": "load-test",
+        "AI_PROVIDERS": "openai",
+        "AI_REFRESH_ENABLED": "false",
+    })
+    if args.pool_size is not None:
+        env["DB_POOL_SIZE"] = str(args.pool_size)
+    if args.max_overflow is not None:
+        env["DB_MAX_OVERFLOW"] = str(args.max_overflow)
+    command = [
+        sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(args.port),
+        "--workers", str(args.workers), "--log-level", "warning", "--no-access-log",
+    ]
+    return subprocess.Popen(command, cwd=BACKEND_DIR, env=env)
+
+
+def wait_ready(base_url: str, process: Optional[subprocess.Popen], timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise SystemExit(f"应用进程已退出（exit code {process.returncode}）")
+        try:
+            if httpx.get(f"{base_url}/", timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise SystemExit(f"应用在 {timeout:.0f}s 内未就绪：{base_url}")
+
+
+def scrape_pool(client: httpx.Client) -> Optional[Dict[str, float]]:
+    try:
+        text = client.get("/metrics").text
+    except httpx.HTTPError:
+        return None
+    values = {}
+    for line in text.splitlines():
+        match = METRIC_LINE.match(line)
+        if match:
+            values[match.group(1)] = float(match.group(2))
+    return values
+
+
+class PoolSampler:
+    """压测期间定期抓取连接池指标"""
+
+    def __init__(self, base_url: str, interval: float):
+        self.base_url = base_url
+        self.interval = interval
+        self.samples: List[Dict[str, float]] = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="pool-sampler", daemon=True)
+
+    def start(self) -> "PoolSampler":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        with httpx.Client(base_url=self.base_url, timeout=10) as client:
+            while not self._stop.wait(self.interval):
+                values = scrape_pool(client)
+                if values:
+                    self.samples.append(values)
+
+    def summary(self) -> Dict:
+        if not self.samples:
+            return {"samples": 0}
+        first, last = self.samples[0], self.samples[-1]
+        in_use = [s.get("eie_db_pool_checked_out", 0.0) for s in self.samples]
+        capacity = last.get("eie_db_pool_capacity")
+        checkouts = last.get("eie_db_pool_checkouts_total", 0.0) - first.get("eie_db_pool_checkouts_total", 0.0)
+        saturated = last.get("eie_db_pool_saturated_checkouts_total", 0.0) \
+            - first.get("eie_db_pool_saturated_checkouts_total", 0.0)
+        mean_in_use = sum(in_use) / len(in_use)
+        return {
+            "samples": len(self.samples),
+            "capacity": capacity,
+            "mean_checked_out": round(mean_in_use, 2),
+            "max_checked_out_sampled": max(in_use),
+            "peak_checked_out": max(s.get("eie_db_pool_checked_out_peak", 0.0) for s in self.samples),
+            "mean_utilization": round(mean_in_use / capacity, 4) if capacity else None,
+            "checkouts": checkouts,
+            "saturated_checkout_share": round(saturated / checkouts, 4) if checkouts else 0.0,
+        }
+
+
+def drive(base_url: str, mix: Dict[str, float], ctx: Dict, args) -> Dict[str, Dict]:
+    """concurrency 个客户端闭环发请求，返回 {场景: {"latencies": [...], "errors": n}}"""
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    start = time.monotonic()
+    measure_from = start + args.warmup
+    stop_at = measure_from + args.duration
+    per_worker: List[Dict[str, Dict]] = []
+
+    def worker(index: int) -> None:
+        rng = random.Random(args.seed * 1000 + index)
+        records = {name: {"latencies": [], "errors": 0, "statuses": {}} for name in names}
+        per_worker.append(records)
+        with httpx.Client(base_url=base_url, timeout=args.request_timeout) as client:
+            while True:
+                now = time.monotonic()
+                if now >= stop_at:
+                    return
+                name = rng.choices(names, weights)[0]
+                began = time.perf_counter()
+                try:
+                    status = SCENARIOS[name](client, rng, ctx).status_code
+                except httpx.HTTPError:
+                    status = None
+                elapsed_ms = (time.perf_counter() - began) * 1000
+                if now < measure_from:
+                    continue
+                record = records[name]
+                record["latencies"].append(elapsed_ms)
+                key = str(status) if status is not None else "transport_error"
+                record["statuses"][key] = record["statuses"].get(key, 0) + 1
+                if status is None or status >= 400:
+                    record["errors"] += 1
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    merged = {name: {"latencies": [], "errors": 0, "statuses": {}} for name in names}
+    for records in per_worker:
+        for name, record in records.items():
+            merged[name]["latencies"] += record["latencies"]
+            merged[name]["errors"] += record["errors"]
+            for status, count in record["statuses"].items():
+                merged[name]["statuses"][status] = merged[name]["statuses"].get(status, 0) + count
+    return merged
+
+
+def summarize_scenario(name: str, record: Dict, args) -> Dict:
+    latencies = sorted(record["latencies"])
+    params = {"concurrency": args.concurrency, "companies": args.companies, "quarters": args.quarters,
+              "llm_latency": args.llm_latency, "workers": args.workers}
+    if not latencies:
+        return {"benchmark": f"load.{name}", "params": params, "requests": 0, "mean_ms": 0.0}
+    return {
+        "benchmark": f"load.{name}",
+        "params": params,
+        "requests": len(latencies),
+        "errors": record["errors"],
+        "statuses": record["statuses"],
+        "rps": round(len(latencies) / args.duration, 2),
+        "mean_ms": round(sum(latencies) / len(latencies), 3),
+        "p50_ms": round(percentile(latencies, 0.50), 3),
+        "p95_ms": round(percentile(latencies, 0.95), 3),
+        "p99_ms": round(percentile(latencies, 0.99), 3),
+        "max_ms": round(latencies[-1], 3),
+    }
+
+
+def print_table(results: List[Dict], pool: Dict) -> None:
+    print(f"{'scenario':<16} {'requests':>9} {'errors':>7} {'rps':>9} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10}",
+          file=sys.stderr)
+    for item in results:
+        if not item["requests"]:
+            print(f"{item['benchmark']:<16} {0:>9}", file=sys.stderr)
+            continue
+        print(f"{item['benchmark']:<16} {item['requests']:>9} {item['errors']:>7} {item['rps']:>9.1f} "
+              f"{item['p50_ms']:>10.1f} {item['p95_ms']:>10.1f} {item['p99_ms']:>10.1f}", file=sys.stderr)
+    if pool.get("samples"):
+        print(f"db pool: capacity={pool['capacity']} mean_checked_out={pool['mean_checked_out']} "
+              f"peak={pool['peak_checked_out']} saturated_checkouts={pool['saturated_checkout_share']:.1%}",
+              file=sys.stderr)
+
+
+def main():
+    args = parse_args()
+    mix = parse_mix(args.mix)
+    if not args.app_url and not args.database_url:
+        # 应用子进程与本进程共用同一个库，不能用内存库
+        args.database_url = "sqlite:///" + os.path.join(tempfile.gettempdir(), "eie_load.db")
+    # config.Settings 要求 DATABASE_URL，必须在导入业务模块（含 benchmarks.seed）之前设置
+    os.environ["DATABASE_URL"] = args.database_url or os.environ.get("DATABASE_URL", "sqlite://")
+
+    llm, app = None, None
+    base_url = (args.app_url or f"http://127.0.0.1:{args.port}").rstrip("/")
+    try:
+        if not args.app_url:
+            if not args.skip_seed:
+                seed_database(args)
+            llm = FakeLLMServer(latency=args.llm_latency, jitter=args.llm_jitter,
+                                error_rate=args.llm_error_rate, seed=args.seed).start()
+            app = start_app(args, llm.base_url)
+        wait_ready(base_url, app)
+
+        from benchmarks.seed import quarter_labels
+        companies = httpx.get(f"{base_url}/api/companies", timeout=args.request_timeout).json()
+        if not companies:
+            sys.exit("应用中没有公司数据")
+        ctx = {"company_ids": [c["id"] for c in companies], "quarter_labels": quarter_labels(args.quarters)}
+
+        sampler = PoolSampler(base_url, args.sample_interval).start()
+        records = drive(base_url, mix, ctx, args)
+        sampler.stop()
+    finally:
+        if app is not None:
+            app.terminate()
+            try:
+                app.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                app.kill()
+        if llm is not None:
+            llm.stop()
+
+    results = [summarize_scenario(name, record, args) for name, record in records.items()]
+    pool = sampler.summary()
+    print_table(results, pool)
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "database": args.database_url.split("://")[0] if args.database_url else None,
+            "args": vars(args) | {"database_url": None},
+            "llm_calls": llm.requests if llm is not None else None,
+        },
+        "results": results,
+        "db_pool": pool,
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
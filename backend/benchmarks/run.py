@@ -0,0 +1,285 @@
+"""基准测试入口 - 结果输出为JSON，便于不同提交间对比
+
+示例：
+    python -m benchmarks.run --sizes 20x8,200x12 --output bench.json
+    python -m benchmarks.run --database-url postgresql://user:pw@localhost/eie_bench --output bench.json
+
+未指定数据库时crud读取基准在进程内的 SQLite 内存库上运行，不需要数据库服务；
+与线上一致的数字请使用 PostgreSQL。
+注意：crud读取基准会在目标库中重建表结构，请使用专用的基准数据库。
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Equity Insight Engine 基准测试")
+    parser.add_argument("--database-url", default=os.environ.get("BENCH_DATABASE_URL"),
+                        help="专用基准数据库（默认读取 BENCH_DATABASE_URL，均未设置时使用 SQLite 内存库）")
+    parser.add_argument("--sizes", default="20x8,200x12",
+                        help="crud读取基准的数据规模，格式 公司数x季度数，逗号分隔")
+    parser.add_argument("--engine-batch", type=int, default=1000, help="引擎基准每轮调用次数")
+    parser.add_argument("--rounds", type=int, default=30, help="每项基准的采样轮数")
+    parser.add_argument("--read-iterations", type=int, default=20, help="crud读取基准每项调用次数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--skip-db", action="store_true", help="只运行纯计算基准（引擎、Prompt）")
+    parser.add_argument("--output", help="结果JSON文件路径（默认输出到stdout）")
+    return parser.parse_args()
+
+
+def parse_sizes(text: str) -> List[tuple]:
+    sizes = []
+    for part in text.split(","):
+        companies, quarters = part.lower().split("x")
+        sizes.append((int(companies), int(quarters)))
+    return sizes
+
+
+def summarize(samples_ms: List[float], per_sample_calls: int = 1) -> Dict:
+    """汇总采样耗时（毫秒），per_sample_calls>1 时换算为单次调用耗时"""
+    per_call = sorted(s / per_sample_calls for s in samples_ms)
+    mean = statistics.fmean(per_call)
+    return {
+        "rounds": len(per_call),
+        "calls_per_round": per_sample_calls,
+        "mean_ms": round(mean, 6),
+        "p50_ms": round(per_call[len(per_call) // 2], 6),
+        "p95_ms": round(per_call[min(len(per_call) - 1, int(len(per_call) * 0.95))], 6),
+        "min_ms": round(per_call[0], 6),
+        "ops_per_sec": round(1000.0 / mean, 2) if mean else None,
+    }
+
+
+def measure(fn: Callable[[], None], rounds: int, per_sample_calls: int = 1, warmup: int = 2) -> Dict:
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return summarize(samples, per_sample_calls)
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def bench_engine(args, rng: random.Random) -> List[Dict]:
+    """normalize 与 SystemAnalysisEngine.analyze 的单次调用耗时"""
+    from system_analysis_engine import SystemAnalysisEngine, normalize
+    from quarter_metrics import QuarterMetrics
+    from benchmarks.seed import COMPANY_TYPES, random_metrics
+
+    results = []
+    values = [rng.uniform(-10, 120) for _ in range(args.engine_batch)]
+
+    def run_normalize():
+        for value in values:
+            normalize(value, 5, 15, 30)
+
+    results.append({"benchmark": "engine.normalize", "params": {},
+                    **measure(run_normalize, args.rounds, len(values))})
+
+    for company_type in COMPANY_TYPES:
+        inputs = [
+            (QuarterMetrics.from_mapping(random_metrics(rng)), QuarterMetrics.from_mapping(random_metrics(rng)))
+            for _ in range(args.engine_batch)
+        ]
+
+        def run_analyze(company_type=company_type, inputs=inputs):
+            for current, previous in inputs:
+                SystemAnalysisEngine.analyze(company_type, current, previous)
+
+        results.append({"benchmark": "engine.analyze", "params": {"company_type": company_type.value},
+                        **measure(run_analyze, args.rounds, len(inputs))})
+    return results
+
+
+def bench_prompts(args, rng: random.Random) -> List[Dict]:
+    """AIPromptGenerator 单季度与综合Prompt生成耗时"""
+    from ai_prompt_generator import AIPromptGenerator
+    from quarter_metrics import QuarterMetrics
+    from benchmarks.seed import COMPANY_TYPES, METRIC_RANGES, SAMPLE_AI_TEXT, quarter_labels
+
+    results = []
+    for company_type in COMPANY_TYPES:
+        inputs = [
+            QuarterMetrics(**{name: round(rng.uniform(low, high), 2) for name, (low, high) in METRIC_RANGES.items()})
+            for _ in range(args.engine_batch)
+        ]
+
+        def run_quarter_prompt(company_type=company_type, inputs=inputs):
+            for data in inputs:
+                AIPromptGenerator.generate_quarter_prompt(
+                    company_name="Synthetic", company_type=company_type, quarter="2025-Q4",
+                    quarter_data=data, labels=["基本面走弱"]
+                )
+
+        results.append({"benchmark": "prompt.quarter", "params": {"company_type": company_type.value},
+                        **measure(run_quarter_prompt, args.rounds, len(inputs))})
+
+    quarters_summary = [
+        {"quarter": label, "system_summary": "质量得分：80.0/100\n估值状态：55.0/100", "ai_analysis": SAMPLE_AI_TEXT}
+        for label in quarter_labels(4)[::-1]
+    ]
+
+    def run_comprehensive_prompt():
+        for _ in range(args.engine_batch):
+            AIPromptGenerator.generate_comprehensive_prompt(
+                ticker="SYN", company_name="Synthetic", company_type=COMPANY_TYPES[0],
+                quarters_summary=quarters_summary
+            )
+
+    results.append({"benchmark": "prompt.comprehensive", "params": {},
+                    **measure(run_comprehensive_prompt, args.rounds, args.engine_batch)})
+    return results
+
+
+def bench_serialization(args, rng: random.Random) -> List[Dict]:
+    """详情页响应编码：response_model 校验 + jsonable_encoder（原路径）对比 FastJSONResponse"""
+    import json
+    from fastapi.encoders import jsonable_encoder
+    import schemas
+    import serialization
+    from benchmarks.seed import COMPANY_TYPES, METRIC_RANGES, SAMPLE_AI_TEXT, quarter_labels
+
+    now = datetime(2025, 1, 1)
+    results = []
+    for quarters in (8, 40):
+        detail = {
+            "id": 1, "ticker": "SYN", "company_name": "Synthetic", "company_type": COMPANY_TYPES[0],
+            "created_at": now, "updated_at": now,
+            "quarters": [
+                {
+                    "quarter": label, "id": i, "company_id": 1, "created_at": now,
+                    **{name: round(rng.uniform(low, high), 2) for name, (low, high) in METRIC_RANGES.items()},
+                    "system_analysis": {
+                        "id": i, "quarter_id": i, "quality_score": 80.0, "valuation_score": 55.0,
+                        "trend_score": 60.0, "labels": ["高质量"], "system_summary": "质量得分：80.0/100",
+                        "created_at": now,
+                    },
+                    "ai_analysis": {"id": i, "quarter_id": i, "analysis_text": SAMPLE_AI_TEXT, "created_at": now},
+                }
+                for i, label in enumerate(quarter_labels(quarters)[::-1], start=1)
+            ],
+            "comprehensive_ai": None,
+        }
+
+        def run_response_model(detail=detail):
+            validated = schemas.CompanyDetailResponse.model_validate(detail)
+            json.dumps(jsonable_encoder(validated), ensure_ascii=False).encode("utf-8")
+
+        def run_fast_json(detail=detail):
+            serialization.dumps(detail)
+
+        params = {"quarters": quarters}
+        results.append({"benchmark": "serialize.response_model", "params": params,
+                        **measure(run_response_model, args.rounds)})
+        results.append({"benchmark": "serialize.fast_json", "params": params | {"orjson": serialization.orjson is not None},
+                        **measure(run_fast_json, args.rounds)})
+    return results
+
+
+def bench_crud_reads(args, rng: random.Random) -> List[Dict]:
+    """首页与详情页读取路径的耗时与每次调用的SQL条数"""
+    from sqlalchemy import event
+    import crud
+    # 使用应用的引擎（DATABASE_URL 已在 main 中设置），SQLite 的 PRAGMA 与线上配置一致
+    from database import Base, engine, SessionLocal as Session
+    from benchmarks.seed import seed_synthetic
+
+    query_count = {"n": 0}
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def count_queries(*_):
+        query_count["n"] += 1
+
+    def timed_read(fn: Callable, calls: List) -> Dict:
+        samples, queries = [], []
+        for call_args in calls:
+            db = Session()
+            try:
+                before = query_count["n"]
+                start = time.perf_counter()
+                fn(db, *call_args)
+                samples.append((time.perf_counter() - start) * 1000)
+                queries.append(query_count["n"] - before)
+            finally:
+                db.close()
+        return {**summarize(samples), "queries_per_call": round(statistics.fmean(queries), 2)}
+
+    results = []
+    for companies, quarters in parse_sizes(args.sizes):
+        Base.metadata.drop_all(bind=engine)
+        Base.metadata.create_all(bind=engine)
+
+        db = Session()
+        start = time.perf_counter()
+        company_ids = seed_synthetic(db, companies, quarters, seed=args.seed)
+        seed_ms = (time.perf_counter() - start) * 1000
+        db.close()
+
+        params = {"companies": companies, "quarters": quarters}
+        results.append({"benchmark": "seed", "params": params, "mean_ms": round(seed_ms, 3)})
+
+        # 预热连接池
+        timed_read(crud.get_companies_with_summary, [()])
+
+        results.append({"benchmark": "crud.get_companies_with_summary", "params": params,
+                        **timed_read(crud.get_companies_with_summary, [()] * args.read_iterations)})
+
+        detail_ids = [(rng.choice(company_ids),) for _ in range(args.read_iterations)]
+        results.append({"benchmark": "crud.get_company_detail", "params": params,
+                        **timed_read(crud.get_company_detail, detail_ids)})
+
+    Base.metadata.drop_all(bind=engine)
+    engine.dispose()
+    return results
+
+
+def main():
+    args = parse_args()
+    args.database_url = args.database_url or "sqlite://"
+
+    # config.Settings 要求 DATABASE_URL，必须在导入业务模块之前设置
+    os.environ["DATABASE_URL"] = args.database_url
+
+    rng = random.Random(args.seed)
+    results = bench_engine(args, rng) + bench_prompts(args, rng) + bench_serialization(args, rng)
+    if not args.skip_db:
+        results += bench_crud_reads(args, rng)
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "database": None if args.skip_db else args.database_url.split("://")[0],
+            "args": vars(args) | {"database_url": None},
+        },
+        "results": results,
+    }
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""合成数据生成 - 按给定规模批量写入公司、季度及分析结果"""
+import random
+from typing import List
+from sqlalchemy.orm import Session
+import models
+from system_analysis_engine import SystemAnalysisEngine
+
+COMPANY_TYPES = list(models.CompanyType)
+
+# 各指标的合成取值范围（与引擎normalize区间大致对应）
+METRIC_RANGES = {
+    "pe": (5, 80),
+    "pb": (0.5, 30),
+    "ps": (0.3, 25),
+    "roe": (0.02, 0.35),
+    "roic": (0.01, 0.40),
+    "wacc": (0.05, 0.12),
+    "revenue_yoy": (-0.2, 0.6),
+    "gross_margin": (0.1, 0.85),
+    "fcf_margin": (-0.1, 0.4),
+    "capex_ratio": (0.02, 0.3),
+}
+
+SAMPLE_AI_TEXT = (
+    "公司当前处于增长兑现阶段，ROIC 持续高于 WACC，资本开支占收入比例有所回落，"
+    "自由现金流质量改善。需关注毛利率变化与新业务投入节奏，主要风险在于行业竞争加剧。"
+)
+
+
+def quarter_labels(count: int, last_year: int = 2025) -> List[str]:
+    """生成按时间升序的季度标签，最后一个为 last_year-Q4"""
+    labels = []
+    year, q = last_year, 4
+    for _ in range(count):
+        labels.append(f"{year}-Q{q}")
+        q -= 1
+        if q == 0:
+            year, q = year - 1, 4
+    return labels[::-1]
+
+
+def random_metrics(rng: random.Random) -> dict:
+    return {
+        name: round(rng.uniform(low, high), 2) if rng.random() > 0.05 else None
+        for name, (low, high) in METRIC_RANGES.items()
+    }
+
+
+def seed_synthetic(db: Session, companies: int, quarters: int, seed: int = 0, ticker_prefix: str = "BM") -> List[int]:
+    """写入 companies 家公司、每家 quarters 个季度的合成数据，返回公司ID列表"""
+    rng = random.Random(seed)
+    labels = quarter_labels(quarters)
+    company_ids = []
+
+    for i in range(companies):
+        company_type = COMPANY_TYPES[i % len(COMPANY_TYPES)]
+        company = models.Company(
+            ticker=f"{ticker_prefix}{i:05d}",
+            company_name=f"Synthetic Company {i}",
+            company_type=company_type
+        )
+        db.add(company)
+        db.flush()
+        company_ids.append(company.id)
+
+        previous = None
+        for label in labels:
+            data = random_metrics(rng)
+            quarter = models.Quarter(company_id=company.id, quarter=label, **data)
+            db.add(quarter)
+            db.flush()
+
+            result = SystemAnalysisEngine.analyze(company_type, data, previous)
+            db.add(models.SystemAnalysis(
+                quarter_id=quarter.id,
+                quality_score=result["quality_score"],
+                valuation_score=result["valuation_score"],
+                trend_score=result["trend_score"],
+                labels=result["labels"],
+                system_summary=result["system_summary"]
+            ))
+            db.add(models.QuarterAIAnalysis(quarter_id=quarter.id, analysis_text=SAMPLE_AI_TEXT))
+            previous = data
+
+        if quarters >= 4:
+            db.add(models.CompanyComprehensiveAI(
+                company_id=company.id,
+                analysis_text=SAMPLE_AI_TEXT,
+                main_label="高质量成长",
+                risk_label="成长放缓风险",
+                based_quarters=labels[-4:][::-1]
+            ))
+
+    db.commit()
+    return company_ids
@@ -0,0 +1,165 @@
+"""变更日志（事务性 outbox）- /api/changes 的增量同步
+
+crud 的每个写入在修改业务表的同一事务中追加变更记录，写入回滚时记录一起回滚，
+提交后记录必然存在，不会出现数据已变而日志缺失的情况。覆盖的实体：
+- company：created / updated / deleted（删除公司时其季度另记 quarter deleted）
+- quarter：created / updated / deleted（季度删除时其系统分析与AI分析随之删除）
+- system_analysis：upserted（含被连带重算的后继季度）
+- quarter_ai、comprehensive_ai：upserted，data 中带历史版本号，文本从版本接口读取
+
+游标：按自增 id 读取在 PostgreSQL 上不可靠，先分配 id 的事务可能后提交，消费者读过
+更大的 id 后就会漏掉它。因此每条记录同时保存写入事务号（txid_current()），按
+(txid, id) 排序，并且只返回事务号小于当前快照 xmin 的记录：这些事务均已结束，此后
+提交的事务号都不会更小，游标之前的位置不会再出现新记录。代价是长事务进行期间，
+其后的记录要等它结束才可读。其他数据库的写入串行提交，txid 记为 0，按 id 排序。
+
+游标为 "txid.id" 形式的字符串，消费者原样传回即可；空游标从头读取，cursor=latest
+只返回当前末尾的游标（全量导出前先记下它，导出后从该游标增量拉取）。
+清理过期记录（保留 CHANGE_LOG_RETENTION_DAYS 天）：python manage.py prune-changes
+"""
+import json
+from datetime import timedelta
+from typing import Optional, Dict, Any, List, Tuple
+from sqlalchemy.orm import Session
+from sqlalchemy import func, or_, and_, desc
+import models
+import serialization
+
+ENTITIES = ("company", "quarter", "system_analysis", "quarter_ai", "comprehensive_ai")
+LATEST = "latest"
+MAX_LIMIT = 1000
+
+
+class ChangeCursorError(ValueError):
+    """游标或过滤参数错误"""
+
+
+def _is_postgres(db: Session) -> bool:
+    return db.get_bind().dialect.name == "postgresql"
+
+
+def record(
+    db: Session,
+    entity: str,
+    action: str,
+    entity_id: int,
+    company_id: Optional[int],
+    quarter_id: Optional[int] = None,
+    data: Optional[Dict[str, Any]] = None
+) -> None:
+    """在当前事务中追加一条变更记录（不提交）"""
+    values = {
+        "entity": entity, "action": action, "entity_id": entity_id,
+        "company_id": company_id, "quarter_id": quarter_id,
+        # 快照中的 Decimal、时间与枚举转成 JSON 原生类型
+        "data": json.loads(serialization.dumps(data)) if data is not None else None,
+    }
+    if _is_postgres(db):
+        values["txid"] = func.txid_current()
+    db.add(models.ChangeLog(**values))
+
+
+def parse_cursor(cursor: Optional[str]) -> Optional[Tuple[int, int]]:
+    """'txid.id' → (txid, id)；空值表示从头读取"""
+    if cursor is None or not cursor.strip():
+        return None
+    try:
+        txid, change_id = (int(part) for part in cursor.strip().split(".", 1))
+    except ValueError:
+        raise ChangeCursorError("游标格式无效，应原样传回上次返回的 next_cursor")
+    return txid, change_id
+
+
+def format_cursor(txid: int, change_id: int) -> str:
+    return f"{txid}.{change_id}"
+
+
+def _visible_filter(db: Session):
+    """只读取已结束事务写入的记录（见模块说明）"""
+    if not _is_postgres(db):
+        return None
+    return models.ChangeLog.txid < func.txid_snapshot_xmin(func.txid_current_snapshot())
+
+
+def _head(db: Session) -> Optional[str]:
+    change = models.ChangeLog
+    query = db.query(change.txid, change.id)
+    visible = _visible_filter(db)
+    if visible is not None:
+        query = query.filter(visible)
+    row = query.order_by(desc(change.txid), desc(change.id)).first()
+    return format_cursor(row.txid, row.id) if row else None
+
+
+def read(
+    db: Session,
+    cursor: Optional[str] = None,
+    limit: int = 500,
+    entities: Optional[List[str]] = None,
+    company_id: Optional[int] = None
+) -> Dict:
+    """读取游标之后的一批变更，按提交顺序排列；可按实体或公司过滤"""
+    if entities:
+        unknown = [name for name in entities if name not in ENTITIES]
+        if unknown:
+            raise ChangeCursorError(f"未知的实体：{', '.join(unknown)}，可选 {', '.join(ENTITIES)}")
+    if cursor is not None and cursor.strip() == LATEST:
+        head = _head(db)
+        return {"changes": [], "next_cursor": head or "", "has_more": False}
+
+    position = parse_cursor(cursor)
+    change = models.ChangeLog
+    query = db.query(change)
+    visible = _visible_filter(db)
+    if visible is not None:
+        query = query.filter(visible)
+    if position is not None:
+        txid, change_id = position
+        query = query.filter(or_(change.txid > txid, and_(change.txid == txid, change.id > change_id)))
+    if entities:
+        query = query.filter(change.entity.in_(entities))
+    if company_id is not None:
+        query = query.filter(change.company_id == company_id)
+    rows = query.order_by(change.txid, change.id).limit(limit + 1).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = format_cursor(rows[-1].txid, rows[-1].id) if rows else (cursor or "").strip()
+    changes = [
+        {
+            "cursor": format_cursor(row.txid, row.id),
+            "entity": row.entity,
+            "action": row.action,
+            "entity_id": row.entity_id,
+            "company_id": row.company_id,
+            "quarter_id": row.quarter_id,
+            "data": row.data,
+            "changed_at": row.changed_at,
+        }
+        for row in rows
+    ]
+    return {"changes": changes, "next_cursor": next_cursor, "has_more": has_more}
+
+
+def is_retained(db: Session, cursor: Optional[str]) -> bool:
+    """游标所指的记录是否仍在日志中（未被 prune 清理）；空游标没有对应记录，返回 False
+
+    从游标继续读取之前检查它，能发现游标之后的记录是否可能已被清理。
+    """
+    position = parse_cursor(cursor)
+    if position is None:
+        return False
+    return db.query(models.ChangeLog.id).filter(models.ChangeLog.id == position[1]).first() is not None
+
+
+def prune(db: Session, older_than: timedelta) -> int:
+    """删除早于 older_than 的记录（不提交），返回删除条数
+
+    游标落在被清理区间内的消费者会直接从保留的第一条继续，应在清理周期内完成同步，
+    否则需要重新全量导出。
+    """
+    # 与 server_default now() 写入的时间戳使用同一时钟
+    cutoff = db.query(func.now()).scalar() - older_than
+    return db.query(models.ChangeLog)\
+        .filter(models.ChangeLog.changed_at < cutoff)\
+        .delete(synchronize_session=False)
@@ -5,7 +5,16 @@ from typing import Optional
 
 class Settings(BaseSettings):
     """应用配置"""
-    database_url: str
+    database_url: str  # postgresql://… 或 sqlite:///路径（单机部署、测试），sqlite:// 为内存库
+    # 连接池（PostgreSQL 与 SQLite 文件库）：每个 worker 进程最多同时占用 db_pool_size + db_max_overflow 个连接
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_timeout: float = 30  # 连接池已满时等待空闲连接的秒数
+    # SQLite：文件库使用 WAL，写事务串行，其余写入最多等待 busy_timeout
+    sqlite_busy_timeout_ms: int = 5000
+    sqlite_synchronous: str = "NORMAL"  # WAL 下 NORMAL 足够安全；要求每次提交落盘时用 FULL
+    sqlite_cache_size_mb: int = 64  # 每个连接的页缓存
+    sqlite_mmap_size_mb: int = 256  # 内存映射读取的上限，0 表示不使用 mmap
     openai_api_key: Optional[str] = None
     anthropic_api_key: Optional[str] = None
     grok_api_key: Optional[str] = None
@@ -15,9 +24,56 @@ class Settings(BaseSettings):
     ai_service_model: Optional[str] = "gpt-4"  # AI模型名称，如: gpt-4, gpt-3.5-turbo等
     ai_service_api_key: Optional[str] = None  # AI服务API Key（如果与openai_api_key不同）
     
+    # LLM 供应商路由：按顺序列出参与路由的供应商，未配置 API Key 的会被跳过（openai 使用上面的AI服务配置）
+    ai_providers: str = "openai,anthropic,grok"
+    anthropic_base_url: str = "https://api.anthropic.com/v1"
+    anthropic_model: str = "claude-3-5-sonnet-latest"
+    grok_base_url: str = "https://api.x.ai/v1"
+    grok_model: str = "grok-2-latest"
+    ai_request_timeout: float = 60  # 单次LLM请求超时秒数
+    ai_hedge_after_seconds: float = 0  # 主请求超过该秒数未返回时向次优供应商发送对冲请求，0 表示不对冲
+    ai_provider_cooldown_seconds: float = 30  # 供应商连续失败后暂停路由的秒数
+    ai_verify_ssl: bool = False  # 是否校验LLM服务的SSL证书
+    
+    # AI生成去重（single-flight）：相同输入的并发生成只调用一次LLM
+    ai_singleflight_enabled: bool = True
+    ai_singleflight_wait_seconds: int = 180  # 等待其他进程生成结果的最长时间
+    ai_singleflight_lease_seconds: int = 300  # 锁租约，持锁进程退出后到期可接管
+    ai_singleflight_result_ttl_seconds: int = 30  # 完成后结果至少保留的时间，供仍在轮询的其他进程读取（新请求不复用）
+    
+    # 综合AI分析定时刷新（ai_refresh）：在刷新时段内按过期程度重新生成
+    ai_refresh_enabled: bool = False
+    ai_refresh_window: str = "01:00-06:00"  # 服务器本地时间 HH:MM-HH:MM，可跨午夜，空值表示全天
+    ai_refresh_concurrency: int = 2  # 同时进行的生成任务数
+    ai_refresh_daily_token_budget: int = 200000  # 每日 token 预算，按时段进度线性放开
+    ai_refresh_max_age_days: int = 30  # 输入未变化时超过该天数也重新生成
+    ai_refresh_tick_seconds: int = 60
+    ai_refresh_defer_writes: bool = True  # 启用时季度写入不再同步生成综合分析，交给调度器
+    
+    # 列式指标存储（筛选等分析类读取使用），快照目录为空时不落盘
+    metrics_store_enabled: bool = True
+    metrics_store_dir: Optional[str] = "data"
+    
+    # 变更事件推送（/api/events），PostgreSQL 下经 NOTIFY 在多进程间转发
+    events_pg_notify: bool = True
+    events_heartbeat_seconds: int = 15
+    
+    # 变更日志（/api/changes 增量同步）保留天数，由 python manage.py prune-changes 清理
+    change_log_retention_days: int = 90
+    
     host: str = "0.0.0.0"
     port: int = 8000
     
+    # 启动模式（run.py）：development 单进程热重载；production 多进程
+    server_mode: str = "development"
+    workers: Optional[int] = None  # 默认 CPU 核数
+    preload_app: bool = True  # 主进程预加载应用后再 fork（仅 gunicorn）
+    graceful_timeout: int = 120  # 关闭时等待进行中请求与LLM调用的秒数
+    max_requests: int = 5000  # 每个 worker 处理该数量请求后重启，0 表示不回收
+    max_requests_jitter: int = 500  # 随机抖动，避免所有 worker 同时重启
+    keepalive: int = 5  # HTTP keep-alive 秒数
+    backlog: int = 2048  # 监听队列长度
+    
     model_config = SettingsConfigDict(
         env_file=".env",
         case_sensitive=False
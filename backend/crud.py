@@ -1,16 +1,94 @@
 """数据库CRUD操作"""
 from sqlalchemy.orm import Session
-from sqlalchemy import desc
-from typing import List, Optional, Dict
-from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy import desc, or_, null, literal_column, func
+from typing import List, Optional, Dict, Set
+from datetime import datetime, timedelta
+import logging
 import models
 import schemas
 from system_analysis_engine import SystemAnalysisEngine
+from quarter_metrics import QuarterMetrics, METRIC_FIELDS, to_float
 from ai_prompt_generator import AIPromptGenerator
 from ai_service import AIService
+from config import settings
+from database import dialect_insert
+from metrics_store import store as metrics_store
+import screener
+import sector_stats
+import portfolios
+import search_index
+import change_log
+import serialization
+import analysis_history
+import singleflight
+from events import broker as event_broker
 
 
-ai_service = AIService()
+logger = logging.getLogger(__name__)
+
+_ai_service: Optional[AIService] = None
+
+
+def get_ai_service() -> AIService:
+    """首次生成分析时才构建AI客户端，导入本模块不做任何初始化"""
+    global _ai_service
+    if _ai_service is None:
+        _ai_service = AIService()
+    return _ai_service
+
+
+def _sync_metrics_store(db: Session) -> None:
+    """写入提交后让列式指标存储从变更日志追平；失败只记录日志，下次读取时会再次追平"""
+    if not settings.metrics_store_enabled:
+        return
+    try:
+        metrics_store.sync(db)
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"Metrics store sync failed: {e}")
+
+
+def _refresh_sector_stats(db: Session, company_type: models.CompanyType, quarter_labels) -> None:
+    """在当前事务中刷新受影响的行业聚合分组（不提交）"""
+    db.flush()
+    sector_stats.refresh_groups(db, [(company_type, label) for label in quarter_labels])
+
+
+def _refresh_portfolios(db: Session, company_id: int) -> None:
+    """在当前事务中更新该公司所在组合的聚合（不提交）"""
+    db.flush()
+    portfolios.refresh_company(db, company_id)
+
+
+def _publish_event(event_type: str, company_id: Optional[int], **data) -> None:
+    """写入提交后推送变更事件；推送异常只记录日志"""
+    try:
+        event_broker.publish(event_type, company_id, **data)
+    except Exception as e:
+        logger.warning(f"Publishing {event_type} event failed: {e}")
+
+
+def _record_company(db: Session, company: models.Company, action: str) -> None:
+    """在当前事务中记录公司变更（附公司快照）"""
+    db.flush()
+    change_log.record(
+        db, "company", action, company.id, company.id,
+        data=serialization.row_to_dict(company, serialization.COMPANY_FIELDS)
+    )
+
+
+def _record_quarter(db: Session, quarter: models.Quarter, action: str) -> None:
+    """在当前事务中记录季度变更（附季度数据快照）"""
+    db.flush()
+    change_log.record(
+        db, "quarter", action, quarter.id, quarter.company_id, quarter.id,
+        data=serialization.row_to_dict(quarter, serialization.QUARTER_FIELDS)
+    )
+
+
+def _company_quarter_labels(db: Session, company_id: int) -> List[str]:
+    return [label for (label,) in db.query(models.Quarter.quarter).filter(models.Quarter.company_id == company_id).all()]
 
 
 # 公司相关CRUD
@@ -18,8 +96,10 @@ def create_company(db: Session, company: schemas.CompanyCreate) -> models.Compan
     """创建公司"""
     db_company = models.Company(**company.dict())
     db.add(db_company)
+    _record_company(db, db_company, "created")
     db.commit()
     db.refresh(db_company)
+    _publish_event("company-changed", db_company.id, action="created")
     return db_company
 
 
@@ -42,15 +122,15 @@ def get_companies_with_summary(db: Session) -> List[Dict]:
         latest_labels = None
         
         if latest_quarter:
-            latest_roic = float(latest_quarter.roic) if latest_quarter.roic else None
-            latest_wacc = float(latest_quarter.wacc) if latest_quarter.wacc else None
+            latest_roic = to_float(latest_quarter.roic)
+            latest_wacc = to_float(latest_quarter.wacc)
             
             latest_analysis = db.query(models.SystemAnalysis)\
                 .filter(models.SystemAnalysis.quarter_id == latest_quarter.id)\
                 .first()
             
             if latest_analysis:
-                latest_valuation_score = float(latest_analysis.valuation_score) if latest_analysis.valuation_score else None
+                latest_valuation_score = to_float(latest_analysis.valuation_score)
                 latest_labels = latest_analysis.labels
         
         # 获取综合AI分析
@@ -68,48 +148,121 @@ def get_companies_with_summary(db: Session) -> List[Dict]:
             "latest_wacc": latest_wacc,
             "latest_valuation_score": latest_valuation_score,
             "latest_labels": latest_labels,
-            "comprehensive_ai": comprehensive_ai
+            "comprehensive_ai": serialization.row_to_dict(
+                comprehensive_ai, serialization.COMPREHENSIVE_AI_FIELDS
+            ) if comprehensive_ai else None
         })
     
     return result
 
 
-def get_company_detail(db: Session, company_id: int) -> Optional[Dict]:
-    """获取公司详情（包含所有季度数据）"""
-    company = db.query(models.Company).filter(models.Company.id == company_id).first()
-    if not company:
-        return None
-    
-    # 获取所有季度数据（倒序）
-    quarters = db.query(models.Quarter)\
-        .filter(models.Quarter.company_id == company_id)\
+def _quarter_parts(db: Session, quarter_filter, include: Set[str]) -> tuple:
+    """批量查询一组季度的系统分析与AI分析，按 quarter_id 索引；未包含的部分不查询"""
+    system_analyses, ai_analyses = {}, {}
+    if "system_analysis" in include:
+        names = [
+            name for name in serialization.SYSTEM_ANALYSIS_FIELDS
+            if name != "system_summary" or "system_summary" in include
+        ]
+        rows = db.query(*[getattr(models.SystemAnalysis, name) for name in names])\
+            .join(models.Quarter, models.Quarter.id == models.SystemAnalysis.quarter_id)\
+            .filter(quarter_filter)\
+            .all()
+        system_analyses = {row.quarter_id: serialization.row_to_dict(row, names) for row in rows}
+    if "ai_analysis" in include:
+        names = serialization.AI_ANALYSIS_FIELDS
+        rows = db.query(*[getattr(models.QuarterAIAnalysis, name) for name in names])\
+            .join(models.Quarter, models.Quarter.id == models.QuarterAIAnalysis.quarter_id)\
+            .filter(quarter_filter)\
+            .all()
+        ai_analyses = {row.quarter_id: serialization.row_to_dict(row, names) for row in rows}
+    return system_analyses, ai_analyses
+
+
+def _quarter_detail_dicts(db: Session, quarter_filter, fields: Optional[Set[str]], include: Set[str]) -> List[Dict]:
+    """按列查询季度并组装与 QuarterDetailResponse 结构相同的字典（季度倒序）"""
+    names = serialization.quarter_columns(fields)
+    rows = db.query(*[getattr(models.Quarter, name) for name in names])\
+        .filter(quarter_filter)\
         .order_by(desc(models.Quarter.quarter))\
         .all()
+    system_analyses, ai_analyses = _quarter_parts(db, quarter_filter, include) if rows else ({}, {})
+
+    details = []
+    for row in rows:
+        detail = serialization.row_to_dict(row, names)
+        if "system_analysis" in include:
+            detail["system_analysis"] = system_analyses.get(row.id)
+        if "ai_analysis" in include:
+            detail["ai_analysis"] = ai_analyses.get(row.id)
+        details.append(detail)
+    return details
+
+
+def get_company_detail(
+    db: Session,
+    company_id: int,
+    fields: Optional[Set[str]] = None,
+    include: Optional[Set[str]] = None
+) -> Optional[Dict]:
+    """获取公司详情（包含所有季度数据）
+
+    fields 限定季度级字段，include 选择要返回的 system_analysis / system_summary /
+    ai_analysis / comprehensive_ai（缺省全部返回）。每类数据一条查询，只取需要的列，
+    结果为可直接编码的字典（见 serialization.FastJSONResponse）。
+    """
+    include = set(serialization.INCLUDE_PARTS) if include is None else include
+    return _company_detail_dicts(db, [company_id], fields, include).get(company_id)
+
+
+def _company_detail_dicts(db: Session, company_ids: List[int], fields: Optional[Set[str]], include: Set[str]) -> Dict[int, Dict]:
+    """一组公司的详情，按 company_id 索引；公司、季度及各部分分析各一条 IN 查询"""
+    companies = db.query(models.Company).filter(models.Company.id.in_(company_ids)).all()
+    if not companies:
+        return {}
+    details = {
+        company.id: {**serialization.row_to_dict(company, serialization.COMPANY_FIELDS), "quarters": []}
+        for company in companies
+    }
     
-    quarter_details = []
+    # 按公司分组需要 company_id；字段白名单中没有时分组后去掉
+    keep_company_id = fields is None or "company_id" in fields
+    quarter_fields = fields if keep_company_id else fields | {"company_id"}
+    quarters = _quarter_detail_dicts(db, models.Quarter.company_id.in_(list(details)), quarter_fields, include)
     for quarter in quarters:
-        system_analysis = db.query(models.SystemAnalysis)\
-            .filter(models.SystemAnalysis.quarter_id == quarter.id)\
-            .first()
-        
-        ai_analysis = db.query(models.QuarterAIAnalysis)\
-            .filter(models.QuarterAIAnalysis.quarter_id == quarter.id)\
-            .first()
-        
-        quarter_details.append({
-            **schemas.QuarterResponse.model_validate(quarter).model_dump(),
-            "system_analysis": schemas.SystemAnalysisResponse.model_validate(system_analysis).model_dump() if system_analysis else None,
-            "ai_analysis": schemas.QuarterAIAnalysisResponse.model_validate(ai_analysis).model_dump() if ai_analysis else None
-        })
-    
-    comprehensive_ai = db.query(models.CompanyComprehensiveAI)\
-        .filter(models.CompanyComprehensiveAI.company_id == company_id)\
-        .first()
+        owner = quarter["company_id"] if keep_company_id else quarter.pop("company_id")
+        details[owner]["quarters"].append(quarter)
     
+    if "comprehensive_ai" in include:
+        rows = db.query(models.CompanyComprehensiveAI)\
+            .filter(models.CompanyComprehensiveAI.company_id.in_(list(details)))\
+            .all()
+        comprehensive = {
+            row.company_id: serialization.row_to_dict(row, serialization.COMPREHENSIVE_AI_FIELDS) for row in rows
+        }
+        for company_id, detail in details.items():
+            detail["comprehensive_ai"] = comprehensive.get(company_id)
+    return details
+
+
+def get_companies_batch(
+    db: Session,
+    company_ids: List[int],
+    fields: Optional[Set[str]] = None,
+    include: Optional[Set[str]] = None
+) -> Dict:
+    """批量获取公司详情（字段选择同 get_company_detail），结果按 id 索引，不存在的 id 列在 missing"""
+    include = set(serialization.INCLUDE_PARTS) if include is None else include
+    ids = list(dict.fromkeys(company_ids))
+    details = _company_detail_dicts(db, ids, fields, include) if ids else {}
+    return _batch_result(ids, details)
+
+
+def _batch_result(ids: List[int], found: Dict[int, Dict]) -> Dict:
+    # JSON 对象的键只能是字符串（orjson 也不接受整数键）
     return {
-        **schemas.CompanyResponse.model_validate(company).model_dump(),
-        "quarters": quarter_details,
-        "comprehensive_ai": schemas.CompanyComprehensiveAIResponse.model_validate(comprehensive_ai).model_dump() if comprehensive_ai else None
+        "items": {str(item_id): found[item_id] for item_id in ids if item_id in found},
+        "missing": [item_id for item_id in ids if item_id not in found],
     }
 
 
@@ -119,12 +272,24 @@ def update_company(db: Session, company_id: int, company_update: schemas.Company
     if not company:
         return None
     
+    old_type = company.company_type
     update_data = company_update.model_dump(exclude_unset=True)
     for field, value in update_data.items():
         setattr(company, field, value)
     
+    # 类型变化时该公司的所有季度从旧分组移到新分组
+    if company.company_type != old_type:
+        labels = _company_quarter_labels(db, company_id)
+        _refresh_sector_stats(db, old_type, labels)
+        _refresh_sector_stats(db, company.company_type, labels)
+    _record_company(db, company, "updated")
+    
     db.commit()
     db.refresh(company)
+    
+    if "company_type" in update_data:
+        _sync_metrics_store(db)
+    _publish_event("company-changed", company.id, action="updated")
     return company
 
 
@@ -133,123 +298,237 @@ def delete_company(db: Session, company_id: int) -> bool:
     company = db.query(models.Company).filter(models.Company.id == company_id).first()
     if not company:
         return False
+    company_type = company.company_type
+    labels = _company_quarter_labels(db, company_id)
+    portfolios.remove_company(db, company_id)
+    # 季度随公司级联删除，逐个记录，按季度同步的消费者不必自行推断
+    for (quarter_id,) in db.query(models.Quarter.id).filter(models.Quarter.company_id == company_id).all():
+        change_log.record(db, "quarter", "deleted", quarter_id, company_id, quarter_id)
+    change_log.record(db, "company", "deleted", company_id, company_id)
     db.delete(company)
+    _refresh_sector_stats(db, company_type, labels)
     db.commit()
+    _sync_metrics_store(db)
+    _publish_event("company-changed", company_id, action="deleted")
     return True
 
 
 # 季度数据相关CRUD
-def create_quarter_with_analysis(db: Session, quarter: schemas.QuarterCreate) -> models.Quarter:
-    """创建季度数据并自动触发系统分析和AI分析"""
-    # 创建季度数据
-    db_quarter = models.Quarter(**quarter.dict())
-    db.add(db_quarter)
-    db.commit()
-    db.refresh(db_quarter)
-    
-    # 获取公司信息
-    company = db.query(models.Company).filter(models.Company.id == quarter.company_id).first()
-    if not company:
-        raise ValueError("公司不存在")
-    
-    # 获取上一季度数据（用于trend计算）
-    previous_quarter = db.query(models.Quarter)\
-        .filter(models.Quarter.company_id == quarter.company_id)\
-        .filter(models.Quarter.quarter < quarter.quarter)\
+def _previous_quarter(db: Session, company_id: int, quarter_label: str) -> Optional[models.Quarter]:
+    """获取同公司的上一季度"""
+    return db.query(models.Quarter)\
+        .filter(models.Quarter.company_id == company_id)\
+        .filter(models.Quarter.quarter < quarter_label)\
         .order_by(desc(models.Quarter.quarter))\
         .first()
+
+
+def _next_quarter(db: Session, company_id: int, quarter_label: str, exclude_id: Optional[int] = None) -> Optional[models.Quarter]:
+    """获取同公司的下一季度"""
+    query = db.query(models.Quarter)\
+        .filter(models.Quarter.company_id == company_id)\
+        .filter(models.Quarter.quarter > quarter_label)
+    if exclude_id is not None:
+        query = query.filter(models.Quarter.id != exclude_id)
+    return query.order_by(models.Quarter.quarter).first()
+
+
+class ScoredQuarter:
+    """写入事务中算好的一个季度（纯数据）
+
+    提交后 ORM 对象的属性全部过期，再访问会隐式查询并重新从连接池取连接，且一直
+    占用到下一次提交。提交之后的步骤（同步列式存储、推送事件、调用LLM）只使用这里
+    的字段，保证LLM调用期间不占用数据库连接。
+    """
+    __slots__ = ("quarter_id", "quarter", "company_id", "company_name", "company_type", "metrics", "analysis")
+
+    def __init__(self, company: models.Company, quarter: models.Quarter, metrics: QuarterMetrics, analysis: Dict):
+        self.quarter_id = quarter.id
+        self.quarter = quarter.quarter
+        self.company_id = company.id
+        self.company_name = company.company_name
+        self.company_type = company.company_type
+        self.metrics = metrics
+        self.analysis = analysis
+
+
+def _end_transaction(db: Session) -> None:
+    """结束当前事务并把连接归还连接池（调用LLM之前使用）"""
+    db.commit()
+
+
+def _apply_system_analysis(db: Session, company: models.Company, quarter: models.Quarter) -> ScoredQuarter:
+    """基于上一季度计算并写入（不提交）某季度的系统分析
+
+    调用前需 flush，保证上一季度查询能看到本事务中的改动。
+    """
+    previous_quarter = _previous_quarter(db, quarter.company_id, quarter.quarter)
+    current_data = QuarterMetrics.from_row(quarter)
     
-    prev_data = {}
-    if previous_quarter:
-        prev_data = {
-            "pe": float(previous_quarter.pe) if previous_quarter.pe else None,
-            "pb": float(previous_quarter.pb) if previous_quarter.pb else None,
-            "ps": float(previous_quarter.ps) if previous_quarter.ps else None,
-            "roe": float(previous_quarter.roe) if previous_quarter.roe else None,
-            "roic": float(previous_quarter.roic) if previous_quarter.roic else None,
-            "wacc": float(previous_quarter.wacc) if previous_quarter.wacc else None,
-            "revenue_yoy": float(previous_quarter.revenue_yoy) if previous_quarter.revenue_yoy else None,
-            "gross_margin": float(previous_quarter.gross_margin) if previous_quarter.gross_margin else None,
-            "fcf_margin": float(previous_quarter.fcf_margin) if previous_quarter.fcf_margin else None,
-            "capex_ratio": float(previous_quarter.capex_ratio) if previous_quarter.capex_ratio else None
-        }
-    
-    # 准备当前季度数据
-    current_data = {
-        "pe": float(db_quarter.pe) if db_quarter.pe else None,
-        "pb": float(db_quarter.pb) if db_quarter.pb else None,
-        "ps": float(db_quarter.ps) if db_quarter.ps else None,
-        "roe": float(db_quarter.roe) if db_quarter.roe else None,
-        "roic": float(db_quarter.roic) if db_quarter.roic else None,
-        "wacc": float(db_quarter.wacc) if db_quarter.wacc else None,
-        "revenue_yoy": float(db_quarter.revenue_yoy) if db_quarter.revenue_yoy else None,
-        "gross_margin": float(db_quarter.gross_margin) if db_quarter.gross_margin else None,
-        "fcf_margin": float(db_quarter.fcf_margin) if db_quarter.fcf_margin else None,
-        "capex_ratio": float(db_quarter.capex_ratio) if db_quarter.capex_ratio else None
-    }
-    
-    # 执行系统分析
     analysis_result = SystemAnalysisEngine.analyze(
         company_type=company.company_type,
         quarter_data=current_data,
-        previous_quarter_data=prev_data if prev_data else None
+        previous_quarter_data=QuarterMetrics.from_row(previous_quarter) if previous_quarter else None
     )
     
-    # 保存系统分析结果
-    db_analysis = models.SystemAnalysis(
-        quarter_id=db_quarter.id,
-        quality_score=analysis_result["quality_score"],
-        valuation_score=analysis_result["valuation_score"],
-        trend_score=analysis_result["trend_score"],
-        labels=analysis_result["labels"],
-        system_summary=analysis_result["system_summary"]
+    existing_analysis = db.query(models.SystemAnalysis)\
+        .filter(models.SystemAnalysis.quarter_id == quarter.id)\
+        .first()
+    
+    if existing_analysis:
+        existing_analysis.quality_score = analysis_result["quality_score"]
+        existing_analysis.valuation_score = analysis_result["valuation_score"]
+        existing_analysis.trend_score = analysis_result["trend_score"]
+        existing_analysis.labels = analysis_result["labels"]
+        existing_analysis.system_summary = analysis_result["system_summary"]
+    else:
+        db.add(models.SystemAnalysis(
+            quarter_id=quarter.id,
+            quality_score=analysis_result["quality_score"],
+            valuation_score=analysis_result["valuation_score"],
+            trend_score=analysis_result["trend_score"],
+            labels=analysis_result["labels"],
+            system_summary=analysis_result["system_summary"]
+        ))
+    search_index.index_document(db, "system_summary", quarter.company_id, quarter.id, analysis_result["system_summary"])
+    change_log.record(
+        db, "system_analysis", "upserted", quarter.id, quarter.company_id, quarter.id,
+        data={"quarter": quarter.quarter, **{
+            name: analysis_result[name]
+            for name in ("quality_score", "valuation_score", "trend_score", "labels", "system_summary")
+        }}
     )
-    db.add(db_analysis)
-    db.commit()
     
-    # 生成AI分析
+    return ScoredQuarter(company, quarter, current_data, analysis_result)
+
+
+def _rescore_downstream(db: Session, company: models.Company, quarter_labels: List[str], exclude_id: Optional[int] = None) -> List[ScoredQuarter]:
+    """重新计算受影响的后继季度的系统分析（不提交）
+
+    trend 只依赖紧邻的上一季度，因此插入、修改或删除某个季度后，只有紧随其后的
+    那个季度输入发生变化，更早或更晚的季度都无需重算。quarter_labels 为发生变化的
+    位置（季度改名时新旧两个位置都会影响各自的后继）。
+    返回重算的季度，供提交后同步列式存储。
+    """
+    rescored = []
+    seen = set()
+    for label in quarter_labels:
+        successor = _next_quarter(db, company.id, label, exclude_id)
+        if successor is None or successor.id in seen:
+            continue
+        seen.add(successor.id)
+        rescored.append(_apply_system_analysis(db, company, successor))
+    return rescored
+
+
+def _generate_quarter_ai(db: Session, scored: ScoredQuarter) -> models.QuarterAIAnalysis:
+    """生成并保存（新增或覆盖）单季度AI分析，提交后推送 analysis-completed
+
+    LLM调用前先结束事务归还连接，结果在一个只包含AI分析写入的短事务中保存。
+    """
     prompt = AIPromptGenerator.generate_quarter_prompt(
-        company_name=company.company_name,
-        company_type=company.company_type,
-        quarter=db_quarter.quarter,
-        quarter_data=current_data,
-        labels=analysis_result["labels"]
+        company_name=scored.company_name,
+        company_type=scored.company_type,
+        quarter=scored.quarter,
+        quarter_data=scored.metrics,
+        labels=scored.analysis["labels"]
     )
     
-    ai_text = ai_service.generate_analysis(prompt)
+    _end_transaction(db)
+    # 同一季度相同输入的并发生成（重复提交、多人同时点击）只调用一次LLM
+    ai_text = singleflight.run(
+        f"quarter:{scored.quarter_id}", prompt, lambda: get_ai_service().generate_analysis(prompt)
+    )
     
-    db_ai_analysis = models.QuarterAIAnalysis(
-        quarter_id=db_quarter.id,
-        analysis_text=ai_text
+    ai_analysis = db.query(models.QuarterAIAnalysis)\
+        .filter(models.QuarterAIAnalysis.quarter_id == scored.quarter_id)\
+        .first()
+    
+    version = analysis_history.record_version(
+        db, "quarter", scored.company_id, scored.quarter_id, ai_text, current=ai_analysis
     )
-    db.add(db_ai_analysis)
+    if ai_analysis:
+        ai_analysis.analysis_text = ai_text
+        ai_analysis.current_version_id = version.id
+    else:
+        ai_analysis = models.QuarterAIAnalysis(
+            quarter_id=scored.quarter_id,
+            analysis_text=ai_text,
+            current_version_id=version.id
+        )
+        db.add(ai_analysis)
+    search_index.index_document(db, "quarter_ai", scored.company_id, scored.quarter_id, ai_text)
+    change_log.record(
+        db, "quarter_ai", "upserted", scored.quarter_id, scored.company_id, scored.quarter_id,
+        data={"quarter": scored.quarter, "version_id": version.id}
+    )
+    
+    db.commit()
+    _publish_event("analysis-completed", scored.company_id, kind="quarter", quarter_id=scored.quarter_id)
+    return ai_analysis
+
+
+def create_quarter_with_analysis(db: Session, quarter: schemas.QuarterCreate) -> models.Quarter:
+    """创建季度数据并自动触发系统分析和AI分析"""
+    # 获取公司信息
+    company = db.query(models.Company).filter(models.Company.id == quarter.company_id).first()
+    if not company:
+        raise ValueError("公司不存在")
+    
+    # 创建季度数据，并在同一事务中写入系统分析、重算后继季度
+    db_quarter = models.Quarter(**quarter.dict())
+    db.add(db_quarter)
+    db.flush()
+    
+    _record_quarter(db, db_quarter, "created")
+    scored = _apply_system_analysis(db, company, db_quarter)
+    
+    # 插入历史季度（如补录 2023-Q2）会改变其后一季度的 trend 基准
+    rescored = _rescore_downstream(db, company, [scored.quarter], exclude_id=scored.quarter_id)
+    _refresh_sector_stats(db, scored.company_type, [scored.quarter] + [r.quarter for r in rescored])
+    _refresh_portfolios(db, scored.company_id)
+    
+    # 事务一：季度、系统分析、后继重算与行业统计一次提交，提交后连接归还连接池
     db.commit()
     
+    _sync_metrics_store(db)
+    _publish_event(
+        "quarter-changed", scored.company_id, action="created", quarter_id=scored.quarter_id,
+        quarter=scored.quarter, rescored_quarter_ids=[r.quarter_id for r in rescored]
+    )
+    
+    # 生成AI分析（调用期间不占用连接，结果在短事务中写入）
+    _generate_quarter_ai(db, scored)
+    
     # 检查是否需要更新综合AI分析（如果是最新4个季度之一）
-    update_comprehensive_ai_if_needed(db, quarter.company_id)
+    update_comprehensive_ai_if_needed(db, scored.company_id)
     
     return db_quarter
 
 
-def get_quarter_detail(db: Session, quarter_id: int) -> Optional[Dict]:
-    """获取季度详情"""
-    quarter = db.query(models.Quarter).filter(models.Quarter.id == quarter_id).first()
-    if not quarter:
-        return None
-    
-    system_analysis = db.query(models.SystemAnalysis)\
-        .filter(models.SystemAnalysis.quarter_id == quarter_id)\
-        .first()
-    
-    ai_analysis = db.query(models.QuarterAIAnalysis)\
-        .filter(models.QuarterAIAnalysis.quarter_id == quarter_id)\
-        .first()
-    
-    return {
-        **schemas.QuarterResponse.model_validate(quarter).model_dump(),
-        "system_analysis": schemas.SystemAnalysisResponse.model_validate(system_analysis).model_dump() if system_analysis else None,
-        "ai_analysis": schemas.QuarterAIAnalysisResponse.model_validate(ai_analysis).model_dump() if ai_analysis else None
-    }
+def get_quarter_detail(
+    db: Session,
+    quarter_id: int,
+    fields: Optional[Set[str]] = None,
+    include: Optional[Set[str]] = None
+) -> Optional[Dict]:
+    """获取季度详情（字段选择同 get_company_detail）"""
+    include = set(serialization.INCLUDE_PARTS) if include is None else include
+    details = _quarter_detail_dicts(db, models.Quarter.id == quarter_id, fields, include)
+    return details[0] if details else None
+
+
+def get_quarters_batch(
+    db: Session,
+    quarter_ids: List[int],
+    fields: Optional[Set[str]] = None,
+    include: Optional[Set[str]] = None
+) -> Dict:
+    """批量获取季度详情：季度、系统分析、AI分析各一条 IN 查询，结果按 id 索引"""
+    include = set(serialization.INCLUDE_PARTS) if include is None else include
+    ids = list(dict.fromkeys(quarter_ids))
+    details = _quarter_detail_dicts(db, models.Quarter.id.in_(ids), fields, include) if ids else []
+    return _batch_result(ids, {detail["id"]: detail for detail in details})
 
 
 def update_quarter_with_analysis(db: Session, quarter_id: int, quarter_update: schemas.QuarterUpdate) -> Optional[models.Quarter]:
@@ -258,117 +537,130 @@ def update_quarter_with_analysis(db: Session, quarter_id: int, quarter_update: s
     if not quarter:
         return None
     
+    old_label = quarter.quarter
+    old_data = QuarterMetrics.from_row(quarter)
+    
     # 更新季度数据
     update_data = quarter_update.model_dump(exclude_unset=True)
     for field, value in update_data.items():
         setattr(quarter, field, value)
     
-    db.commit()
-    db.refresh(quarter)
+    db.flush()
     
     # 获取公司信息
     company = db.query(models.Company).filter(models.Company.id == quarter.company_id).first()
     if not company:
+        db.commit()
+        db.refresh(quarter)
         return quarter
     
-    # 获取上一季度数据（用于trend计算）
-    previous_quarter = db.query(models.Quarter)\
-        .filter(models.Quarter.company_id == quarter.company_id)\
-        .filter(models.Quarter.quarter < quarter.quarter)\
-        .order_by(desc(models.Quarter.quarter))\
-        .first()
-    
-    prev_data = {}
-    if previous_quarter:
-        prev_data = {
-            "pe": float(previous_quarter.pe) if previous_quarter.pe else None,
-            "pb": float(previous_quarter.pb) if previous_quarter.pb else None,
-            "ps": float(previous_quarter.ps) if previous_quarter.ps else None,
-            "roe": float(previous_quarter.roe) if previous_quarter.roe else None,
-            "roic": float(previous_quarter.roic) if previous_quarter.roic else None,
-            "wacc": float(previous_quarter.wacc) if previous_quarter.wacc else None,
-            "revenue_yoy": float(previous_quarter.revenue_yoy) if previous_quarter.revenue_yoy else None,
-            "gross_margin": float(previous_quarter.gross_margin) if previous_quarter.gross_margin else None,
-            "fcf_margin": float(previous_quarter.fcf_margin) if previous_quarter.fcf_margin else None,
-            "capex_ratio": float(previous_quarter.capex_ratio) if previous_quarter.capex_ratio else None
-        }
-    
-    # 准备当前季度数据
-    current_data = {
-        "pe": float(quarter.pe) if quarter.pe else None,
-        "pb": float(quarter.pb) if quarter.pb else None,
-        "ps": float(quarter.ps) if quarter.ps else None,
-        "roe": float(quarter.roe) if quarter.roe else None,
-        "roic": float(quarter.roic) if quarter.roic else None,
-        "wacc": float(quarter.wacc) if quarter.wacc else None,
-        "revenue_yoy": float(quarter.revenue_yoy) if quarter.revenue_yoy else None,
-        "gross_margin": float(quarter.gross_margin) if quarter.gross_margin else None,
-        "fcf_margin": float(quarter.fcf_margin) if quarter.fcf_margin else None,
-        "capex_ratio": float(quarter.capex_ratio) if quarter.capex_ratio else None
-    }
+    _record_quarter(db, quarter, "updated")
     
     # 重新执行系统分析
-    analysis_result = SystemAnalysisEngine.analyze(
-        company_type=company.company_type,
-        quarter_data=current_data,
-        previous_quarter_data=prev_data if prev_data else None
-    )
+    scored = _apply_system_analysis(db, company, quarter)
     
-    # 更新或创建系统分析结果
-    existing_analysis = db.query(models.SystemAnalysis)\
-        .filter(models.SystemAnalysis.quarter_id == quarter_id)\
-        .first()
-    
-    if existing_analysis:
-        existing_analysis.quality_score = analysis_result["quality_score"]
-        existing_analysis.valuation_score = analysis_result["valuation_score"]
-        existing_analysis.trend_score = analysis_result["trend_score"]
-        existing_analysis.labels = analysis_result["labels"]
-        existing_analysis.system_summary = analysis_result["system_summary"]
-    else:
-        db_analysis = models.SystemAnalysis(
-            quarter_id=quarter.id,
-            quality_score=analysis_result["quality_score"],
-            valuation_score=analysis_result["valuation_score"],
-            trend_score=analysis_result["trend_score"],
-            labels=analysis_result["labels"],
-            system_summary=analysis_result["system_summary"]
-        )
-        db.add(db_analysis)
+    # 数值变化只影响本季度的后继；季度改名时旧位置的后继也换了上一季度
+    changed_positions = []
+    if scored.quarter != old_label:
+        changed_positions = [old_label, scored.quarter]
+    elif scored.metrics != old_data:
+        changed_positions = [scored.quarter]
+    rescored = _rescore_downstream(db, company, changed_positions, exclude_id=scored.quarter_id)
+    _refresh_sector_stats(db, scored.company_type, {old_label, scored.quarter} | {r.quarter for r in rescored})
+    _refresh_portfolios(db, scored.company_id)
     
+    # 事务一提交后连接归还连接池
     db.commit()
     
-    # 重新生成AI分析
-    prompt = AIPromptGenerator.generate_quarter_prompt(
-        company_name=company.company_name,
-        company_type=company.company_type,
-        quarter=quarter.quarter,
-        quarter_data=current_data,
-        labels=analysis_result["labels"]
+    _sync_metrics_store(db)
+    _publish_event(
+        "quarter-changed", scored.company_id, action="updated", quarter_id=scored.quarter_id,
+        quarter=scored.quarter, rescored_quarter_ids=[r.quarter_id for r in rescored]
     )
     
-    ai_text = ai_service.generate_analysis(prompt)
+    # 重新生成AI分析
+    _generate_quarter_ai(db, scored)
     
-    # 更新或创建AI分析
-    existing_ai = db.query(models.QuarterAIAnalysis)\
-        .filter(models.QuarterAIAnalysis.quarter_id == quarter_id)\
-        .first()
+    # 检查是否需要更新综合AI分析
+    update_comprehensive_ai_if_needed(db, scored.company_id)
     
-    if existing_ai:
-        existing_ai.analysis_text = ai_text
-    else:
-        db_ai_analysis = models.QuarterAIAnalysis(
-            quarter_id=quarter.id,
-            analysis_text=ai_text
-        )
-        db.add(db_ai_analysis)
+    return quarter
+
+
+def _inserted_flag(db: Session):
+    """RETURNING 中表示“本次为新增”的列：PostgreSQL 新插入行的 xmax 为 0，其他方言返回 NULL"""
+    if db.get_bind().dialect.name == "postgresql":
+        return literal_column("(xmax = 0)").label("inserted")
+    return null().label("inserted")
+
+
+def upsert_quarter_with_analysis(
+    db: Session,
+    company_id: int,
+    quarter_label: str,
+    values: schemas.QuarterValues
+) -> Optional[Dict]:
+    """按 (公司, 季度) 幂等写入季度数据（PUT 语义：未提供的指标置空）
+
+    一条 INSERT … ON CONFLICT (company_id, quarter) DO UPDATE … WHERE 有值变化 RETURNING：
+    新增或有值变化时返回该行，随后执行系统分析、重算后继季度并生成AI分析；
+    值完全相同时不写入、不分析，只多一次查询读取现有行。公司不存在时返回 None。
+    """
+    company = db.query(models.Company).filter(models.Company.id == company_id).first()
+    if not company:
+        return None
+    
+    row = {"company_id": company_id, "quarter": quarter_label, **values.model_dump()}
+    insert = dialect_insert(db)(models.Quarter).values(**row)
+    excluded = insert.excluded
+    changed_condition = or_(*[
+        getattr(models.Quarter, name).is_distinct_from(getattr(excluded, name))
+        for name in METRIC_FIELDS
+    ])
+    statement = insert.on_conflict_do_update(
+        index_elements=["company_id", "quarter"],
+        set_={**{name: getattr(excluded, name) for name in METRIC_FIELDS}, "updated_at": func.now()},
+        where=changed_condition
+    ).returning(models.Quarter.id, _inserted_flag(db))
+    result = db.execute(statement).first()
+    
+    if result is None:
+        # 冲突且没有任何值变化：WHERE 为假，未写入
+        db.rollback()
+        quarter = db.query(models.Quarter)\
+            .filter(models.Quarter.company_id == company_id)\
+            .filter(models.Quarter.quarter == quarter_label)\
+            .first()
+        return {"quarter": quarter, "created": False, "changed": False}
+    
+    quarter_id, created = result
+    quarter = db.query(models.Quarter)\
+        .filter(models.Quarter.id == quarter_id)\
+        .populate_existing()\
+        .one()
+    if created is None:
+        # 非 PostgreSQL 无法从 RETURNING 判断是否新增：新行还没有系统分析
+        created = db.query(models.SystemAnalysis.id)\
+            .filter(models.SystemAnalysis.quarter_id == quarter_id)\
+            .first() is None
     
+    _record_quarter(db, quarter, "created" if created else "updated")
+    scored = _apply_system_analysis(db, company, quarter)
+    rescored = _rescore_downstream(db, company, [quarter_label], exclude_id=quarter_id)
+    _refresh_sector_stats(db, scored.company_type, [quarter_label] + [r.quarter for r in rescored])
+    _refresh_portfolios(db, company_id)
     db.commit()
     
-    # 检查是否需要更新综合AI分析
-    update_comprehensive_ai_if_needed(db, quarter.company_id)
+    _sync_metrics_store(db)
+    _publish_event(
+        "quarter-changed", company_id, action="created" if created else "updated", quarter_id=quarter_id,
+        quarter=quarter_label, rescored_quarter_ids=[r.quarter_id for r in rescored]
+    )
     
-    return quarter
+    _generate_quarter_ai(db, scored)
+    update_comprehensive_ai_if_needed(db, company_id)
+    
+    return {"quarter": quarter, "created": bool(created), "changed": True}
 
 
 def delete_quarter(db: Session, quarter_id: int) -> bool:
@@ -378,9 +670,26 @@ def delete_quarter(db: Session, quarter_id: int) -> bool:
         return False
     
     company_id = quarter.company_id
+    quarter_label = quarter.quarter
+    change_log.record(db, "quarter", "deleted", quarter_id, company_id, quarter_id, data={"quarter": quarter_label})
     db.delete(quarter)
+    db.flush()
+    
+    # 被删季度的后继改为以更早的季度为基准，在同一事务中重算
+    rescored = []
+    company = db.query(models.Company).filter(models.Company.id == company_id).first()
+    if company:
+        rescored = _rescore_downstream(db, company, [quarter_label])
+        _refresh_sector_stats(db, company.company_type, [quarter_label] + [r.quarter for r in rescored])
+    _refresh_portfolios(db, company_id)
     db.commit()
     
+    _sync_metrics_store(db)
+    _publish_event(
+        "quarter-changed", company_id, action="deleted", quarter_id=quarter_id,
+        quarter=quarter_label, rescored_quarter_ids=[r.quarter_id for r in rescored]
+    )
+    
     # 删除后可能需要更新综合AI分析
     update_comprehensive_ai_if_needed(db, company_id)
     
@@ -412,50 +721,62 @@ def generate_quarter_ai_analysis(db: Session, quarter_id: int) -> Optional[model
     if not system_analysis:
         return None
     
-    # 准备数据
-    quarter_data = {
-        "pe": float(quarter.pe) if quarter.pe else None,
-        "pb": float(quarter.pb) if quarter.pb else None,
-        "ps": float(quarter.ps) if quarter.ps else None,
-        "roe": float(quarter.roe) if quarter.roe else None,
-        "roic": float(quarter.roic) if quarter.roic else None,
-        "wacc": float(quarter.wacc) if quarter.wacc else None,
-        "revenue_yoy": float(quarter.revenue_yoy) if quarter.revenue_yoy else None,
-        "gross_margin": float(quarter.gross_margin) if quarter.gross_margin else None,
-        "fcf_margin": float(quarter.fcf_margin) if quarter.fcf_margin else None,
-        "capex_ratio": float(quarter.capex_ratio) if quarter.capex_ratio else None
-    }
-    
-    # 生成prompt并调用AI
-    prompt = AIPromptGenerator.generate_quarter_prompt(
-        company_name=company.company_name,
-        company_type=company.company_type,
-        quarter=quarter.quarter,
-        quarter_data=quarter_data,
-        labels=system_analysis.labels or []
-    )
-    
-    ai_text = ai_service.generate_analysis(prompt)
-    
-    # 更新或创建AI分析
-    existing_ai = db.query(models.QuarterAIAnalysis)\
+    scored = ScoredQuarter(company, quarter, QuarterMetrics.from_row(quarter), {"labels": system_analysis.labels or []})
+    ai_analysis = _generate_quarter_ai(db, scored)
+    db.refresh(ai_analysis)
+    return ai_analysis
+
+
+def _quarter_ai_current_version(db: Session, quarter_id: int) -> Optional[int]:
+    return db.query(models.QuarterAIAnalysis.current_version_id)\
         .filter(models.QuarterAIAnalysis.quarter_id == quarter_id)\
-        .first()
-    
-    if existing_ai:
-        existing_ai.analysis_text = ai_text
-        db.commit()
-        db.refresh(existing_ai)
-        return existing_ai
-    else:
-        db_ai_analysis = models.QuarterAIAnalysis(
-            quarter_id=quarter_id,
-            analysis_text=ai_text
-        )
-        db.add(db_ai_analysis)
-        db.commit()
-        db.refresh(db_ai_analysis)
-        return db_ai_analysis
+        .scalar()
+
+
+def _comprehensive_ai_current_version(db: Session, company_id: int) -> Optional[int]:
+    return db.query(models.CompanyComprehensiveAI.current_version_id)\
+        .filter(models.CompanyComprehensiveAI.company_id == company_id)\
+        .scalar()
+
+
+def get_quarter_ai_versions(db: Session, quarter_id: int) -> Optional[List[Dict]]:
+    """单季度AI分析的版本列表（新到旧，不含文本）；季度不存在时返回 None"""
+    quarter = db.query(models.Quarter.company_id).filter(models.Quarter.id == quarter_id).first()
+    if quarter is None:
+        return None
+    return analysis_history.list_versions(
+        db, "quarter", quarter.company_id, quarter_id,
+        current_version_id=_quarter_ai_current_version(db, quarter_id)
+    )
+
+
+def get_quarter_ai_version(db: Session, quarter_id: int, version_id: int) -> Optional[Dict]:
+    """读取单季度AI分析的某个历史版本（含解压后的文本）"""
+    quarter = db.query(models.Quarter.company_id).filter(models.Quarter.id == quarter_id).first()
+    if quarter is None:
+        return None
+    return analysis_history.get_version(
+        db, "quarter", version_id, quarter.company_id, quarter_id,
+        current_version_id=_quarter_ai_current_version(db, quarter_id)
+    )
+
+
+def get_comprehensive_ai_versions(db: Session, company_id: int) -> Optional[List[Dict]]:
+    """综合AI分析的版本列表（新到旧，不含文本）；公司不存在时返回 None"""
+    if db.query(models.Company.id).filter(models.Company.id == company_id).first() is None:
+        return None
+    return analysis_history.list_versions(
+        db, "comprehensive", company_id,
+        current_version_id=_comprehensive_ai_current_version(db, company_id)
+    )
+
+
+def get_comprehensive_ai_version(db: Session, company_id: int, version_id: int) -> Optional[Dict]:
+    """读取综合AI分析的某个历史版本（含解压后的文本）"""
+    return analysis_history.get_version(
+        db, "comprehensive", version_id, company_id,
+        current_version_id=_comprehensive_ai_current_version(db, company_id)
+    )
 
 
 def get_company_comprehensive_ai(db: Session, company_id: int) -> Optional[models.CompanyComprehensiveAI]:
@@ -506,11 +827,17 @@ def generate_company_comprehensive_ai(db: Session, company_id: int) -> Optional[
         quarters_summary=quarters_summary
     )
     
-    # 调用AI
-    ai_response = ai_service.generate_analysis(prompt)
+    # 输入的读取时间：调用AI期间季度或单季度分析再有改动，应仍判为过期（见 stale_comprehensive_companies）
+    inputs_read_at = db.query(func.now()).scalar()
+
+    # 调用AI（先结束读取事务，调用期间不占用连接）
+    _end_transaction(db)
+    ai_response = singleflight.run(
+        f"company:{company_id}", prompt, lambda: get_ai_service().generate_analysis(prompt)
+    )
     
     # 解析结果
-    parsed = ai_service.parse_comprehensive_analysis(ai_response)
+    parsed = get_ai_service().parse_comprehensive_analysis(ai_response)
     
     # 更新或创建综合AI分析
     existing = db.query(models.CompanyComprehensiveAI)\
@@ -518,46 +845,367 @@ def generate_company_comprehensive_ai(db: Session, company_id: int) -> Optional[
         .first()
     
     based_quarters = [q["quarter"] for q in quarters_summary]
+    version = analysis_history.record_version(
+        db, "comprehensive", company_id, None, parsed["analysis_text"], current=existing,
+        main_label=parsed["main_label"], risk_label=parsed["risk_label"], based_quarters=based_quarters
+    )
     
     if existing:
         existing.analysis_text = parsed["analysis_text"]
         existing.main_label = parsed["main_label"]
         existing.risk_label = parsed["risk_label"]
         existing.based_quarters = based_quarters
-        db.commit()
-        db.refresh(existing)
-        return existing
+        existing.current_version_id = version.id
+        # 内容未变时也记录本次刷新时间，避免被调度器反复判为过期
+        existing.updated_at = inputs_read_at
+        db_comprehensive = existing
     else:
         db_comprehensive = models.CompanyComprehensiveAI(
             company_id=company_id,
             analysis_text=parsed["analysis_text"],
             main_label=parsed["main_label"],
             risk_label=parsed["risk_label"],
-            based_quarters=based_quarters
+            based_quarters=based_quarters,
+            current_version_id=version.id,
+            updated_at=inputs_read_at
         )
         db.add(db_comprehensive)
-        db.commit()
-        db.refresh(db_comprehensive)
-        return db_comprehensive
+    search_index.index_document(db, "comprehensive_ai", company_id, None, parsed["analysis_text"])
+    change_log.record(
+        db, "comprehensive_ai", "upserted", company_id, company_id,
+        data={
+            "version_id": version.id, "main_label": parsed["main_label"], "risk_label": parsed["risk_label"],
+            "based_quarters": based_quarters,
+        }
+    )
+    db.commit()
+    db.refresh(db_comprehensive)
+    _publish_event(
+        "analysis-completed", company_id, kind="comprehensive",
+        main_label=db_comprehensive.main_label, risk_label=db_comprehensive.risk_label
+    )
+    return db_comprehensive
 
 
-def update_comprehensive_ai_if_needed(db: Session, company_id: int):
-    """如果需要，更新综合AI分析（当季度数据变化时）"""
-    # 获取最新季度
-    latest_quarter = db.query(models.Quarter)\
-        .filter(models.Quarter.company_id == company_id)\
-        .order_by(desc(models.Quarter.quarter))\
-        .first()
+COMPREHENSIVE_MIN_QUARTERS = 4
+
+
+def stale_comprehensive_companies(
+    db: Session,
+    max_age: timedelta,
+    limit: int,
+    exclude: Optional[Set[int]] = None
+) -> List[Dict]:
+    """按过期程度排序的待刷新公司（综合AI分析）
+
+    过期的三种情况，依次优先：从未生成；生成后季度数据或单季度AI分析有变化；
+    超过 max_age 未刷新。同类中按上次刷新时间从早到晚。
+    """
+    quarter_changed = func.max(func.coalesce(models.Quarter.updated_at, models.Quarter.created_at))
+    quarters = db.query(
+        models.Quarter.company_id.label("company_id"),
+        quarter_changed.label("changed_at"),
+        func.count(models.Quarter.id).label("quarter_count")
+    ).group_by(models.Quarter.company_id).subquery()
+    analysis_changed = db.query(
+        models.Quarter.company_id.label("company_id"),
+        func.max(func.coalesce(models.QuarterAIAnalysis.updated_at, models.QuarterAIAnalysis.created_at)).label("changed_at")
+    ).join(models.QuarterAIAnalysis, models.QuarterAIAnalysis.quarter_id == models.Quarter.id)\
+        .group_by(models.Quarter.company_id).subquery()
     
-    if not latest_quarter:
+    comprehensive = models.CompanyComprehensiveAI
+    refreshed_at = comprehensive.updated_at
+    missing = comprehensive.id.is_(None)
+    inputs_changed = or_(
+        refreshed_at < quarters.c.changed_at,
+        refreshed_at < analysis_changed.c.changed_at
+    )
+    # 与 server_default now() 写入的时间戳使用同一时钟
+    expired = refreshed_at < db.query(func.now()).scalar() - max_age
+    
+    query = db.query(
+        quarters.c.company_id, refreshed_at.label("refreshed_at"), missing.label("missing"),
+        inputs_changed.label("inputs_changed")
+    ).outerjoin(analysis_changed, analysis_changed.c.company_id == quarters.c.company_id)\
+        .outerjoin(comprehensive, comprehensive.company_id == quarters.c.company_id)\
+        .filter(quarters.c.quarter_count >= COMPREHENSIVE_MIN_QUARTERS)\
+        .filter(or_(missing, inputs_changed, expired))
+    if exclude:
+        query = query.filter(quarters.c.company_id.notin_(exclude))
+    rows = query.order_by(
+        desc(missing), desc(func.coalesce(inputs_changed, False)), refreshed_at, quarters.c.company_id
+    ).limit(limit).all()
+    return [
+        {
+            "company_id": row.company_id,
+            "refreshed_at": row.refreshed_at,
+            "reason": "missing" if row.missing else ("inputs_changed" if row.inputs_changed else "expired"),
+        }
+        for row in rows
+    ]
+
+
+def update_comprehensive_ai_if_needed(db: Session, company_id: int):
+    """如果需要，更新综合AI分析（当季度数据变化时）
+
+    启用了定时刷新（ai_refresh）且 ai_refresh_defer_writes 时不在写入请求中生成，
+    该公司会被判为过期，由调度器在刷新时段内重新生成。
+    """
+    if settings.ai_refresh_enabled and settings.ai_refresh_defer_writes:
         return
     
-    # 检查是否有至少4个季度
+    # 检查是否有足够的季度
     quarter_count = db.query(models.Quarter)\
         .filter(models.Quarter.company_id == company_id)\
         .count()
     
-    if quarter_count >= 4:
+    if quarter_count >= COMPREHENSIVE_MIN_QUARTERS:
         # 异步或同步更新综合AI分析
         generate_company_comprehensive_ai(db, company_id)
 
+
+
+# 组合相关CRUD
+class PortfolioError(ValueError):
+    """组合操作的参数错误（名称重复、公司不存在）"""
+
+
+def _portfolio_summary(portfolio: models.Portfolio) -> Dict:
+    return {
+        "id": portfolio.id,
+        "name": portfolio.name,
+        "description": portfolio.description,
+        "member_count": portfolio.member_count,
+        "total_weight": portfolio.total_weight,
+        "aggregates": portfolios.aggregates(portfolio),
+        "created_at": portfolio.created_at,
+        "updated_at": portfolio.updated_at,
+    }
+
+
+def _check_companies_exist(db: Session, company_ids: Set[int]) -> None:
+    found = {cid for (cid,) in db.query(models.Company.id).filter(models.Company.id.in_(company_ids)).all()}
+    missing = sorted(company_ids - found)
+    if missing:
+        raise PortfolioError(f"公司不存在: {', '.join(map(str, missing))}")
+
+
+def get_portfolios(db: Session) -> List[Dict]:
+    """所有组合及其聚合值（读取组合行，不遍历成员）"""
+    return [_portfolio_summary(p) for p in db.query(models.Portfolio).order_by(models.Portfolio.id).all()]
+
+
+def get_portfolio(db: Session, portfolio_id: int) -> Optional[Dict]:
+    """组合详情：聚合值与成员快照"""
+    portfolio = db.query(models.Portfolio).filter(models.Portfolio.id == portfolio_id).first()
+    if not portfolio:
+        return None
+    
+    member = models.PortfolioMember
+    rows = db.query(member, models.Company.ticker, models.Company.company_name, models.Company.company_type)\
+        .join(models.Company, models.Company.id == member.company_id)\
+        .filter(member.portfolio_id == portfolio_id)\
+        .order_by(desc(member.weight), models.Company.ticker)\
+        .all()
+    total_weight = portfolio.total_weight
+    members = [
+        {
+            "company_id": row.PortfolioMember.company_id,
+            "ticker": row.ticker,
+            "company_name": row.company_name,
+            "company_type": row.company_type,
+            "weight": row.PortfolioMember.weight,
+            "weight_share": row.PortfolioMember.weight / total_weight if total_weight > portfolios.WEIGHT_EPSILON else None,
+            "latest_quarter": row.PortfolioMember.latest_quarter,
+            **{name: getattr(row.PortfolioMember, name) for name in portfolios.AGGREGATE_METRICS},
+            "added_at": row.PortfolioMember.added_at,
+        }
+        for row in rows
+    ]
+    return {**_portfolio_summary(portfolio), "members": members}
+
+
+def create_portfolio(db: Session, data: schemas.PortfolioCreate) -> Dict:
+    """创建组合（可同时添加成员）"""
+    weights = {m.company_id: m.weight for m in data.members}
+    if weights:
+        _check_companies_exist(db, set(weights))
+    
+    portfolio = models.Portfolio(name=data.name, description=data.description)
+    db.add(portfolio)
+    try:
+        db.flush()
+    except IntegrityError:
+        db.rollback()
+        raise PortfolioError("组合名称已存在")
+    for company_id, weight in weights.items():
+        portfolios.set_member(db, portfolio.id, company_id, weight)
+    db.commit()
+    return get_portfolio(db, portfolio.id)
+
+
+def update_portfolio(db: Session, portfolio_id: int, data: schemas.PortfolioUpdate) -> Optional[Dict]:
+    """修改组合名称或描述"""
+    portfolio = db.query(models.Portfolio).filter(models.Portfolio.id == portfolio_id).first()
+    if not portfolio:
+        return None
+    for field, value in data.model_dump(exclude_unset=True).items():
+        setattr(portfolio, field, value)
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise PortfolioError("组合名称已存在")
+    return get_portfolio(db, portfolio_id)
+
+
+def delete_portfolio(db: Session, portfolio_id: int) -> bool:
+    """删除组合（成员一并删除）"""
+    portfolio = db.query(models.Portfolio).filter(models.Portfolio.id == portfolio_id).first()
+    if not portfolio:
+        return False
+    db.delete(portfolio)
+    db.commit()
+    return True
+
+
+def set_portfolio_member(db: Session, portfolio_id: int, company_id: int, weight: float) -> Optional[Dict]:
+    """添加成员或修改权重，组合聚合按该成员贡献的差值更新；组合不存在时返回 None"""
+    if db.query(models.Portfolio.id).filter(models.Portfolio.id == portfolio_id).first() is None:
+        return None
+    _check_companies_exist(db, {company_id})
+    portfolios.set_member(db, portfolio_id, company_id, weight)
+    db.commit()
+    return get_portfolio(db, portfolio_id)
+
+
+def remove_portfolio_member(db: Session, portfolio_id: int, company_id: int) -> Optional[Dict]:
+    """移除成员；组合或成员不存在时返回 None"""
+    member = db.query(models.PortfolioMember)\
+        .filter(models.PortfolioMember.portfolio_id == portfolio_id, models.PortfolioMember.company_id == company_id)\
+        .with_for_update()\
+        .first()
+    if member is None:
+        return None
+    portfolios.remove_member(db, member)
+    db.commit()
+    return get_portfolio(db, portfolio_id)
+
+
+# 筛选相关
+def screen_companies(
+    db: Session,
+    expression: Optional[str],
+    quarter: str = "latest",
+    company_type: Optional[models.CompanyType] = None,
+    sort: Optional[str] = None,
+    limit: int = 100
+) -> Dict:
+    """按过滤表达式筛选公司季度（表达式错误时抛出 screener.ScreenQueryError）"""
+    store = metrics_store if settings.metrics_store_enabled else None
+    items = screener.run_screen(db, expression, quarter, company_type, sort, limit, store=store)
+    return {
+        "query": expression or "",
+        "quarter": quarter,
+        "company_type": company_type,
+        "count": len(items),
+        "items": items
+    }
+
+
+# 全文检索
+def search_analyses(
+    db: Session,
+    query: str,
+    kinds: Optional[List[str]] = None,
+    company_id: Optional[int] = None,
+    limit: int = 20
+) -> Dict:
+    """检索AI分析与系统摘要（读取预建的检索索引）"""
+    return search_index.search(db, query, kinds, company_id, limit)
+
+
+# 变更日志
+def get_changes(
+    db: Session,
+    cursor: Optional[str] = None,
+    limit: int = 500,
+    entities: Optional[List[str]] = None,
+    company_id: Optional[int] = None
+) -> Dict:
+    """游标之后的一批变更（见 change_log）"""
+    return change_log.read(db, cursor, limit, entities, company_id)
+
+
+# 行业聚合统计
+def get_sector_stats(db: Session, company_type: models.CompanyType, quarter: Optional[str] = None) -> Optional[Dict]:
+    """读取预计算的行业分布（不扫描季度表）"""
+    return sector_stats.get_sector_stats(db, company_type, quarter)
+
+
+def get_label_facets(db: Session, company_type: Optional[models.CompanyType] = None, quarter: str = "latest") -> Dict:
+    """读取预计算的标签计数（不扫描分析表）"""
+    return sector_stats.get_label_facets(db, company_type, quarter)
+
+
+# 时间序列（图表）
+class SeriesMetricError(ValueError):
+    """请求了不支持的序列指标"""
+
+
+def _downsample_indices(length: int, max_points: int) -> List[int]:
+    """等间隔抽取不超过 max_points 个下标，始终保留首尾两个点"""
+    if max_points <= 0 or length <= max_points:
+        return list(range(length))
+    if max_points == 1:
+        return [length - 1]
+    step = (length - 1) / (max_points - 1)
+    return sorted({round(i * step) for i in range(max_points)})
+
+
+def get_company_series(
+    db: Session,
+    company_id: int,
+    metrics: List[str],
+    from_quarter: Optional[str] = None,
+    to_quarter: Optional[str] = None,
+    max_points: Optional[int] = None
+) -> Optional[Dict]:
+    """按列返回公司指标时间序列：periods 加每个指标一个数组
+
+    只查询所需的列（不加载ORM对象），仅在请求系统得分时才关联 system_analyses；
+    配合 (company_id, quarter) INCLUDE 指标的覆盖索引可走 index-only scan。
+    """
+    unknown = [name for name in metrics if name not in screener.NUMERIC_FIELDS]
+    if unknown:
+        raise SeriesMetricError(f"不支持的指标: {', '.join(unknown)}")
+
+    if db.query(models.Company.id).filter(models.Company.id == company_id).first() is None:
+        return None
+
+    columns = [
+        getattr(models.SystemAnalysis if name in screener.SCORE_FIELDS else models.Quarter, name)
+        for name in metrics
+    ]
+    query = db.query(models.Quarter.quarter, *columns).filter(models.Quarter.company_id == company_id)
+    if any(name in screener.SCORE_FIELDS for name in metrics):
+        query = query.outerjoin(models.SystemAnalysis, models.SystemAnalysis.quarter_id == models.Quarter.id)
+    if from_quarter:
+        query = query.filter(models.Quarter.quarter >= from_quarter)
+    if to_quarter:
+        query = query.filter(models.Quarter.quarter <= to_quarter)
+    rows = query.order_by(models.Quarter.quarter).all()
+
+    total_points = len(rows)
+    indices = _downsample_indices(total_points, max_points or 0)
+    if len(indices) < total_points:
+        rows = [rows[i] for i in indices]
+
+    return {
+        "company_id": company_id,
+        "metrics": metrics,
+        "periods": [row[0] for row in rows],
+        "series": {name: [to_float(row[i + 1]) for row in rows] for i, name in enumerate(metrics)},
+        "total_points": total_points,
+        "downsampled": len(rows) < total_points,
+    }
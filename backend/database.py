@@ -1,10 +1,84 @@
-"""数据库连接和会话管理"""
-from sqlalchemy import create_engine
+"""数据库连接和会话管理
+
+支持 PostgreSQL 与 SQLite。SQLite 用于单机部署与测试、基准（无需数据库服务）：
+- 文件库开启 WAL，读取不阻塞写入、写入不阻塞读取；同一时间仍只有一个写事务，
+  其余写入按 busy_timeout 等待
+- 每个连接设置 foreign_keys（ON DELETE CASCADE 依赖它）与读多写少场景的缓存、mmap
+- 内存库（sqlite:// 或 :memory:）所有会话共用同一个连接，否则每个连接各是一个空库
+PostgreSQL 专有的数组、tsvector 列在 SQLite 上的存储见 models。
+"""
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
 from config import settings
+import instrumentation
+
+
+def is_sqlite_url(url: str) -> bool:
+    return url.startswith("sqlite")
+
+
+def is_memory_sqlite_url(url: str) -> bool:
+    path = url.split("://", 1)[-1]
+    return path in ("", "/", "/:memory:") or "mode=memory" in path
+
+
+def _engine_options(url: str) -> dict:
+    if not is_sqlite_url(url):
+        return {
+            "pool_size": settings.db_pool_size,
+            "max_overflow": settings.db_max_overflow,
+            "pool_timeout": settings.db_pool_timeout,
+        }
+    # 请求在线程池中执行，连接会跨线程使用；会话本身不跨线程共享
+    options = {"connect_args": {"check_same_thread": False, "timeout": settings.sqlite_busy_timeout_ms / 1000}}
+    if is_memory_sqlite_url(url):
+        options["poolclass"] = StaticPool
+    else:
+        options.update(
+            pool_size=settings.db_pool_size,
+            max_overflow=settings.db_max_overflow,
+            pool_timeout=settings.db_pool_timeout,
+        )
+    return options
+
 
-engine = create_engine(settings.database_url)
+def sqlite_pragmas(memory: bool) -> list:
+    """每个新连接执行的 PRAGMA"""
+    pragmas = [
+        "PRAGMA foreign_keys=ON",
+        f"PRAGMA busy_timeout={int(settings.sqlite_busy_timeout_ms)}",
+        f"PRAGMA cache_size=-{int(settings.sqlite_cache_size_mb) * 1024}",  # 负值单位为 KiB
+        "PRAGMA temp_store=MEMORY",
+    ]
+    if not memory:
+        pragmas += [
+            "PRAGMA journal_mode=WAL",
+            # WAL 下 NORMAL 只在检查点时 fsync，掉电可能丢失最近提交但不会损坏数据库
+            f"PRAGMA synchronous={settings.sqlite_synchronous}",
+            f"PRAGMA mmap_size={int(settings.sqlite_mmap_size_mb) * 1024 * 1024}",
+        ]
+    return pragmas
+
+
+def _install_sqlite_pragmas(engine, memory: bool) -> None:
+    pragmas = sqlite_pragmas(memory)
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+
+
+engine = create_engine(settings.database_url, **_engine_options(settings.database_url))
+if is_sqlite_url(settings.database_url):
+    _install_sqlite_pragmas(engine, is_memory_sqlite_url(settings.database_url))
+instrumentation.install_db_hooks(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
@@ -18,3 +92,13 @@ def get_db():
     finally:
         db.close()
 
+
+
+
+def dialect_insert(db):
+    """返回当前数据库方言的 insert 构造器（支持 on_conflict_do_update / do_nothing）"""
+    if db.get_bind().dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        from sqlalchemy.dialects.postgresql import insert
+    return insert
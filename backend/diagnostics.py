@@ -0,0 +1,109 @@
+"""启动耗时诊断 - 类似 python -X importtime 的模块导入耗时统计
+
+main.py 最先导入本模块并调用 start_import_timer()，之后每个首次导入的模块都会记录
+累计耗时（含其依赖）与自身耗时（不含其依赖）；main.py 导入完成时调用
+finish_import_timer() 卸载钩子。结果通过 /api/diagnostics/startup 查看：
+- import_ms：main.py 全部导入耗时
+- ready_ms：从导入本模块到应用启动事件完成
+
+多进程 + 预加载（run.py production）时模块在主进程导入，worker fork 后直接继承，
+报告中的导入耗时即发生在主进程。
+"""
+import os
+import sys
+import time
+import builtins
+import threading
+from typing import Optional, Dict, List
+
+PROCESS_STARTED = time.perf_counter()
+
+
+class ImportTimer:
+    """替换 builtins.__import__，记录每个模块首次导入的耗时（秒）"""
+
+    def __init__(self):
+        self.cumulative: Dict[str, float] = {}
+        self.self_time: Dict[str, float] = {}
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self._original = None
+        self._children = threading.local()
+
+    def start(self) -> None:
+        if self._original is not None:
+            return
+        self.started = time.perf_counter()
+        self._original = builtins.__import__
+        builtins.__import__ = self._import
+
+    def finish(self) -> None:
+        if self._original is None:
+            return
+        builtins.__import__ = self._original
+        self._original = None
+        self.finished = time.perf_counter()
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        original = self._original or builtins.__import__
+        if level or name in sys.modules or name in self.cumulative:
+            return original(name, globals, locals, fromlist, level)
+
+        stack = getattr(self._children, "stack", None)
+        if stack is None:
+            stack = self._children.stack = []
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            return original(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter() - start
+            children = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            self.cumulative[name] = elapsed
+            self.self_time[name] = max(elapsed - children, 0.0)
+
+    def top(self, limit: int) -> List[Dict]:
+        ranked = sorted(self.cumulative.items(), key=lambda item: item[1], reverse=True)[:limit]
+        return [
+            {
+                "module": name,
+                "cumulative_ms": round(seconds * 1000, 3),
+                "self_ms": round(self.self_time[name] * 1000, 3),
+            }
+            for name, seconds in ranked
+        ]
+
+
+import_timer = ImportTimer()
+_app_ready: Optional[float] = None
+
+
+def start_import_timer() -> None:
+    import_timer.start()
+
+
+def finish_import_timer() -> None:
+    import_timer.finish()
+
+
+def mark_ready() -> None:
+    """应用启动事件完成时调用"""
+    global _app_ready
+    if _app_ready is None:
+        _app_ready = time.perf_counter()
+
+
+def startup_report(limit: int = 30) -> Dict:
+    def ms(start: Optional[float], end: Optional[float]) -> Optional[float]:
+        return round((end - start) * 1000, 3) if start is not None and end is not None else None
+
+    return {
+        "pid": os.getpid(),
+        "python": sys.version.split()[0],
+        "import_ms": ms(import_timer.started, import_timer.finished),
+        "ready_ms": ms(PROCESS_STARTED, _app_ready),
+        "modules_imported": len(import_timer.cumulative),
+        "slowest_imports": import_timer.top(limit),
+    }
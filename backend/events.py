@@ -0,0 +1,186 @@
+"""变更事件推送 - /api/events（Server-Sent Events）的进程内广播
+
+crud 在写入提交后调用 publish()，事件类型：
+- analysis-completed：单季度或综合AI分析生成完成
+- quarter-changed：季度新增、修改、删除（含被连带重算的后继季度）
+- company-changed：公司新增、修改、删除
+
+每个 SSE 连接是一个订阅者，持有一个有界 asyncio.Queue。publish 可能在线程池线程中
+被调用，通过 loop.call_soon_threadsafe 投递到订阅者所在的事件循环。订阅者消费过慢
+导致队列满时清空队列并只留下一条 resync 事件，提示前端整体刷新。
+
+多进程部署（PostgreSQL）时事件经 NOTIFY 转发：publish 只发送 NOTIFY，每个进程的
+监听线程 LISTEN 同一频道后再投递给本进程订阅者，因此任一 worker 上的写入都能推送到
+所有 worker 的连接。NOTIFY 经每个进程一条独立的长连接发送（加锁串行使用），
+不从请求的连接池借用连接。其他数据库只在进程内广播。
+"""
+import json
+import time
+import select
+import asyncio
+import logging
+import itertools
+import threading
+from typing import Optional, Dict, Any, Set
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+EVENT_TYPES = ("analysis-completed", "quarter-changed", "company-changed")
+NOTIFY_CHANNEL = "eie_events"
+QUEUE_SIZE = 1000
+
+
+class Subscriber:
+    """一个 SSE 连接：company_ids / types 为空表示不过滤"""
+    __slots__ = ("loop", "queue", "company_ids", "types")
+
+    def __init__(self, loop, company_ids: Optional[Set[int]], types: Optional[Set[str]]):
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.company_ids = company_ids
+        self.types = types
+
+    def wants(self, event: Dict[str, Any]) -> bool:
+        if self.types is not None and event["type"] not in self.types:
+            return False
+        return self.company_ids is None or event.get("company_id") in self.company_ids
+
+    def offer(self, event: Dict[str, Any]) -> None:
+        """在订阅者的事件循环中执行"""
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({"type": "resync", "id": event["id"]})
+
+
+class EventBroker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers: Set[Subscriber] = set()
+        self._ids = itertools.count(1)
+        self._listener: Optional[threading.Thread] = None
+        self._notify_lock = threading.Lock()
+        self._notify_connection = None
+
+    def subscribe(self, company_ids: Optional[Set[int]] = None, types: Optional[Set[str]] = None) -> Subscriber:
+        subscriber = Subscriber(asyncio.get_running_loop(), company_ids, types)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        self._ensure_listener()
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def publish(self, event_type: str, company_id: Optional[int], **data) -> None:
+        """发布事件（写入已提交后调用）"""
+        event = {"type": event_type, "company_id": company_id, "ts": time.time(), **data}
+        if _use_notify():
+            if self._notify(event):
+                return
+        self.dispatch(event)
+
+    def dispatch(self, event: Dict[str, Any]) -> None:
+        """投递给本进程内的订阅者"""
+        event = {**event, "id": next(self._ids)}
+        with self._lock:
+            subscribers = [s for s in self._subscribers if s.wants(event)]
+        for subscriber in subscribers:
+            try:
+                subscriber.loop.call_soon_threadsafe(subscriber.offer, event)
+            except RuntimeError:  # 事件循环已关闭
+                self.unsubscribe(subscriber)
+
+    def _ensure_listener(self) -> None:
+        if not _use_notify() or (self._listener is not None and self._listener.is_alive()):
+            return
+        with self._lock:
+            if self._listener is not None and self._listener.is_alive():
+                return
+            self._listener = threading.Thread(target=self._listen, name="eie-events-listener", daemon=True)
+            self._listener.start()
+
+    def _listen(self) -> None:
+        """LISTEN 通知频道并转发给本进程订阅者；连接断开后重连
+
+        使用连接池之外的独立连接，不占用请求可用的连接。
+        """
+        while True:
+            try:
+                raw = _dedicated_connection()
+                try:
+                    raw.cursor().execute(f"LISTEN {NOTIFY_CHANNEL}")
+                    while True:
+                        if select.select([raw], [], [], 30) == ([], [], []):
+                            continue
+                        raw.poll()
+                        while raw.notifies:
+                            notification = raw.notifies.pop(0)
+                            try:
+                                self.dispatch(json.loads(notification.payload))
+                            except ValueError:
+                                logger.warning("Ignoring malformed event notification")
+                finally:
+                    raw.close()
+            except Exception as e:
+                logger.warning(f"Event listener disconnected, retrying: {e}")
+                time.sleep(5)
+
+    def _notify(self, event: Dict[str, Any]) -> bool:
+        """通过 pg_notify 广播到所有进程；失败时返回 False 由调用方退回进程内投递
+
+        使用本进程独立的发送连接，断开后丢弃并重连一次。
+        """
+        payload = json.dumps(event, ensure_ascii=False)
+        with self._notify_lock:
+            for attempt in range(2):
+                try:
+                    if self._notify_connection is None:
+                        self._notify_connection = _dedicated_connection()
+                    cursor = self._notify_connection.cursor()
+                    try:
+                        cursor.execute("SELECT pg_notify(%s, %s)", (NOTIFY_CHANNEL, payload))
+                    finally:
+                        cursor.close()
+                    return True
+                except Exception as e:
+                    self._close_notify_connection()
+                    if attempt:
+                        logger.warning(f"pg_notify failed, delivering locally: {e}")
+        return False
+
+    def _close_notify_connection(self) -> None:
+        if self._notify_connection is None:
+            return
+        try:
+            self._notify_connection.close()
+        except Exception:
+            pass
+        self._notify_connection = None
+
+
+def _use_notify() -> bool:
+    from database import engine
+    return settings.events_pg_notify and engine.dialect.name == "postgresql"
+
+
+def _dedicated_connection():
+    """连接池之外的 autocommit 驱动连接（LISTEN 与 NOTIFY 各用一条）"""
+    from database import engine
+
+    cargs, cparams = engine.dialect.create_connect_args(engine.url)
+    raw = engine.dialect.connect(*cargs, **cparams)
+    raw.autocommit = True
+    return raw
+
+
+def format_sse(event: Dict[str, Any]) -> str:
+    """一条 SSE 消息：event 为事件类型，data 为JSON"""
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+
+broker = EventBroker()
@@ -0,0 +1,282 @@
+"""请求耗时统计 - 分阶段计时、Server-Timing 响应头与 Prometheus 指标
+
+每个请求在中间件中创建一个 RequestTimings 放入 contextvar，业务代码通过 phase() /
+timed() 记录各阶段耗时（db、engine、prompt、llm 等），数据库耗时与SQL条数由
+SQLAlchemy 事件钩子自动记录。同步路由在线程池中执行时 contextvar 会被复制，
+因此线程内记录的数据对中间件可见。
+"""
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Optional, Dict, Tuple, List, Callable
+from sqlalchemy import event
+
+# Prometheus 直方图桶（秒），覆盖从毫秒级读取到分钟级LLM调用
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+class RequestTimings:
+    """单个请求的各阶段耗时（秒）与次数"""
+    __slots__ = ("started", "durations", "counts", "route", "endpoint_finished")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.durations: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+        self.route: Optional[str] = None
+        self.endpoint_finished: Optional[float] = None
+
+    def add(self, name: str, seconds: float, count: int = 1) -> None:
+        self.durations[name] = self.durations.get(name, 0.0) + seconds
+        self.counts[name] = self.counts.get(name, 0) + count
+
+    def server_timing(self, total: float) -> str:
+        """生成 Server-Timing 头，例如 db;dur=3.2;desc="4 queries", total;dur=10.5"""
+        parts = []
+        for name, seconds in self.durations.items():
+            entry = f"{name};dur={seconds * 1000:.1f}"
+            if name == "db":
+                entry += f';desc="{self.counts[name]} queries"'
+            parts.append(entry)
+        parts.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(parts)
+
+
+_current: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+
+
+def current() -> Optional[RequestTimings]:
+    return _current.get()
+
+
+def start_request():
+    """开始记录当前请求，返回用于 end_request 的 token"""
+    return _current.set(RequestTimings())
+
+
+def end_request(token) -> None:
+    _current.reset(token)
+
+
+@contextmanager
+def phase(name: str):
+    """记录一个阶段的耗时；不在请求上下文中时不做任何事"""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - start)
+
+
+def timed(name: str):
+    """phase 的装饰器形式"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current.get() is None:
+                return func(*args, **kwargs)
+            with phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def install_db_hooks(engine) -> None:
+    """在引擎上记录每条SQL的耗时与条数（计入 db 阶段）以及连接池借出情况"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("eie_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["eie_query_start"].pop()
+        timings = _current.get()
+        if timings is not None:
+            timings.add("db", time.perf_counter() - started)
+
+    pool_usage.pool = engine.pool
+
+    @event.listens_for(engine, "checkout")
+    def _checkout(dbapi_connection, connection_record, connection_proxy):
+        pool_usage.checkout()
+
+    @event.listens_for(engine, "checkin")
+    def _checkin(dbapi_connection, connection_record):
+        pool_usage.checkin()
+
+
+class Histogram:
+    """线程安全的 Prometheus 直方图（按标签组合分别累计）"""
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...], buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._series: Dict[Tuple[str, ...], List] = {}
+
+    def observe(self, labels: Tuple[str, ...], value: float) -> None:
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, (bucket_counts, total, count) in sorted(self._series.items()):
+                base = ",".join(f'{k}="{_escape(v)}"' for k, v in zip(self.label_names, labels))
+                sep = "," if base else ""
+                for bound, bucket_count in zip(self.buckets, bucket_counts):
+                    lines.append(f'{self.name}_bucket{{{base}{sep}le="{bound}"}} {bucket_count}')
+                lines.append(f'{self.name}_bucket{{{base}{sep}le="+Inf"}} {count}')
+                lines.append(f"{self.name}_sum{{{base}}} {total}")
+                lines.append(f"{self.name}_count{{{base}}} {count}")
+        return lines
+
+
+class Counter:
+    """线程安全的 Prometheus 计数器"""
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...]):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, labels: Tuple[str, ...], amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                base = ",".join(f'{k}="{_escape(v)}"' for k, v in zip(self.label_names, labels))
+                lines.append(f"{self.name}{{{base}}} {value}")
+        return lines
+
+
+class Gauge:
+    """Prometheus 仪表，输出时调用 read 取当前值（返回 None 时不输出）"""
+
+    def __init__(self, name: str, help_text: str, read: Callable[[], Optional[float]]):
+        self.name = name
+        self.help_text = help_text
+        self.read = read
+
+    def render(self) -> List[str]:
+        value = self.read()
+        if value is None:
+            return []
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge", f"{self.name} {value}"]
+
+
+class PoolUsage:
+    """连接池借出情况，由 checkout / checkin 事件维护（不依赖连接池类型）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.pool = None
+        self.in_use = 0
+        self.peak = 0
+
+    def capacity(self) -> Optional[int]:
+        """最多可同时借出的连接数；连接池没有上限（如 NullPool）时为 None"""
+        size = getattr(self.pool, "size", None)
+        if not callable(size):
+            return None
+        overflow = getattr(self.pool, "_max_overflow", 0)
+        return None if overflow < 0 else size() + overflow
+
+    def checkout(self) -> None:
+        with self._lock:
+            self.in_use += 1
+            self.peak = max(self.peak, self.in_use)
+            in_use = self.in_use
+        DB_POOL_CHECKOUTS.inc(())
+        capacity = self.capacity()
+        if capacity is not None and in_use >= capacity:
+            DB_POOL_SATURATED_CHECKOUTS.inc(())
+
+    def checkin(self) -> None:
+        with self._lock:
+            self.in_use = max(0, self.in_use - 1)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+REQUEST_LATENCY = Histogram(
+    "eie_http_request_duration_seconds", "HTTP请求总耗时", ("method", "route", "status")
+)
+PHASE_LATENCY = Histogram(
+    "eie_http_request_phase_seconds", "HTTP请求各阶段耗时", ("route", "phase")
+)
+DB_QUERIES = Counter(
+    "eie_db_queries_total", "各路由执行的SQL条数", ("route",)
+)
+AI_DEDUPLICATED = Counter(
+    "eie_ai_generations_deduplicated_total", "相同输入正在生成而直接复用结果的AI生成次数", ("scope", "source")
+)
+LLM_PROVIDER_LATENCY = Histogram(
+    "eie_llm_provider_duration_seconds", "各LLM供应商成功请求的耗时", ("provider",)
+)
+LLM_PROVIDER_REQUESTS = Counter(
+    "eie_llm_provider_requests_total", "各LLM供应商的请求数（ok / error / cancelled）", ("provider", "outcome")
+)
+LLM_HEDGED_REQUESTS = Counter(
+    "eie_llm_hedged_requests_total", "主请求超时后发送的对冲请求数（按对冲目标供应商）", ("provider",)
+)
+LLM_TOKENS = Counter(
+    "eie_llm_tokens_total", "各LLM供应商消耗的 token 数（未返回用量时为估算值）", ("provider",)
+)
+
+
+DB_POOL_CHECKOUTS = Counter(
+    "eie_db_pool_checkouts_total", "从连接池借出连接的次数", ()
+)
+DB_POOL_SATURATED_CHECKOUTS = Counter(
+    "eie_db_pool_saturated_checkouts_total", "借出后连接池已满（再来的请求需要排队等待）的次数", ()
+)
+pool_usage = PoolUsage()
+DB_POOL_GAUGES = (
+    Gauge("eie_db_pool_capacity", "连接池最多可同时借出的连接数（pool_size + max_overflow）", pool_usage.capacity),
+    Gauge("eie_db_pool_checked_out", "当前借出的连接数", lambda: pool_usage.in_use),
+    Gauge("eie_db_pool_checked_out_peak", "进程启动以来同时借出连接数的峰值", lambda: pool_usage.peak),
+)
+
+
+def record_request(method: str, status: int, timings: RequestTimings, total: float) -> None:
+    """请求结束时汇总到 Prometheus 指标"""
+    route = timings.route or "unmatched"
+    REQUEST_LATENCY.observe((method, route, str(status)), total)
+    for name, seconds in timings.durations.items():
+        PHASE_LATENCY.observe((route, name), seconds)
+    if "db" in timings.counts:
+        DB_QUERIES.inc((route,), timings.counts["db"])
+
+
+def render_metrics() -> str:
+    """Prometheus 文本格式（0.0.4）"""
+    lines = REQUEST_LATENCY.render() + PHASE_LATENCY.render() + DB_QUERIES.render() + AI_DEDUPLICATED.render()
+    lines += LLM_PROVIDER_LATENCY.render() + LLM_PROVIDER_REQUESTS.render() + LLM_HEDGED_REQUESTS.render()
+    lines += LLM_TOKENS.render() + DB_POOL_CHECKOUTS.render() + DB_POOL_SATURATED_CHECKOUTS.render()
+    for gauge in DB_POOL_GAUGES:
+        lines += gauge.render()
+    return "\n".join(lines) + "\n"
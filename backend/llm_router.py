@@ -0,0 +1,351 @@
+"""LLM 多供应商路由 - 按健康度选择供应商，可选对冲请求（hedged request）
+
+配置了 API Key 的供应商参与路由，偏好顺序由 AI_PROVIDERS 给出：
+- openai：OpenAI 兼容接口（AI_SERVICE_URL / AI_SERVICE_MODEL / AI_SERVICE_API_KEY）
+- anthropic：Anthropic Messages API
+- grok：xAI 的 OpenAI 兼容接口
+
+每个供应商记录成功请求耗时与错误率的 EWMA，连续失败后熔断一段时间。请求发给得分最好
+的供应商（尚无样本的供应商按 0 耗时计，先被试用）；设置了 AI_HEDGE_AFTER_SECONDS 时，
+主请求超过该时间仍未返回就向次优供应商发送同一请求，先成功者胜出，另一个被取消。
+某个供应商失败后立即转给下一个；全部因限流或网络错误失败时退避后重试整轮。
+
+HTTP 调用在常驻的后台事件循环线程中用 httpx.AsyncClient 执行（连接复用、可取消），
+同步调用方（线程池中的 crud）通过 complete() 阻塞等待结果。各供应商的 base URL 均可配置，
+因此可以指向本地的替身HTTP服务做测试。
+"""
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+from typing import Optional, Dict, List, Tuple
+import httpx
+from config import settings
+from instrumentation import LLM_PROVIDER_LATENCY, LLM_PROVIDER_REQUESTS, LLM_HEDGED_REQUESTS, LLM_TOKENS
+
+logger = logging.getLogger(__name__)
+
+EWMA_ALPHA = 0.3
+ERROR_PENALTY = 4.0  # 得分 = 耗时EWMA × (1 + ERROR_PENALTY × 错误率EWMA)
+FAILURE_THRESHOLD = 3  # 连续失败该次数后熔断
+MAX_ROUNDS = 3  # 所有供应商都可重试地失败时最多尝试的轮数
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504, 529}
+
+# 额外添加 User-Agent 避免被 WAF 拦截
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
+
+
+class ProviderError(Exception):
+    """单个供应商调用失败"""
+
+    def __init__(self, message: str, retryable: bool = True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class LLMUnavailable(Exception):
+    """没有可用的供应商，或所有供应商都失败"""
+
+
+class Completion:
+    """一次成功的生成：文本、胜出的供应商与消耗的 token 数"""
+    __slots__ = ("text", "provider", "tokens")
+
+    def __init__(self, text: str, provider: str, tokens: int):
+        self.text = text
+        self.provider = provider
+        self.tokens = tokens
+
+
+def estimate_tokens(text: str) -> int:
+    """供应商未返回用量时的估算：按 UTF-8 字节数 / 3（中文约一字一 token，英文约三四个字符一 token）"""
+    return len(text.encode("utf-8")) // 3 + 1
+
+
+class ProviderHealth:
+    """单个供应商的健康度统计（只在路由的事件循环线程中更新）"""
+    __slots__ = ("latency", "error_rate", "consecutive_failures", "open_until",
+                 "requests", "failures", "cancelled")
+
+    def __init__(self):
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.cancelled = 0
+
+    def is_open(self, now: float) -> bool:
+        return now < self.open_until
+
+    def score(self) -> float:
+        return (self.latency or 0.0) * (1 + ERROR_PENALTY * self.error_rate)
+
+    def record_success(self, seconds: float) -> None:
+        self.requests += 1
+        self.latency = seconds if self.latency is None else EWMA_ALPHA * seconds + (1 - EWMA_ALPHA) * self.latency
+        self.error_rate *= 1 - EWMA_ALPHA
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+
+    def record_failure(self, cooldown: float) -> None:
+        self.requests += 1
+        self.failures += 1
+        self.error_rate = EWMA_ALPHA + (1 - EWMA_ALPHA) * self.error_rate
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= FAILURE_THRESHOLD:
+            self.open_until = time.monotonic() + cooldown
+
+    def record_cancelled(self, seconds: float) -> None:
+        # 被对冲取消时真实耗时未知，已等待的时间是其下界：只在高于当前估计时计入，
+        # 否则一直输掉对冲的慢供应商永远没有耗时样本、始终排在最前
+        self.cancelled += 1
+        if self.latency is None or seconds > self.latency:
+            self.latency = seconds if self.latency is None else EWMA_ALPHA * seconds + (1 - EWMA_ALPHA) * self.latency
+
+
+class Provider:
+    """一个LLM供应商：kind 为 openai（OpenAI 兼容 chat/completions）或 anthropic（messages）"""
+
+    def __init__(self, name: str, kind: str, base_url: str, api_key: str, model: str):
+        self.name = name
+        self.kind = kind
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.model = model
+        self.health = ProviderHealth()
+
+    def build_request(self, messages: List[Dict], temperature: float, max_tokens: int) -> Tuple[str, Dict, Dict]:
+        if self.kind == "anthropic":
+            system = "\n\n".join(m["content"] for m in messages if m["role"] == "system")
+            payload = {
+                "model": self.model,
+                "messages": [m for m in messages if m["role"] != "system"],
+                "temperature": temperature,
+                "max_tokens": max_tokens,
+            }
+            if system:
+                payload["system"] = system
+            headers = {"x-api-key": self.api_key, "anthropic-version": "2023-06-01"}
+            return f"{self.base_url}/messages", headers, payload
+
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+        }
+        headers = {"Authorization": f"Bearer {self.api_key}", "User-Agent": USER_AGENT}
+        return f"{self.base_url}/chat/completions", headers, payload
+
+    def parse_response(self, body: Dict) -> str:
+        if self.kind == "anthropic":
+            return "".join(block.get("text", "") for block in body["content"] if block.get("type") == "text").strip()
+        return body["choices"][0]["message"]["content"].strip()
+
+    def parse_usage(self, body: Dict) -> Optional[int]:
+        usage = body.get("usage") or {}
+        if self.kind == "anthropic":
+            parts = (usage.get("input_tokens"), usage.get("output_tokens"))
+        else:
+            parts = (usage.get("prompt_tokens"), usage.get("completion_tokens"))
+        if any(part is None for part in parts):
+            return usage.get("total_tokens")
+        return sum(parts)
+
+
+def providers_from_settings() -> List[Provider]:
+    """按 AI_PROVIDERS 的顺序构造已配置 API Key 的供应商"""
+    available = {
+        "openai": lambda: Provider(
+            "openai", "openai",
+            settings.ai_service_url or "https://api.openai.com/v1",
+            settings.ai_service_api_key or settings.openai_api_key,
+            settings.ai_service_model or "gpt-4"
+        ),
+        "anthropic": lambda: Provider(
+            "anthropic", "anthropic", settings.anthropic_base_url,
+            settings.anthropic_api_key, settings.anthropic_model
+        ),
+        "grok": lambda: Provider(
+            "grok", "openai", settings.grok_base_url,
+            settings.grok_api_key, settings.grok_model
+        ),
+    }
+    providers = []
+    for name in dict.fromkeys(n.strip().lower() for n in settings.ai_providers.split(",") if n.strip()):
+        if name not in available:
+            logger.warning(f"Unknown LLM provider in AI_PROVIDERS: {name}")
+            continue
+        provider = available[name]()
+        if provider.api_key:
+            providers.append(provider)
+    return providers
+
+
+class LLMRouter:
+    def __init__(self, providers: List[Provider], hedge_after: float = 0.0,
+                 timeout: float = 60.0, cooldown: float = 30.0):
+        self.providers = providers
+        self.hedge_after = hedge_after
+        self.timeout = timeout
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self._pid: Optional[int] = None
+
+    def ranked(self) -> List[Provider]:
+        """最健康的在前；熔断中的供应商排在最后，仍可作为兜底"""
+        now = time.monotonic()
+        order = {provider.name: i for i, provider in enumerate(self.providers)}
+        return sorted(
+            self.providers,
+            key=lambda p: (p.health.is_open(now), p.health.score(), order[p.name])
+        )
+
+    def complete(self, messages: List[Dict], temperature: float = 0.7, max_tokens: int = 2500) -> Completion:
+        """同步调用：返回胜出的生成结果，全部失败时抛出 LLMUnavailable"""
+        if not self.providers:
+            raise LLMUnavailable("no LLM provider configured")
+        future = asyncio.run_coroutine_threadsafe(
+            self._complete(messages, temperature, max_tokens), self._ensure_loop()
+        )
+        return future.result()
+
+    def health_report(self) -> List[Dict]:
+        now = time.monotonic()
+        return [
+            {
+                "provider": p.name,
+                "model": p.model,
+                "base_url": p.base_url,
+                "latency_ms": round(p.health.latency * 1000, 1) if p.health.latency is not None else None,
+                "error_rate": round(p.health.error_rate, 4),
+                "circuit_open": p.health.is_open(now),
+                "requests": p.health.requests,
+                "failures": p.health.failures,
+                "cancelled": p.health.cancelled,
+            }
+            for p in self.ranked()
+        ]
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        # fork 后子进程没有父进程的事件循环线程，需要重新创建
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="eie-llm-router", daemon=True).start()
+                self._loop, self._client, self._pid = loop, None, os.getpid()
+            return self._loop
+
+    def _get_client(self) -> httpx.AsyncClient:
+        # 在事件循环线程中创建，连接池归属该循环
+        if self._client is None:
+            self._client = httpx.AsyncClient(verify=settings.ai_verify_ssl, timeout=self.timeout)
+        return self._client
+
+    async def _complete(self, messages: List[Dict], temperature: float, max_tokens: int) -> Completion:
+        errors: List[str] = []
+        for attempt in range(MAX_ROUNDS):
+            if attempt:
+                wait_time = (2 ** (attempt - 1)) + random.uniform(0, 1)
+                logger.warning(f"All LLM providers failed, retrying in {wait_time:.1f}s...")
+                await asyncio.sleep(wait_time)
+            result, retryable = await self._round(messages, temperature, max_tokens, errors)
+            if result is not None:
+                return result
+            if not retryable:
+                break
+        raise LLMUnavailable("; ".join(errors))
+
+    async def _round(self, messages: List[Dict], temperature: float, max_tokens: int,
+                     errors: List[str]) -> Tuple[Optional[Completion], bool]:
+        """按健康度依次尝试所有供应商一轮，返回 (结果, 失败是否都可重试)"""
+        remaining = self.ranked()
+        running: Dict[asyncio.Task, Provider] = {}
+        retryable = True
+        hedged = False
+
+        def launch() -> None:
+            provider = remaining.pop(0)
+            task = asyncio.ensure_future(self._call(provider, messages, temperature, max_tokens))
+            running[task] = provider
+
+        launch()
+        while running:
+            timeout = None
+            if self.hedge_after > 0 and not hedged and remaining and len(running) == 1:
+                timeout = self.hedge_after
+            done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                hedged = True
+                LLM_HEDGED_REQUESTS.inc((remaining[0].name,))
+                logger.info(f"LLM request exceeded {self.hedge_after}s, hedging to {remaining[0].name}")
+                launch()
+                continue
+
+            for task in done:
+                provider = running.pop(task)
+                try:
+                    result = task.result()
+                except ProviderError as e:
+                    errors.append(f"{provider.name}: {e}")
+                    retryable = retryable and e.retryable
+                    continue
+                for loser in running:
+                    loser.cancel()
+                await asyncio.gather(*running, return_exceptions=True)
+                return result, True
+
+            if not running and remaining:
+                launch()
+        return None, retryable
+
+    async def _call(self, provider: Provider, messages: List[Dict], temperature: float, max_tokens: int) -> Completion:
+        url, headers, payload = provider.build_request(messages, temperature, max_tokens)
+        logger.info(f"Calling LLM provider {provider.name}: {url} (model: {provider.model})")
+        started = time.perf_counter()
+        try:
+            response = await self._get_client().post(url, headers=headers, json=payload)
+            if response.status_code != 200:
+                raise ProviderError(
+                    f"HTTP {response.status_code} - {response.text[:500]}",
+                    retryable=response.status_code in RETRYABLE_STATUS
+                )
+            body = response.json()
+            text = provider.parse_response(body)
+            if not text:
+                raise ProviderError("empty completion")
+            tokens = provider.parse_usage(body)
+        except asyncio.CancelledError:
+            provider.health.record_cancelled(time.perf_counter() - started)
+            LLM_PROVIDER_REQUESTS.inc((provider.name, "cancelled"))
+            raise
+        except (ProviderError, httpx.HTTPError, ValueError, KeyError, IndexError, TypeError) as e:
+            provider.health.record_failure(self.cooldown)
+            LLM_PROVIDER_REQUESTS.inc((provider.name, "error"))
+            logger.error(f"LLM provider {provider.name} failed: {e!r}")
+            if isinstance(e, ProviderError):
+                raise
+            raise ProviderError(repr(e), retryable=isinstance(e, httpx.TransportError)) from e
+
+        elapsed = time.perf_counter() - started
+        provider.health.record_success(elapsed)
+        LLM_PROVIDER_LATENCY.observe((provider.name,), elapsed)
+        LLM_PROVIDER_REQUESTS.inc((provider.name, "ok"))
+        if tokens is None:
+            tokens = sum(estimate_tokens(m["content"]) for m in messages) + estimate_tokens(text)
+        LLM_TOKENS.inc((provider.name,), tokens)
+        return Completion(text, provider.name, tokens)
+
+
+router = LLMRouter(
+    providers_from_settings(),
+    hedge_after=settings.ai_hedge_after_seconds,
+    timeout=settings.ai_request_timeout,
+    cooldown=settings.ai_provider_cooldown_seconds,
+)
@@ -1,17 +1,78 @@
 """FastAPI主应用"""
-from fastapi import FastAPI, Depends, HTTPException
+import diagnostics
+diagnostics.start_import_timer()
+
+import re
+import time
+import asyncio
+import logging
+from functools import wraps
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.routing import APIRoute
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from sqlalchemy import desc
 from typing import List, Optional
 import crud
 import schemas
-from database import get_db, engine, Base
+import instrumentation
+from ai_service import inflight_calls
+import serialization
+import events
+import ai_refresh
+from config import settings
+from serialization import FastJSONResponse, FieldSelectorError
+from models import CompanyType
+from screener import ScreenQueryError
+from search_index import SearchQueryError
+from change_log import ChangeCursorError, MAX_LIMIT as CHANGES_MAX_LIMIT
+from database import get_db
+
+# 导入时不连接数据库；建表与索引由 python manage.py migrate 完成
+diagnostics.finish_import_timer()
+
+logger = logging.getLogger(__name__)
+
+
+
+class TimedRoute(APIRoute):
+    """记录路由模板与处理函数耗时；处理函数返回到响应开始之间记为序列化耗时"""
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        def enter():
+            timings = instrumentation.current()
+            if timings is not None:
+                timings.route = path
+            return timings, time.perf_counter()
+
+        def leave(timings, started):
+            if timings is not None:
+                timings.endpoint_finished = time.perf_counter()
+                timings.add("endpoint", timings.endpoint_finished - started)
+
+        if asyncio.iscoroutinefunction(endpoint):
+            @wraps(endpoint)
+            async def timed_endpoint(*args, **kwargs):
+                timings, started = enter()
+                try:
+                    return await endpoint(*args, **kwargs)
+                finally:
+                    leave(timings, started)
+        else:
+            @wraps(endpoint)
+            def timed_endpoint(*args, **kwargs):
+                timings, started = enter()
+                try:
+                    return endpoint(*args, **kwargs)
+                finally:
+                    leave(timings, started)
+
+        super().__init__(path, timed_endpoint, **kwargs)
 
-# 创建数据库表
-Base.metadata.create_all(bind=engine)
 
 app = FastAPI(title="Equity Insight Engine API", version="1.0.0")
+app.router.route_class = TimedRoute
 
 # 配置CORS
 app.add_middleware(
@@ -20,14 +81,113 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
 
 
+@app.on_event("startup")
+def startup_ready():
+    if settings.ai_refresh_enabled:
+        ai_refresh.scheduler.start()
+    diagnostics.mark_ready()
+
+
+@app.on_event("shutdown")
+def drain_llm_calls():
+    """进程退出前等待进行中的LLM调用完成（如后台生成），避免结果丢失"""
+    ai_refresh.scheduler.stop()
+    if inflight_calls.count and not inflight_calls.wait_idle(settings.graceful_timeout):
+        logger.warning(f"Shutting down with {inflight_calls.count} LLM calls still in flight")
+
+
+@app.middleware("http")
+async def request_timing(request: Request, call_next):
+    """为每个请求记录分阶段耗时，输出 Server-Timing 头并汇总到 /metrics"""
+    token = instrumentation.start_request()
+    timings = instrumentation.current()
+    try:
+        response = await call_next(request)
+    finally:
+        instrumentation.end_request(token)
+    
+    finished = time.perf_counter()
+    if timings.endpoint_finished is not None:
+        timings.add("serialize", finished - timings.endpoint_finished)
+    total = finished - timings.started
+    response.headers["Server-Timing"] = timings.server_timing(total)
+    instrumentation.record_request(request.method, response.status_code, timings, total)
+    return response
+
+
 @app.get("/")
 def root():
     return {"message": "Equity Insight Engine API"}
 
 
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """Prometheus 指标（文本格式）"""
+    return Response(instrumentation.render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/api/diagnostics/startup")
+def startup_diagnostics(limit: int = Query(30, ge=1, le=500)):
+    """当前进程的启动耗时：main 导入总耗时与最慢的模块导入（累计/自身）"""
+    return diagnostics.startup_report(limit)
+
+
+@app.get("/api/diagnostics/ai-refresh")
+def ai_refresh_diagnostics():
+    """综合AI分析定时刷新的状态：时段、预算用量、进行中的任务"""
+    return ai_refresh.scheduler.status()
+
+
+@app.get("/api/diagnostics/llm")
+def llm_diagnostics():
+    """当前进程中各LLM供应商的健康度，按路由优先级排序"""
+    from llm_router import router
+    return {"hedge_after_seconds": router.hedge_after, "providers": router.health_report()}
+
+
+# 变更事件推送
+@app.get("/api/events")
+async def stream_events(
+    request: Request,
+    company_id: Optional[str] = Query(None, description="逗号分隔的公司ID，缺省接收全部公司"),
+    types: Optional[str] = Query(None, description="analysis-completed,quarter-changed,company-changed 的子集"),
+):
+    """Server-Sent Events：AI分析完成、季度变更、公司变更"""
+    try:
+        company_ids = {int(part) for part in company_id.split(",") if part.strip()} if company_id else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="company_id 应为逗号分隔的整数")
+    event_types = {part.strip() for part in types.split(",") if part.strip()} if types else None
+    if event_types and not event_types <= set(events.EVENT_TYPES):
+        raise HTTPException(status_code=400, detail=f"types 只能是 {', '.join(events.EVENT_TYPES)}")
+    
+    subscriber = events.broker.subscribe(company_ids, event_types)
+    
+    async def stream():
+        try:
+            # 建立连接后立即发送一条注释，便于客户端和代理确认连接已打开
+            yield ": connected\n\n"
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(subscriber.queue.get(), settings.events_heartbeat_seconds)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield events.format_sse(event)
+        finally:
+            events.broker.unsubscribe(subscriber)
+    
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 # 公司相关API
 @app.post("/api/companies", response_model=schemas.CompanyResponse)
 def create_company(company: schemas.CompanyCreate, db: Session = Depends(get_db)):
@@ -38,16 +198,63 @@ def create_company(company: schemas.CompanyCreate, db: Session = Depends(get_db)
 @app.get("/api/companies", response_model=List[schemas.CompanyCardResponse])
 def get_companies(db: Session = Depends(get_db)):
     """获取所有公司（首页卡片数据）"""
-    return crud.get_companies_with_summary(db)
+    return FastJSONResponse(crud.get_companies_with_summary(db))
+
+
+def _field_selection(fields: Optional[str], include: Optional[str]):
+    try:
+        return serialization.parse_fields(fields), serialization.parse_include(include)
+    except FieldSelectorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.post("/api/companies/batch", response_model=schemas.CompanyBatchResponse)
+def get_companies_batch(request: schemas.CompanyBatchRequest, db: Session = Depends(get_db)):
+    """批量获取公司详情（一次请求代替逐个 GET /api/companies/{id}），结果按 id 索引"""
+    result = crud.get_companies_batch(db, request.ids, *_field_selection(request.fields, request.include))
+    return FastJSONResponse(result)
 
 
 @app.get("/api/companies/{company_id}", response_model=schemas.CompanyDetailResponse)
-def get_company(company_id: int, db: Session = Depends(get_db)):
+def get_company(
+    company_id: int,
+    fields: Optional[str] = Query(None, description="季度字段白名单，如 quarter,roic,wacc"),
+    include: Optional[str] = Query(None, description="system_analysis,system_summary,ai_analysis,comprehensive_ai 的子集，默认全部"),
+    db: Session = Depends(get_db)
+):
     """获取公司详情（包含所有季度数据）"""
-    company = crud.get_company_detail(db, company_id)
+    company = crud.get_company_detail(db, company_id, *_field_selection(fields, include))
     if not company:
         raise HTTPException(status_code=404, detail="公司不存在")
-    return company
+    return FastJSONResponse(company)
+
+
+@app.get("/api/companies/{company_id}/series", response_model=schemas.CompanySeriesResponse)
+def get_company_series(
+    company_id: int,
+    metrics: str = Query(
+        "roic,wacc,quality_score,valuation_score,trend_score",
+        description="逗号分隔的指标，如 roic,wacc,valuation_score"
+    ),
+    from_quarter: Optional[str] = Query(None, alias="from", description="起始季度（含），如 2022-Q1"),
+    to_quarter: Optional[str] = Query(None, alias="to", description="结束季度（含），如 2024-Q4"),
+    max_points: Optional[int] = Query(None, ge=1, le=1000, description="超过该点数时等间隔降采样"),
+    db: Session = Depends(get_db)
+):
+    """图表用的列式时间序列（不含AI文本与系统摘要）"""
+    for value in (from_quarter, to_quarter):
+        if value is not None and not re.match(r"^\d{4}-Q[1-4]$", value):
+            raise HTTPException(status_code=400, detail="季度格式应为 YYYY-QN")
+    names = list(dict.fromkeys(name.strip() for name in metrics.split(",") if name.strip()))
+    if not names:
+        raise HTTPException(status_code=400, detail="至少需要一个指标")
+    try:
+        series = crud.get_company_series(db, company_id, names, from_quarter, to_quarter, max_points)
+    except crud.SeriesMetricError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if series is None:
+        raise HTTPException(status_code=404, detail="公司不存在")
+    return series
 
 
 @app.put("/api/companies/{company_id}", response_model=schemas.CompanyResponse)
@@ -75,13 +282,61 @@ def create_quarter(quarter: schemas.QuarterCreate, db: Session = Depends(get_db)
     return crud.create_quarter_with_analysis(db, quarter)
 
 
+@app.put("/api/companies/{company_id}/quarters/{quarter}", response_model=schemas.QuarterUpsertResponse)
+def upsert_quarter(
+    company_id: int,
+    quarter: str,
+    values: schemas.QuarterValues,
+    response: Response,
+    db: Session = Depends(get_db)
+):
+    """按公司与季度幂等写入（不存在则创建，存在则整体替换指标）；值未变化时不重新分析"""
+    if not re.match(r"^\d{4}-Q[1-4]$", quarter):
+        raise HTTPException(status_code=400, detail="季度格式应为 YYYY-QN")
+    result = crud.upsert_quarter_with_analysis(db, company_id, quarter, values)
+    if result is None:
+        raise HTTPException(status_code=404, detail="公司不存在")
+    if result["created"]:
+        response.status_code = 201
+    return {
+        **schemas.QuarterResponse.model_validate(result["quarter"]).model_dump(),
+        "created": result["created"],
+        "changed": result["changed"],
+    }
+
+
+@app.get("/api/quarters", response_model=schemas.QuarterBatchResponse)
+def get_quarters_batch(
+    ids: str = Query(..., description="逗号分隔的季度ID，如 1,2,3"),
+    fields: Optional[str] = Query(None, description="季度字段白名单，如 quarter,roic,wacc"),
+    include: Optional[str] = Query(None, description="system_analysis,system_summary,ai_analysis 的子集，默认全部"),
+    db: Session = Depends(get_db)
+):
+    """批量获取季度详情（含系统分析与AI分析），结果按 id 索引"""
+    try:
+        quarter_ids = [int(part) for part in ids.split(",") if part.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids 应为逗号分隔的整数")
+    if not quarter_ids:
+        raise HTTPException(status_code=400, detail="至少需要一个季度ID")
+    if len(quarter_ids) > schemas.BATCH_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"一次最多 {schemas.BATCH_MAX_IDS} 个季度ID")
+    result = crud.get_quarters_batch(db, quarter_ids, *_field_selection(fields, include))
+    return FastJSONResponse(result)
+
+
 @app.get("/api/quarters/{quarter_id}", response_model=schemas.QuarterDetailResponse)
-def get_quarter(quarter_id: int, db: Session = Depends(get_db)):
+def get_quarter(
+    quarter_id: int,
+    fields: Optional[str] = Query(None, description="季度字段白名单，如 quarter,roic,wacc"),
+    include: Optional[str] = Query(None, description="system_analysis,system_summary,ai_analysis 的子集，默认全部"),
+    db: Session = Depends(get_db)
+):
     """获取季度详情"""
-    quarter = crud.get_quarter_detail(db, quarter_id)
+    quarter = crud.get_quarter_detail(db, quarter_id, *_field_selection(fields, include))
     if not quarter:
         raise HTTPException(status_code=404, detail="季度数据不存在")
-    return quarter
+    return FastJSONResponse(quarter)
 
 
 @app.put("/api/quarters/{quarter_id}", response_model=schemas.QuarterResponse)
@@ -121,6 +376,24 @@ def generate_quarter_ai(quarter_id: int, db: Session = Depends(get_db)):
     return {"message": "AI分析生成成功", "analysis": result}
 
 
+@app.get("/api/quarters/{quarter_id}/ai/versions", response_model=List[schemas.AIAnalysisVersionSummary])
+def list_quarter_ai_versions(quarter_id: int, db: Session = Depends(get_db)):
+    """单季度AI分析的历史版本（新到旧，不含文本）"""
+    versions = crud.get_quarter_ai_versions(db, quarter_id)
+    if versions is None:
+        raise HTTPException(status_code=404, detail="季度数据不存在")
+    return versions
+
+
+@app.get("/api/quarters/{quarter_id}/ai/versions/{version_id}", response_model=schemas.AIAnalysisVersionResponse)
+def get_quarter_ai_version(quarter_id: int, version_id: int, db: Session = Depends(get_db)):
+    """读取单季度AI分析的某个历史版本"""
+    version = crud.get_quarter_ai_version(db, quarter_id, version_id)
+    if version is None:
+        raise HTTPException(status_code=404, detail="AI分析版本不存在")
+    return version
+
+
 @app.get("/api/companies/{company_id}/comprehensive-ai", response_model=schemas.CompanyComprehensiveAIResponse)
 def get_comprehensive_ai(company_id: int, db: Session = Depends(get_db)):
     """获取公司综合AI分析"""
@@ -130,6 +403,24 @@ def get_comprehensive_ai(company_id: int, db: Session = Depends(get_db)):
     return ai
 
 
+@app.get("/api/companies/{company_id}/comprehensive-ai/versions", response_model=List[schemas.AIAnalysisVersionSummary])
+def list_comprehensive_ai_versions(company_id: int, db: Session = Depends(get_db)):
+    """公司综合AI分析的历史版本（新到旧，不含文本）"""
+    versions = crud.get_comprehensive_ai_versions(db, company_id)
+    if versions is None:
+        raise HTTPException(status_code=404, detail="公司不存在")
+    return versions
+
+
+@app.get("/api/companies/{company_id}/comprehensive-ai/versions/{version_id}", response_model=schemas.AIAnalysisVersionResponse)
+def get_comprehensive_ai_version(company_id: int, version_id: int, db: Session = Depends(get_db)):
+    """读取公司综合AI分析的某个历史版本"""
+    version = crud.get_comprehensive_ai_version(db, company_id, version_id)
+    if version is None:
+        raise HTTPException(status_code=404, detail="AI分析版本不存在")
+    return version
+
+
 @app.post("/api/companies/{company_id}/comprehensive-ai/generate")
 def generate_comprehensive_ai(company_id: int, db: Session = Depends(get_db)):
     """手动触发生成公司综合AI分析"""
@@ -138,3 +429,152 @@ def generate_comprehensive_ai(company_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="公司不存在或季度数据不足")
     return {"message": "综合AI分析生成成功", "analysis": result}
 
+
+# 组合API
+@app.get("/api/portfolios", response_model=List[schemas.PortfolioSummaryResponse])
+def list_portfolios(db: Session = Depends(get_db)):
+    """所有组合及其加权聚合值"""
+    return crud.get_portfolios(db)
+
+
+@app.post("/api/portfolios", response_model=schemas.PortfolioDetailResponse)
+def create_portfolio(portfolio: schemas.PortfolioCreate, db: Session = Depends(get_db)):
+    """创建组合（可同时添加成员）"""
+    try:
+        return crud.create_portfolio(db, portfolio)
+    except crud.PortfolioError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/api/portfolios/{portfolio_id}", response_model=schemas.PortfolioDetailResponse)
+def get_portfolio(portfolio_id: int, db: Session = Depends(get_db)):
+    """组合详情：聚合值与成员最新季度快照"""
+    portfolio = crud.get_portfolio(db, portfolio_id)
+    if not portfolio:
+        raise HTTPException(status_code=404, detail="组合不存在")
+    return portfolio
+
+
+@app.put("/api/portfolios/{portfolio_id}", response_model=schemas.PortfolioDetailResponse)
+def update_portfolio(portfolio_id: int, portfolio_update: schemas.PortfolioUpdate, db: Session = Depends(get_db)):
+    """修改组合名称或描述"""
+    try:
+        portfolio = crud.update_portfolio(db, portfolio_id, portfolio_update)
+    except crud.PortfolioError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not portfolio:
+        raise HTTPException(status_code=404, detail="组合不存在")
+    return portfolio
+
+
+@app.delete("/api/portfolios/{portfolio_id}")
+def delete_portfolio(portfolio_id: int, db: Session = Depends(get_db)):
+    """删除组合"""
+    if not crud.delete_portfolio(db, portfolio_id):
+        raise HTTPException(status_code=404, detail="组合不存在")
+    return {"message": "删除成功"}
+
+
+@app.put("/api/portfolios/{portfolio_id}/members/{company_id}", response_model=schemas.PortfolioDetailResponse)
+def set_portfolio_member(portfolio_id: int, company_id: int, body: schemas.PortfolioWeight, db: Session = Depends(get_db)):
+    """添加成员或修改权重"""
+    try:
+        portfolio = crud.set_portfolio_member(db, portfolio_id, company_id, body.weight)
+    except crud.PortfolioError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    if not portfolio:
+        raise HTTPException(status_code=404, detail="组合不存在")
+    return portfolio
+
+
+@app.delete("/api/portfolios/{portfolio_id}/members/{company_id}", response_model=schemas.PortfolioDetailResponse)
+def remove_portfolio_member(portfolio_id: int, company_id: int, db: Session = Depends(get_db)):
+    """移除成员"""
+    portfolio = crud.remove_portfolio_member(db, portfolio_id, company_id)
+    if not portfolio:
+        raise HTTPException(status_code=404, detail="组合或成员不存在")
+    return portfolio
+
+
+# 筛选API
+@app.get("/api/screen", response_model=schemas.ScreenResponse)
+def screen(
+    q: Optional[str] = Query(None, description='过滤表达式，如: roic - wacc > 5 and valuation_score > 70 and trend_score rising'),
+    quarter: str = Query("latest", description="latest（各公司最新季度）、all 或具体季度如 2024-Q3"),
+    company_type: Optional[CompanyType] = None,
+    sort: Optional[str] = Query(None, description="排序字段，前缀 - 表示倒序，如 -valuation_score"),
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_db)
+):
+    """按指标与系统得分筛选公司"""
+    if quarter not in ("latest", "all") and not re.match(r"^\d{4}-Q[1-4]$", quarter):
+        raise HTTPException(status_code=400, detail="季度格式应为 latest、all 或 YYYY-QN")
+    try:
+        return crud.screen_companies(db, q, quarter, company_type, sort, limit)
+    except ScreenQueryError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+# 全文检索API
+@app.get("/api/search", response_model=schemas.SearchResponse)
+def search_analyses(
+    q: str = Query(..., description="检索词，空白分隔的多个词须同时命中，如: 资本开支 ROIC拐点"),
+    kind: Optional[str] = Query(None, description="quarter_ai,system_summary,comprehensive_ai 的子集，默认全部"),
+    company_id: Optional[int] = None,
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_db)
+):
+    """在单季度AI分析、系统摘要与综合AI分析中检索，按相关度返回摘录与高亮区间"""
+    kinds = [name.strip() for name in kind.split(",") if name.strip()] if kind else None
+    try:
+        return crud.search_analyses(db, q, kinds, company_id, limit)
+    except SearchQueryError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+# 变更日志（增量同步）API
+@app.get("/api/changes", response_model=schemas.ChangeFeedResponse)
+def list_changes(
+    cursor: Optional[str] = Query(None, description="上次返回的 next_cursor；为空从头读取，latest 只返回当前末尾的游标"),
+    limit: int = Query(500, ge=1, le=CHANGES_MAX_LIMIT),
+    entity: Optional[str] = Query(None, description="company,quarter,system_analysis,quarter_ai,comprehensive_ai 的子集，默认全部"),
+    company_id: Optional[int] = None,
+    db: Session = Depends(get_db)
+):
+    """增量同步：按提交顺序返回游标之后的变更，has_more 为真时立即用 next_cursor 继续拉取"""
+    entities = [name.strip() for name in entity.split(",") if name.strip()] if entity else None
+    try:
+        return crud.get_changes(db, cursor, limit, entities, company_id)
+    except ChangeCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+# 行业聚合统计
+@app.get("/api/sectors/{company_type}/stats", response_model=schemas.SectorStatsResponse)
+def get_sector_stats(
+    company_type: CompanyType,
+    quarter: Optional[str] = Query(None, description="具体季度如 2024-Q3，默认该类型最新季度"),
+    db: Session = Depends(get_db)
+):
+    """同类型公司在某季度的指标分布（中位数、四分位、直方图），只读取预计算结果"""
+    if quarter is not None and not re.match(r"^\d{4}-Q[1-4]$", quarter):
+        raise HTTPException(status_code=400, detail="季度格式应为 YYYY-QN")
+    stats = crud.get_sector_stats(db, company_type, quarter)
+    if stats is None:
+        raise HTTPException(status_code=404, detail="暂无该类型的行业统计")
+    return stats
+
+
+@app.get("/api/labels", response_model=schemas.LabelFacetResponse)
+def get_label_facets(
+    quarter: str = Query("latest", description="latest（各公司最新季度）、all 或具体季度如 2024-Q3"),
+    company_type: Optional[CompanyType] = None,
+    db: Session = Depends(get_db)
+):
+    """标签分面计数（按公司类型与季度），只读取预计算结果
+
+    按标签筛选公司使用筛选接口，如 /api/screen?q=labels has "基本面走弱"（走标签索引）。
+    """
+    if quarter not in ("latest", "all") and not re.match(r"^\d{4}-Q[1-4]$", quarter):
+        raise HTTPException(status_code=400, detail="季度格式应为 latest、all 或 YYYY-QN")
+    return crud.get_label_facets(db, company_type, quarter)
@@ -0,0 +1,197 @@
+"""管理命令
+
+    python manage.py migrate                 # 创建缺失的表与索引，为已有表补充新增的可空列（幂等）
+    python manage.py refresh-sector-stats    # 全量重建行业聚合统计（含标签计数）
+    python manage.py rebuild-metrics-store   # 全表扫描重建列式指标快照
+    python manage.py check-screener-parity   # 比对筛选在列式快照与SQL上的结果与顺序（不一致时退出码为 1）
+    python manage.py rebuild-portfolios      # 从成员快照全量重算组合聚合（修复浮点累计误差）
+    python manage.py reindex                 # 全量重建全文检索索引（AI分析、系统摘要）
+    python manage.py refresh-stale-ai        # 立即刷新一批过期的综合AI分析（不受刷新时段限制，受预算与并发限制）
+    python manage.py prune-changes           # 删除超过保留天数的变更日志（CHANGE_LOG_RETENTION_DAYS）
+
+应用导入时不再自动建表，部署或首次运行前执行一次 migrate。
+"""
+import argparse
+import time
+
+
+def migrate() -> None:
+    from sqlalchemy import inspect
+    from database import Base, engine
+    import models  # noqa: F401  注册全部表
+
+    before = set(inspect(engine).get_table_names())
+    Base.metadata.create_all(bind=engine)
+    created = sorted(set(Base.metadata.tables) - before)
+    added = add_missing_columns(engine, Base.metadata, before)
+    indexed = add_missing_indexes(engine, Base.metadata, before)
+    if not created and not added and not indexed:
+        print("表结构已是最新")
+        return
+    if created:
+        print(f"已创建 {len(created)} 张表: {', '.join(created)}")
+    for name in added:
+        print(f"已添加列: {name}")
+    for name in indexed:
+        print(f"已创建索引: {name}")
+
+
+def add_missing_columns(engine, metadata, tables) -> list:
+    """为已有表补充模型中新增的可空列（不含约束），返回添加的 表.列"""
+    from sqlalchemy import inspect, text
+
+    inspector = inspect(engine)
+    added = []
+    with engine.begin() as connection:
+        for table_name in sorted(tables & set(metadata.tables)):
+            existing = {column["name"] for column in inspector.get_columns(table_name)}
+            for column in metadata.tables[table_name].columns:
+                if column.name in existing:
+                    continue
+                if not column.nullable:
+                    print(f"跳过非空列 {table_name}.{column.name}，请手动迁移")
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                connection.execute(text(f'ALTER TABLE {table_name} ADD COLUMN {column.name} {column_type}'))
+                added.append(f"{table_name}.{column.name}")
+    return added
+
+
+def add_missing_indexes(engine, metadata, tables) -> list:
+    """为已有表创建模型中新增的索引（create_all 跳过已存在的表，不会补建其索引），返回创建的索引名"""
+    from sqlalchemy import inspect
+
+    inspector = inspect(engine)
+    created = []
+    with engine.begin() as connection:
+        for table_name in sorted(tables & set(metadata.tables)):
+            existing = {index["name"] for index in inspector.get_indexes(table_name)}
+            for index in sorted(metadata.tables[table_name].indexes, key=lambda item: item.name):
+                if index.name in existing:
+                    continue
+                index.create(connection, checkfirst=True)
+                created.append(index.name)
+    return created
+
+
+def refresh_sector_stats() -> None:
+    import sector_stats
+    from database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        count = sector_stats.refresh_all(db)
+        db.commit()
+        print(f"已重建 {count} 个行业分组的统计")
+    finally:
+        db.close()
+
+
+def rebuild_metrics_store() -> None:
+    from metrics_store import store
+    from database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        store.rebuild(db)
+        print(f"已重建列式指标快照: {store.snapshot().shape[0]} 行")
+    finally:
+        db.close()
+
+
+def check_screener_parity() -> None:
+    import sys
+    import screener
+    from metrics_store import store
+    from database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        mismatches = screener.parity_mismatches(db, store)
+    finally:
+        db.close()
+    if not mismatches:
+        print("列式快照与SQL的筛选结果一致")
+        return
+    for mismatch in mismatches:
+        print(f"不一致: expression={mismatch['expression']!r} sort={mismatch['sort']} quarter={mismatch['quarter']}")
+        print(f"  SQL:  {mismatch['sql']}")
+        print(f"  快照: {mismatch['store']}")
+    sys.exit(1)
+
+
+def rebuild_portfolios() -> None:
+    import portfolios
+    from database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        count = portfolios.rebuild(db)
+        db.commit()
+        print(f"已重算 {count} 个组合的聚合")
+    finally:
+        db.close()
+
+
+def reindex() -> None:
+    import search_index
+    from database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        count = search_index.rebuild(db)
+        db.commit()
+        print(f"已重建检索索引: {count} 个文档")
+    finally:
+        db.close()
+
+
+def refresh_stale_ai() -> None:
+    from ai_refresh import scheduler
+
+    submitted = scheduler.tick(ignore_window=True)
+    scheduler.drain()
+    status = scheduler.status()
+    print(f"已刷新 {status['completed']} 家公司的综合AI分析（提交 {submitted}，失败 {status['failed']}），"
+          f"今日已用 {status['tokens_used']}/{status['daily_token_budget']} tokens")
+
+
+def prune_changes() -> None:
+    from datetime import timedelta
+    import change_log
+    from config import settings
+    from database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        count = change_log.prune(db, timedelta(days=settings.change_log_retention_days))
+        db.commit()
+        print(f"已删除 {count} 条超过 {settings.change_log_retention_days} 天的变更记录")
+    finally:
+        db.close()
+
+
+COMMANDS = {
+    "migrate": migrate,
+    "refresh-sector-stats": refresh_sector_stats,
+    "rebuild-metrics-store": rebuild_metrics_store,
+    "check-screener-parity": check_screener_parity,
+    "rebuild-portfolios": rebuild_portfolios,
+    "reindex": reindex,
+    "refresh-stale-ai": refresh_stale_ai,
+    "prune-changes": prune_changes,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Equity Insight Engine 管理命令")
+    parser.add_argument("command", choices=sorted(COMMANDS))
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    COMMANDS[args.command]()
+    print(f"完成，用时 {time.perf_counter() - started:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+"""列式指标存储 - 全部季度指标与系统得分的进程级内存快照
+
+所有 (公司, 季度) 行按 company_id、季度排序，存放在一个列优先（Fortran order）的
+float64 矩阵中，每一列即一段连续的 NumPy 数组，空值用 NaN 表示。
+
+矩阵带一个数据库水位：它已包含的最后一条变更日志（change_log）的游标。
+- 首次使用时优先以内存映射方式加载快照文件（.npy 与记录水位的 .watermark），
+  没有快照时全表扫描
+- 每次读取（ensure_loaded）及 crud 写入提交后，读取水位之后的变更日志，按其中涉及的
+  季度、公司从数据库重新读取对应行，再推进水位。矩阵只取决于数据库中已提交的数据，
+  不依赖调用方传入的值；某次同步失败或其他进程的写入，都会在下次读取时补上
+- 水位之后的日志已被清理（prune-changes）或待追平的变更过多时改为全表扫描重建
+- 快照只用于重启或新进程的热启动，累计 PERSIST_EVERY 条变更才重写一次，不随每次写入落盘
+"""
+import os
+import zlib
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Optional, List, Set
+import numpy as np
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+import models
+import change_log
+from config import settings
+from quarter_metrics import METRIC_FIELDS
+from screener import SCORE_FIELDS
+
+try:
+    import fcntl
+except ImportError:  # Windows 下没有 fcntl，多个进程落盘快照时不加锁
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+COMPANY_TYPES = list(models.CompanyType)
+KEY_COLUMNS = ("quarter_id", "company_id", "period", "company_type")
+VALUE_COLUMNS = METRIC_FIELDS + SCORE_FIELDS
+COLUMNS = KEY_COLUMNS + VALUE_COLUMNS
+COLUMN_INDEX = {name: index for index, name in enumerate(COLUMNS)}
+
+# 累计这么多条变更后重写快照文件
+PERSIST_EVERY = 500
+# 待追平的变更超过这么多条时直接全表扫描重建
+CATCH_UP_MAX_CHANGES = 20000
+# 排序键 company_id * PERIOD_SPAN + period（period_code 远小于该值，float64 内精确）
+PERIOD_SPAN = 1 << 16
+
+# 列定义变化后旧快照自动失效（文件名带列签名）
+SNAPSHOT_SIGNATURE = f"{zlib.crc32(','.join(COLUMNS).encode()):08x}"
+
+
+def period_code(quarter: str) -> int:
+    """"2024-Q3" -> 2024 * 4 + 2，保证数值顺序与季度顺序一致"""
+    year, q = quarter.split("-Q")
+    return int(year) * 4 + int(q) - 1
+
+
+def period_label(code: int) -> str:
+    """period_code 的逆运算"""
+    code = int(code)
+    return f"{code // 4}-Q{code % 4 + 1}"
+
+
+def _to_float(value) -> float:
+    return float(value) if value is not None else np.nan
+
+
+class MetricsStore:
+    """进程级列式指标存储
+
+    矩阵在每次修改时整体替换（写时复制），读者拿到的 snapshot() 永远不会被原地修改，
+    因此读取无需加锁。
+    """
+
+    def __init__(self, snapshot_dir: Optional[str] = None):
+        self.snapshot_path = (
+            os.path.join(snapshot_dir, f"metrics_snapshot_{SNAPSHOT_SIGNATURE}.npy")
+            if snapshot_dir else None
+        )
+        self.watermark_path = f"{self.snapshot_path}.watermark" if self.snapshot_path else None
+        self._lock = threading.RLock()
+        self._matrix = np.empty((0, len(COLUMNS)), order="F")
+        # 矩阵已包含的最后一条变更的游标；"" 表示构建时日志为空
+        self.watermark: Optional[str] = None
+        self._unpersisted = 0
+        self.loaded = False
+
+    # 读取
+    def snapshot(self) -> np.ndarray:
+        """当前矩阵（只读约定）"""
+        return self._matrix
+
+    @staticmethod
+    def column(matrix: np.ndarray, name: str) -> np.ndarray:
+        return matrix[:, COLUMN_INDEX[name]]
+
+    @staticmethod
+    def type_code(company_type: models.CompanyType) -> int:
+        return COMPANY_TYPES.index(company_type)
+
+    period_code = staticmethod(period_code)
+    period_label = staticmethod(period_label)
+
+    def ensure_loaded(self, db: Session) -> np.ndarray:
+        """返回追平到数据库已提交变更的矩阵：首次调用时映射快照或全表扫描，之后从变更日志追平"""
+        with self._lock:
+            if not self.loaded:
+                if not self._load_snapshot():
+                    self.rebuild(db)
+                self.loaded = True
+            self._catch_up(db)
+            return self._matrix
+
+    def sync(self, db: Session) -> None:
+        """写入提交后由 crud 调用；本进程尚未加载时什么都不做（首次读取时会一并追平）"""
+        with self._lock:
+            if self.loaded:
+                self._catch_up(db)
+
+    def rebuild(self, db: Session) -> None:
+        """全表扫描重建矩阵并落盘"""
+        # 先取水位再扫描：扫描到的行不会比水位旧，之后从水位重放的变更只会重复读取同样的行
+        watermark = change_log.read(db, change_log.LATEST)["next_cursor"]
+        rows = self._query_rows(db)
+        with self._lock:
+            self._matrix = self._sorted(self._build(rows))
+            self.watermark = watermark
+            self.loaded = True
+            self._persist()
+        logger.info(f"Metrics store rebuilt from database: {len(rows)} rows")
+
+    # 内部实现
+    def _query_rows(self, db: Session, condition=None) -> List:
+        query = db.query(
+            models.Quarter.id,
+            models.Quarter.company_id,
+            models.Quarter.quarter,
+            models.Company.company_type,
+            *[getattr(models.Quarter, name) for name in METRIC_FIELDS],
+            *[getattr(models.SystemAnalysis, name) for name in SCORE_FIELDS]
+        ).join(models.Company, models.Company.id == models.Quarter.company_id)\
+            .outerjoin(models.SystemAnalysis, models.SystemAnalysis.quarter_id == models.Quarter.id)
+        if condition is not None:
+            query = query.filter(condition)
+        return query.all()
+
+    def _build(self, rows: List) -> np.ndarray:
+        matrix = np.empty((len(rows), len(COLUMNS)), order="F")
+        for i, row in enumerate(rows):
+            matrix[i, :len(KEY_COLUMNS)] = (
+                row[0], row[1], period_code(row[2]), self.type_code(row[3])
+            )
+            matrix[i, len(KEY_COLUMNS):] = [_to_float(value) for value in row[4:]]
+        return matrix
+
+    def _catch_up(self, db: Session) -> None:
+        """应用水位之后的变更；水位之后的日志可能已被清理或变更过多时全表扫描重建"""
+        quarter_ids: Set[int] = set()
+        company_ids: Set[int] = set()
+        cursor = self.watermark
+        count = 0
+        while True:
+            page = change_log.read(db, cursor, limit=change_log.MAX_LIMIT)
+            for change in page["changes"]:
+                if change["entity"] == "company":
+                    if change["action"] != "created":  # 新建的公司还没有季度
+                        company_ids.add(change["entity_id"])
+                elif change["entity"] in ("quarter", "system_analysis"):
+                    quarter_ids.add(change["quarter_id"])
+            count += len(page["changes"])
+            cursor = page["next_cursor"]
+            if not page["has_more"]:
+                break
+            if count >= CATCH_UP_MAX_CHANGES:
+                self.rebuild(db)
+                return
+        if count == 0:
+            return
+        if not change_log.is_retained(db, self.watermark):
+            self.rebuild(db)
+            return
+
+        self._replace_rows(db, quarter_ids, company_ids)
+        self.watermark = cursor
+        self._unpersisted += count
+        if self._unpersisted >= PERSIST_EVERY:
+            self._persist()
+
+    def _replace_rows(self, db: Session, quarter_ids: Set[int], company_ids: Set[int]) -> None:
+        """删除涉及的行，再插入从数据库重新读取的当前行（已删除的季度、公司读不到，即被移除）"""
+        conditions = []
+        if quarter_ids:
+            conditions.append(models.Quarter.id.in_(quarter_ids))
+        if company_ids:
+            conditions.append(models.Quarter.company_id.in_(company_ids))
+        if not conditions:
+            return
+        fresh = self._sorted(self._build(self._query_rows(db, or_(*conditions))))
+
+        matrix = self._matrix
+        stale = np.isin(self.column(matrix, "quarter_id"), list(quarter_ids)) | \
+            np.isin(self.column(matrix, "company_id"), list(company_ids))
+        matrix = matrix[~stale]
+        # 两边都已有序，按排序键二分定位插入，不必整体重排
+        positions = np.searchsorted(self._sort_keys(matrix), self._sort_keys(fresh))
+        self._matrix = np.asfortranarray(np.insert(matrix, positions, fresh, axis=0))
+
+    @staticmethod
+    def _sort_keys(matrix: np.ndarray) -> np.ndarray:
+        return matrix[:, COLUMN_INDEX["company_id"]] * PERIOD_SPAN + matrix[:, COLUMN_INDEX["period"]]
+
+    @staticmethod
+    def _sorted(matrix: np.ndarray) -> np.ndarray:
+        order = np.lexsort((matrix[:, COLUMN_INDEX["period"]], matrix[:, COLUMN_INDEX["company_id"]]))
+        return np.asfortranarray(matrix[order])
+
+    @contextmanager
+    def _file_lock(self):
+        if not self.snapshot_path or fcntl is None:
+            yield
+            return
+        os.makedirs(os.path.dirname(self.snapshot_path) or ".", exist_ok=True)
+        with open(self.snapshot_path + ".lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_watermark(self) -> Optional[str]:
+        try:
+            with open(self.watermark_path, encoding="utf-8") as f:
+                return f.read().strip()
+        except OSError:
+            return None
+
+    def _load_snapshot(self) -> bool:
+        """映射快照文件；没有水位文件的快照无法判断新旧，视为不可用"""
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return False
+        # 先读水位再读矩阵：落盘顺序相反，读到的矩阵不会比水位旧
+        watermark = self._read_watermark()
+        if watermark is None:
+            return False
+        try:
+            matrix = np.load(self.snapshot_path, mmap_mode="r")
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable metrics snapshot {self.snapshot_path}: {e}")
+            return False
+        if matrix.ndim != 2 or matrix.shape[1] != len(COLUMNS):
+            return False
+        self._matrix = matrix
+        self.watermark = watermark
+        self._unpersisted = 0
+        return True
+
+    def _is_behind_disk(self) -> bool:
+        """其他进程已落盘了更新的快照时不用本进程较旧的矩阵覆盖它"""
+        try:
+            on_disk = change_log.parse_cursor(self._read_watermark())
+            current = change_log.parse_cursor(self.watermark)
+        except change_log.ChangeCursorError:
+            return False
+        return on_disk is not None and (current is None or on_disk > current)
+
+    def _persist(self) -> None:
+        """先写矩阵再写水位，各自经临时文件原子替换"""
+        self._unpersisted = 0
+        if not self.snapshot_path:
+            return
+        tmp_suffix = f".{os.getpid()}.tmp"
+        try:
+            with self._file_lock():
+                if self._is_behind_disk():
+                    return
+                with open(self.snapshot_path + tmp_suffix, "wb") as f:
+                    np.save(f, np.asfortranarray(self._matrix))
+                os.replace(self.snapshot_path + tmp_suffix, self.snapshot_path)
+                with open(self.watermark_path + tmp_suffix, "w", encoding="utf-8") as f:
+                    f.write(self.watermark or "")
+                os.replace(self.watermark_path + tmp_suffix, self.watermark_path)
+        except OSError as e:
+            logger.warning(f"Failed to persist metrics snapshot: {e}")
+
+
+store = MetricsStore(settings.metrics_store_dir)
@@ -1,9 +1,16 @@
 """数据库模型"""
-from sqlalchemy import Column, Integer, String, Numeric, Text, ARRAY, TIMESTAMP, ForeignKey, Enum
+from sqlalchemy import Column, Integer, String, Numeric, Text, ARRAY, TIMESTAMP, ForeignKey, Enum, UniqueConstraint, Index, LargeBinary, Date, BigInteger, Float, JSON
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 import enum
 from database import Base
+from quarter_metrics import METRIC_FIELDS
+
+# PostgreSQL 专有类型在 SQLite 上的存储：数组存为 JSON 数组，tsvector 存为文本（SQLite 不写入）
+TextArray = ARRAY(Text).with_variant(JSON(), "sqlite")
+IntegerArray = ARRAY(Integer).with_variant(JSON(), "sqlite")
+TSVectorType = TSVECTOR().with_variant(Text(), "sqlite")
 
 
 class CompanyType(str, enum.Enum):
@@ -29,12 +36,18 @@ class Company(Base):
     
     # 关系
     quarters = relationship("Quarter", back_populates="company", cascade="all, delete-orphan")
-    comprehensive_ai = relationship("CompanyComprehensiveAI", back_populates="company", uselist=False)
+    comprehensive_ai = relationship("CompanyComprehensiveAI", back_populates="company", uselist=False, cascade="all, delete-orphan")
 
 
 class Quarter(Base):
     """季度财务数据模型"""
     __tablename__ = "quarters"
+    __table_args__ = (
+        # 与 schema.sql 中的 UNIQUE(company_id, quarter) 保持一致，同时服务按公司、季度排序的查询
+        UniqueConstraint("company_id", "quarter", name="quarters_company_id_quarter_key"),
+        # 覆盖索引：时间序列接口只读索引即可取到全部指标（PostgreSQL index-only scan）
+        Index("idx_quarters_company_series", "company_id", "quarter", postgresql_include=list(METRIC_FIELDS)),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     company_id = Column(Integer, ForeignKey("companies.id", ondelete="CASCADE"), nullable=False)
@@ -50,6 +63,7 @@ class Quarter(Base):
     fcf_margin = Column(Numeric(10, 2))
     capex_ratio = Column(Numeric(10, 2))
     created_at = Column(TIMESTAMP, server_default=func.now())
+    updated_at = Column(TIMESTAMP, server_default=func.now(), onupdate=func.now())
     
     # 关系
     company = relationship("Company", back_populates="quarters")
@@ -60,13 +74,21 @@ class Quarter(Base):
 class SystemAnalysis(Base):
     """系统分析结果模型"""
     __tablename__ = "system_analyses"
+    __table_args__ = (
+        Index(
+            "idx_system_analyses_series", "quarter_id",
+            postgresql_include=["quality_score", "valuation_score", "trend_score"]
+        ),
+        # labels @> ARRAY[...] 的标签查找（筛选器 labels has）
+        Index("idx_system_analyses_labels", "labels", postgresql_using="gin"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     quarter_id = Column(Integer, ForeignKey("quarters.id", ondelete="CASCADE"), unique=True, nullable=False)
     quality_score = Column(Numeric(5, 2))
     valuation_score = Column(Numeric(5, 2))
     trend_score = Column(Numeric(5, 2))
-    labels = Column(ARRAY(Text))
+    labels = Column(TextArray)
     system_summary = Column(Text)
     created_at = Column(TIMESTAMP, server_default=func.now())
     
@@ -81,7 +103,9 @@ class QuarterAIAnalysis(Base):
     id = Column(Integer, primary_key=True, index=True)
     quarter_id = Column(Integer, ForeignKey("quarters.id", ondelete="CASCADE"), unique=True, nullable=False)
     analysis_text = Column(Text, nullable=False)
+    current_version_id = Column(Integer, ForeignKey("ai_analysis_versions.id", ondelete="SET NULL"))
     created_at = Column(TIMESTAMP, server_default=func.now())
+    updated_at = Column(TIMESTAMP, server_default=func.now(), onupdate=func.now())
     
     # 关系
     quarter = relationship("Quarter", back_populates="ai_analysis")
@@ -96,9 +120,202 @@ class CompanyComprehensiveAI(Base):
     analysis_text = Column(Text)
     main_label = Column(String)
     risk_label = Column(String)
-    based_quarters = Column(ARRAY(Text))
+    based_quarters = Column(TextArray)
+    current_version_id = Column(Integer, ForeignKey("ai_analysis_versions.id", ondelete="SET NULL"))
     updated_at = Column(TIMESTAMP, server_default=func.now(), onupdate=func.now())
     
     # 关系
     company = relationship("Company", back_populates="comprehensive_ai")
 
+
+class AIAnalysisVersion(Base):
+    """AI分析历史版本（只追加）
+
+    热表（quarter_ai_analyses / company_comprehensive_ai）只保存当前文本与
+    current_version_id 指针，详情页读取不涉及本表；历史文本压缩后存放在这里，
+    按需解压读取。同一对象内容相同（content_hash 一致）的生成复用已有版本。
+    """
+    __tablename__ = "ai_analysis_versions"
+    __table_args__ = (
+        Index("idx_ai_analysis_versions_subject", "company_id", "kind", "quarter_id", "content_hash"),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    kind = Column(String, nullable=False)  # quarter / comprehensive
+    company_id = Column(Integer, ForeignKey("companies.id", ondelete="CASCADE"), nullable=False)
+    quarter_id = Column(Integer, ForeignKey("quarters.id", ondelete="CASCADE"))
+    content_hash = Column(String, nullable=False)
+    codec = Column(String, nullable=False)
+    text_blob = Column(LargeBinary, nullable=False)
+    raw_size = Column(Integer, nullable=False)
+    stored_size = Column(Integer, nullable=False)
+    main_label = Column(String)
+    risk_label = Column(String)
+    based_quarters = Column(TextArray)
+    created_at = Column(TIMESTAMP, server_default=func.now())
+
+
+class SearchDocument(Base):
+    """全文检索文档：每段单季度AI分析、系统摘要、综合AI分析各一行
+
+    subject_id 为季度类文档的 quarter_id、综合分析的 company_id；tsv 为汉字二元组
+    切分后的 tsvector（见 search_index），body 保存原文用于摘录与非 PostgreSQL 的回退匹配。
+    """
+    __tablename__ = "search_documents"
+    __table_args__ = (
+        UniqueConstraint("kind", "subject_id", name="search_documents_kind_subject_key"),
+        Index("idx_search_documents_tsv", "tsv", postgresql_using="gin"),
+        Index("idx_search_documents_company_id", "company_id"),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    kind = Column(String, nullable=False)  # quarter_ai / system_summary / comprehensive_ai
+    subject_id = Column(Integer, nullable=False)
+    company_id = Column(Integer, ForeignKey("companies.id", ondelete="CASCADE"), nullable=False)
+    quarter_id = Column(Integer, ForeignKey("quarters.id", ondelete="CASCADE"))
+    body = Column(Text, nullable=False)
+    tsv = Column(TSVectorType)
+    updated_at = Column(TIMESTAMP, server_default=func.now())
+
+
+class Portfolio(Base):
+    """组合（自选）：成员按权重汇总的聚合值增量维护
+
+    *_sum 为 Σ(权重 × 成员最新季度的值)，*_weight 为该指标非空的成员权重之和，
+    加权平均 = sum / weight；由 portfolios 模块在成员快照变化时按差值更新。
+    """
+    __tablename__ = "portfolios"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, unique=True, nullable=False)
+    description = Column(Text)
+    member_count = Column(Integer, nullable=False, default=0)
+    total_weight = Column(Float, nullable=False, default=0)
+    quality_score_sum = Column(Float, nullable=False, default=0)
+    quality_score_weight = Column(Float, nullable=False, default=0)
+    valuation_score_sum = Column(Float, nullable=False, default=0)
+    valuation_score_weight = Column(Float, nullable=False, default=0)
+    trend_score_sum = Column(Float, nullable=False, default=0)
+    trend_score_weight = Column(Float, nullable=False, default=0)
+    roic_wacc_spread_sum = Column(Float, nullable=False, default=0)
+    roic_wacc_spread_weight = Column(Float, nullable=False, default=0)
+    created_at = Column(TIMESTAMP, server_default=func.now())
+    updated_at = Column(TIMESTAMP, server_default=func.now(), onupdate=func.now())
+    
+    # 关系
+    members = relationship("PortfolioMember", back_populates="portfolio", cascade="all, delete-orphan")
+
+
+class PortfolioMember(Base):
+    """组合成员：权重与其公司最新季度的快照（得分与 ROIC−WACC）"""
+    __tablename__ = "portfolio_members"
+    __table_args__ = (
+        UniqueConstraint("portfolio_id", "company_id", name="portfolio_members_portfolio_company_key"),
+        Index("idx_portfolio_members_company_id", "company_id"),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    portfolio_id = Column(Integer, ForeignKey("portfolios.id", ondelete="CASCADE"), nullable=False)
+    company_id = Column(Integer, ForeignKey("companies.id", ondelete="CASCADE"), nullable=False)
+    weight = Column(Float, nullable=False, default=1)
+    latest_quarter = Column(String)
+    quality_score = Column(Float)
+    valuation_score = Column(Float)
+    trend_score = Column(Float)
+    roic_wacc_spread = Column(Float)
+    added_at = Column(TIMESTAMP, server_default=func.now())
+    updated_at = Column(TIMESTAMP, server_default=func.now(), onupdate=func.now())
+    
+    # 关系
+    portfolio = relationship("Portfolio", back_populates="members")
+
+
+class SectorPeriodStat(Base):
+    """行业类型 × 季度 的指标分布（预计算聚合，随季度/分析写入增量刷新）"""
+    __tablename__ = "sector_period_stats"
+    __table_args__ = (
+        UniqueConstraint("company_type", "quarter", "metric", name="sector_period_stats_group_key"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    company_type = Column(Enum(CompanyType), nullable=False)
+    quarter = Column(String, nullable=False)
+    metric = Column(String, nullable=False)
+    sample_count = Column(Integer, nullable=False)
+    min_value = Column(Numeric(14, 4))
+    p25 = Column(Numeric(14, 4))
+    median = Column(Numeric(14, 4))
+    p75 = Column(Numeric(14, 4))
+    max_value = Column(Numeric(14, 4))
+    histogram = Column(IntegerArray)  # min~max 等宽分箱的计数
+    updated_at = Column(TIMESTAMP, server_default=func.now(), onupdate=func.now())
+
+
+class SectorLabelCount(Base):
+    """行业类型 × 季度 的标签计数（带该标签的公司数）；quarter 为 latest 时统计各公司最新季度"""
+    __tablename__ = "sector_label_counts"
+    __table_args__ = (
+        UniqueConstraint("company_type", "quarter", "label", name="sector_label_counts_group_key"),
+        Index("idx_sector_label_counts_quarter", "quarter", "company_type"),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    company_type = Column(Enum(CompanyType), nullable=False)
+    quarter = Column(String, nullable=False)
+    label = Column(Text, nullable=False)
+    company_count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(TIMESTAMP, server_default=func.now(), onupdate=func.now())
+
+
+class ChangeLog(Base):
+    """变更日志（事务性 outbox）：crud 写入业务表时在同一事务中追加，供 /api/changes 增量同步
+
+    txid 为 PostgreSQL 写入事务号，与 id 一起构成游标（见 change_log）；其他数据库为 0。
+    不设外键：实体删除后其变更记录仍需保留。SQLite 上用 AUTOINCREMENT，日志被清空后
+    id 也不会从头复用，已发出的游标不会跳过新记录。
+    """
+    __tablename__ = "change_log"
+    __table_args__ = (
+        Index("idx_change_log_position", "txid", "id"),
+        Index("idx_change_log_changed_at", "changed_at"),
+        {"sqlite_autoincrement": True},
+    )
+    
+    id = Column(Integer, primary_key=True)
+    txid = Column(BigInteger, nullable=False, default=0)
+    entity = Column(String, nullable=False)  # company / quarter / system_analysis / quarter_ai / comprehensive_ai
+    action = Column(String, nullable=False)  # created / updated / deleted / upserted
+    entity_id = Column(Integer, nullable=False)
+    company_id = Column(Integer)
+    quarter_id = Column(Integer)
+    data = Column(JSON)
+    changed_at = Column(TIMESTAMP, nullable=False, server_default=func.now())
+
+
+class AIGenerationLock(Base):
+    """AI生成的跨进程去重锁（single-flight）
+
+    lock_key 由作用域（quarter:<id> / company:<id>）与输入指纹组成。持锁进程在
+    expires_at 之前完成生成并写入 result_text；其他进程轮询该行取结果，持锁进程
+    异常退出时租约到期后由等待者接管。ai_refresh 调度器的租约也存放在本表
+    （lock_key 为 scheduler:comprehensive-refresh）。
+    """
+    __tablename__ = "ai_generation_locks"
+    
+    lock_key = Column(String, primary_key=True)
+    owner = Column(String, nullable=False)
+    acquired_at = Column(TIMESTAMP, nullable=False)
+    expires_at = Column(TIMESTAMP, nullable=False)
+    result_text = Column(Text)
+    completed_at = Column(TIMESTAMP)
+
+
+class AITokenUsage(Base):
+    """按日累计的LLM token 用量（ai_refresh 调度器据此执行每日预算，跨进程、跨重启有效）"""
+    __tablename__ = "ai_token_usage"
+    
+    usage_date = Column(Date, primary_key=True)
+    scope = Column(String, primary_key=True)  # 如 comprehensive-refresh
+    tokens = Column(BigInteger, nullable=False, default=0)
+    calls = Column(Integer, nullable=False, default=0)
+    updated_at = Column(TIMESTAMP, server_default=func.now(), onupdate=func.now())
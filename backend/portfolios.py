@@ -0,0 +1,178 @@
+"""组合聚合 - 按权重汇总成员最新季度的得分与 ROIC−WACC，增量维护
+
+每个成员行保存其公司最新季度的快照（quality / valuation / trend 得分与 ROIC−WACC），
+组合行保存各指标的 Σ(权重 × 值) 与 Σ权重（只计该指标非空的成员），读取时相除即为
+加权平均，不需要遍历成员：
+- 季度写入（新增、修改、删除、后继重算）后 crud 调用 refresh_company，只有该公司
+  最新季度的快照变化时，才把差值加到它所在的组合
+- 增删成员、修改权重时加减该成员的贡献
+- 差值更新以 SET x = x + delta 执行，并发写入不会互相覆盖；rebuild 从成员快照全量
+  重算，用于修复浮点累计误差：python manage.py rebuild-portfolios
+
+所有函数只写入当前事务，不提交。
+"""
+from typing import Optional, Dict, List, Iterable
+from sqlalchemy.orm import Session
+from sqlalchemy import desc
+import models
+from quarter_metrics import to_float
+
+AGGREGATE_METRICS = ("quality_score", "valuation_score", "trend_score", "roic_wacc_spread")
+# 权重和低于该值视为没有样本（增减抵消后残留的浮点误差）
+WEIGHT_EPSILON = 1e-9
+
+
+def company_snapshot(db: Session, company_id: int) -> Dict[str, Optional[float]]:
+    """公司最新季度的快照；没有季度时各值为 None"""
+    row = db.query(
+        models.Quarter.quarter, models.Quarter.roic, models.Quarter.wacc,
+        models.SystemAnalysis.quality_score, models.SystemAnalysis.valuation_score,
+        models.SystemAnalysis.trend_score
+    ).outerjoin(models.SystemAnalysis, models.SystemAnalysis.quarter_id == models.Quarter.id)\
+        .filter(models.Quarter.company_id == company_id)\
+        .order_by(desc(models.Quarter.quarter))\
+        .first()
+    if row is None:
+        return {"latest_quarter": None, **{name: None for name in AGGREGATE_METRICS}}
+
+    roic, wacc = to_float(row.roic), to_float(row.wacc)
+    return {
+        "latest_quarter": row.quarter,
+        "quality_score": to_float(row.quality_score),
+        "valuation_score": to_float(row.valuation_score),
+        "trend_score": to_float(row.trend_score),
+        "roic_wacc_spread": roic - wacc if roic is not None and wacc is not None else None,
+    }
+
+
+def _member_values(member: models.PortfolioMember) -> Dict[str, Optional[float]]:
+    return {name: getattr(member, name) for name in AGGREGATE_METRICS}
+
+
+def _apply_delta(
+    db: Session,
+    portfolio_id: int,
+    old_weight: float,
+    old_values: Optional[Dict[str, Optional[float]]],
+    new_weight: float,
+    new_values: Optional[Dict[str, Optional[float]]],
+    member_delta: int = 0
+) -> None:
+    """把一个成员贡献的变化（旧 → 新，None 表示不存在）加到组合聚合上"""
+    portfolio = models.Portfolio
+    changes = {}
+    for name in AGGREGATE_METRICS:
+        old_value = old_values.get(name) if old_values else None
+        new_value = new_values.get(name) if new_values else None
+        sum_delta = (new_weight * new_value if new_value is not None else 0.0) \
+            - (old_weight * old_value if old_value is not None else 0.0)
+        weight_delta = (new_weight if new_value is not None else 0.0) \
+            - (old_weight if old_value is not None else 0.0)
+        if sum_delta:
+            changes[f"{name}_sum"] = getattr(portfolio, f"{name}_sum") + sum_delta
+        if weight_delta:
+            changes[f"{name}_weight"] = getattr(portfolio, f"{name}_weight") + weight_delta
+
+    old_total = old_weight if old_values is not None else 0.0
+    new_total = new_weight if new_values is not None else 0.0
+    if new_total != old_total:
+        changes["total_weight"] = portfolio.total_weight + (new_total - old_total)
+    if member_delta:
+        changes["member_count"] = portfolio.member_count + member_delta
+    if changes:
+        db.query(portfolio).filter(portfolio.id == portfolio_id).update(changes, synchronize_session=False)
+
+
+def refresh_company(db: Session, company_id: int) -> int:
+    """公司季度或系统分析变化后更新其所在组合，返回快照发生变化的成员数"""
+    members = db.query(models.PortfolioMember)\
+        .filter(models.PortfolioMember.company_id == company_id)\
+        .with_for_update()\
+        .all()
+    if not members:
+        return 0
+
+    snapshot = company_snapshot(db, company_id)
+    new_values = {name: snapshot[name] for name in AGGREGATE_METRICS}
+    changed = 0
+    for member in members:
+        old_values = _member_values(member)
+        if old_values == new_values and member.latest_quarter == snapshot["latest_quarter"]:
+            continue
+        _apply_delta(db, member.portfolio_id, member.weight, old_values, member.weight, new_values)
+        for name, value in snapshot.items():
+            setattr(member, name, value)
+        changed += 1
+    return changed
+
+
+def set_member(db: Session, portfolio_id: int, company_id: int, weight: float) -> models.PortfolioMember:
+    """新增成员或修改权重"""
+    member = db.query(models.PortfolioMember)\
+        .filter(models.PortfolioMember.portfolio_id == portfolio_id, models.PortfolioMember.company_id == company_id)\
+        .with_for_update()\
+        .first()
+    if member is not None:
+        if member.weight != weight:
+            values = _member_values(member)
+            _apply_delta(db, portfolio_id, member.weight, values, weight, values)
+            member.weight = weight
+        return member
+
+    snapshot = company_snapshot(db, company_id)
+    member = models.PortfolioMember(portfolio_id=portfolio_id, company_id=company_id, weight=weight, **snapshot)
+    db.add(member)
+    _apply_delta(db, portfolio_id, 0.0, None, weight, _member_values(member), member_delta=1)
+    return member
+
+
+def remove_member(db: Session, member: models.PortfolioMember) -> None:
+    _apply_delta(db, member.portfolio_id, member.weight, _member_values(member), 0.0, None, member_delta=-1)
+    db.delete(member)
+
+
+def remove_company(db: Session, company_id: int) -> None:
+    """公司删除前从所有组合中移除"""
+    members = db.query(models.PortfolioMember)\
+        .filter(models.PortfolioMember.company_id == company_id)\
+        .with_for_update()\
+        .all()
+    for member in members:
+        remove_member(db, member)
+
+
+def aggregates(portfolio: models.Portfolio) -> Dict[str, Optional[float]]:
+    """组合行上的加权平均"""
+    result = {}
+    for name in AGGREGATE_METRICS:
+        weight = getattr(portfolio, f"{name}_weight") or 0.0
+        result[name] = getattr(portfolio, f"{name}_sum") / weight if weight > WEIGHT_EPSILON else None
+    return result
+
+
+def rebuild(db: Session, portfolio_ids: Optional[Iterable[int]] = None) -> int:
+    """重新读取成员快照并全量重算组合聚合，返回重算的组合数"""
+    query = db.query(models.Portfolio)
+    if portfolio_ids is not None:
+        query = query.filter(models.Portfolio.id.in_(list(portfolio_ids)))
+    portfolios: List[models.Portfolio] = query.with_for_update().all()
+
+    snapshots: Dict[int, Dict] = {}
+    for portfolio in portfolios:
+        totals = {"member_count": 0, "total_weight": 0.0}
+        totals.update({f"{name}_{part}": 0.0 for name in AGGREGATE_METRICS for part in ("sum", "weight")})
+        for member in portfolio.members:
+            if member.company_id not in snapshots:
+                snapshots[member.company_id] = company_snapshot(db, member.company_id)
+            for name, value in snapshots[member.company_id].items():
+                setattr(member, name, value)
+            totals["member_count"] += 1
+            totals["total_weight"] += member.weight
+            for name in AGGREGATE_METRICS:
+                value = getattr(member, name)
+                if value is not None:
+                    totals[f"{name}_sum"] += member.weight * value
+                    totals[f"{name}_weight"] += member.weight
+        for key, value in totals.items():
+            setattr(portfolio, key, value)
+    return len(portfolios)
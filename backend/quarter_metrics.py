@@ -0,0 +1,80 @@
+"""季度指标的紧凑表示 - Decimal→float 只转换一次，供引擎、Prompt生成与批量接口共享"""
+from typing import Optional, Iterable, Dict, Any
+
+METRIC_FIELDS = (
+    "pe", "pb", "ps", "roe", "roic", "wacc",
+    "revenue_yoy", "gross_margin", "fcf_margin", "capex_ratio",
+)
+
+
+def to_float(value: Any) -> Optional[float]:
+    """Numeric/Decimal 转 float，None 保持 None（0 仍是 0.0）"""
+    if value is None:
+        return None
+    return float(value)
+
+
+class QuarterMetrics:
+    """一个季度的 10 项财务指标（None 表示缺失）
+
+    使用 __slots__ 避免每个季度分配一个字典；提供 get() 以兼容原先按字典读取的代码，
+    缺失值返回 default，因此 Prompt 中显示为 "N/A" 而不是 "None"。
+    """
+    __slots__ = METRIC_FIELDS
+
+    def __init__(
+        self,
+        pe: Optional[float] = None,
+        pb: Optional[float] = None,
+        ps: Optional[float] = None,
+        roe: Optional[float] = None,
+        roic: Optional[float] = None,
+        wacc: Optional[float] = None,
+        revenue_yoy: Optional[float] = None,
+        gross_margin: Optional[float] = None,
+        fcf_margin: Optional[float] = None,
+        capex_ratio: Optional[float] = None
+    ):
+        self.pe = pe
+        self.pb = pb
+        self.ps = ps
+        self.roe = roe
+        self.roic = roic
+        self.wacc = wacc
+        self.revenue_yoy = revenue_yoy
+        self.gross_margin = gross_margin
+        self.fcf_margin = fcf_margin
+        self.capex_ratio = capex_ratio
+
+    @classmethod
+    def from_values(cls, values: Iterable[Any]) -> "QuarterMetrics":
+        """按 METRIC_FIELDS 顺序的取值构建（如查询结果元组的切片）"""
+        return cls(*[to_float(value) for value in values])
+
+    @classmethod
+    def from_row(cls, quarter) -> "QuarterMetrics":
+        """从 models.Quarter（或任何带同名属性的对象）构建"""
+        return cls.from_values(getattr(quarter, field) for field in METRIC_FIELDS)
+
+    @classmethod
+    def from_mapping(cls, data: Optional[Dict[str, Any]]) -> Optional["QuarterMetrics"]:
+        """从字典构建；已是 QuarterMetrics 时原样返回，None 返回 None"""
+        if data is None or isinstance(data, cls):
+            return data
+        return cls.from_values(data.get(field) for field in METRIC_FIELDS)
+
+    def get(self, name: str, default: Any = None) -> Any:
+        value = getattr(self, name, None)
+        return default if value is None else value
+
+    def values(self) -> tuple:
+        return tuple(getattr(self, field) for field in METRIC_FIELDS)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, QuarterMetrics):
+            return NotImplemented
+        return self.values() == other.values()
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{field}={getattr(self, field)}" for field in METRIC_FIELDS)
+        return f"QuarterMetrics({fields})"
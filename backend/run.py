@@ -1,8 +1,29 @@
-"""启动脚本"""
+"""启动脚本
+
+    python run.py                      # 按 SERVER_MODE 启动（默认 development）
+    python run.py --mode production    # 多进程
+
+production 模式优先使用 gunicorn + UvicornWorker（支持预加载、按请求数回收 worker），
+未安装 gunicorn 时退回 uvicorn 自带的多进程模式（不支持预加载与回收）。两种方式收到
+SIGTERM 后都会停止接收新连接，并在 graceful_timeout 内等待进行中的请求和LLM调用完成。
+"""
+import os
+import argparse
+import logging
 import uvicorn
 from config import settings
 
-if __name__ == "__main__":
+logger = logging.getLogger(__name__)
+
+
+def worker_count() -> int:
+    return settings.workers or os.cpu_count() or 1
+
+
+def run_development():
+    # 开发模式下启动前自动建表（生产环境请显式执行 python manage.py migrate）
+    from manage import migrate
+    migrate()
     uvicorn.run(
         "main:app",
         host=settings.host,
@@ -10,3 +31,74 @@ if __name__ == "__main__":
         reload=True
     )
 
+
+def run_gunicorn(workers: int):
+    from gunicorn.app.base import BaseApplication
+
+    def post_fork(server, worker):
+        # 预加载时主进程可能已建立连接（如建表），子进程不能复用父进程的连接
+        from database import engine
+        engine.dispose(close=False)
+
+    class ProductionApplication(BaseApplication):
+        def load_config(self):
+            options = {
+                "bind": f"{settings.host}:{settings.port}",
+                "workers": workers,
+                "worker_class": "uvicorn.workers.UvicornWorker",
+                "preload_app": settings.preload_app,
+                "graceful_timeout": settings.graceful_timeout,
+                # UvicornWorker 的心跳由事件循环维持，timeout 只用于回收卡死的 worker
+                "timeout": settings.graceful_timeout + 30,
+                "max_requests": settings.max_requests,
+                "max_requests_jitter": settings.max_requests_jitter,
+                "keepalive": settings.keepalive,
+                "backlog": settings.backlog,
+                "post_fork": post_fork,
+            }
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            from main import app
+            return app
+
+    ProductionApplication().run()
+
+
+def run_uvicorn_workers(workers: int):
+    # uvicorn 的多进程管理不会替换退出的 worker，因此这里不启用按请求数回收
+    logger.warning(
+        "gunicorn is not installed; falling back to uvicorn workers "
+        "(no app preload, MAX_REQUESTS recycling disabled)"
+    )
+    uvicorn.run(
+        "main:app",
+        host=settings.host,
+        port=settings.port,
+        workers=workers,
+        backlog=settings.backlog,
+        timeout_keep_alive=settings.keepalive,
+        timeout_graceful_shutdown=settings.graceful_timeout,
+    )
+
+
+def run_production():
+    workers = worker_count()
+    try:
+        import gunicorn  # noqa: F401
+    except ImportError:
+        run_uvicorn_workers(workers)
+    else:
+        run_gunicorn(workers)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Equity Insight Engine API 服务")
+    parser.add_argument("--mode", choices=("development", "production"), default=settings.server_mode)
+    args = parser.parse_args()
+
+    if args.mode == "production":
+        run_production()
+    else:
+        run_development()
@@ -1,6 +1,6 @@
 """Pydantic模型（API请求/响应）"""
 from pydantic import BaseModel, Field, ConfigDict
-from typing import Optional, List
+from typing import Optional, List, Dict
 from datetime import datetime
 from models import CompanyType
 
@@ -61,6 +61,25 @@ class QuarterResponse(QuarterBase):
     model_config = ConfigDict(from_attributes=True)
 
 
+class QuarterValues(BaseModel):
+    """按 (公司, 季度) 幂等写入时的请求体：未提供的指标视为空值"""
+    pe: Optional[float] = None
+    pb: Optional[float] = None
+    ps: Optional[float] = None
+    roe: Optional[float] = None
+    roic: Optional[float] = None
+    wacc: Optional[float] = None
+    revenue_yoy: Optional[float] = None
+    gross_margin: Optional[float] = None
+    fcf_margin: Optional[float] = None
+    capex_ratio: Optional[float] = None
+
+
+class QuarterUpsertResponse(QuarterResponse):
+    created: bool
+    changed: bool
+
+
 # 系统分析相关Schema
 class SystemAnalysisResponse(BaseModel):
     id: int
@@ -80,6 +99,7 @@ class QuarterAIAnalysisResponse(BaseModel):
     id: int
     quarter_id: int
     analysis_text: str
+    current_version_id: Optional[int] = None
     created_at: datetime
     
     model_config = ConfigDict(from_attributes=True)
@@ -92,11 +112,33 @@ class CompanyComprehensiveAIResponse(BaseModel):
     main_label: Optional[str]
     risk_label: Optional[str]
     based_quarters: Optional[List[str]]
+    current_version_id: Optional[int] = None
     updated_at: datetime
     
     model_config = ConfigDict(from_attributes=True)
 
 
+class AIAnalysisVersionSummary(BaseModel):
+    """AI分析历史版本（列表项，不含文本）"""
+    id: int
+    kind: str
+    company_id: int
+    quarter_id: Optional[int] = None
+    content_hash: str
+    codec: str
+    raw_size: int
+    stored_size: int
+    main_label: Optional[str] = None
+    risk_label: Optional[str] = None
+    based_quarters: Optional[List[str]] = None
+    created_at: Optional[datetime] = None
+    is_current: bool
+
+
+class AIAnalysisVersionResponse(AIAnalysisVersionSummary):
+    analysis_text: str
+
+
 # 详情页完整数据Schema
 class QuarterDetailResponse(QuarterResponse):
     system_analysis: Optional[SystemAnalysisResponse] = None
@@ -108,6 +150,26 @@ class CompanyDetailResponse(CompanyResponse):
     comprehensive_ai: Optional[CompanyComprehensiveAIResponse] = None
 
 
+# 批量读取Schema：items 以 id（字符串）为键，不存在的 id 列在 missing
+BATCH_MAX_IDS = 200
+
+
+class CompanyBatchRequest(BaseModel):
+    ids: List[int] = Field(..., min_length=1, max_length=BATCH_MAX_IDS)
+    fields: Optional[str] = None  # 同 GET /api/companies/{id} 的 fields
+    include: Optional[str] = None  # 同 GET /api/companies/{id} 的 include
+
+
+class CompanyBatchResponse(BaseModel):
+    items: Dict[str, CompanyDetailResponse] = {}
+    missing: List[int] = []
+
+
+class QuarterBatchResponse(BaseModel):
+    items: Dict[str, QuarterDetailResponse] = {}
+    missing: List[int] = []
+
+
 # 首页卡片数据Schema
 class CompanyCardResponse(BaseModel):
     id: int
@@ -123,3 +185,188 @@ class CompanyCardResponse(BaseModel):
     
     model_config = ConfigDict(from_attributes=True)
 
+
+
+# 筛选器Schema
+class ScreenResultItem(BaseModel):
+    quarter_id: int
+    company_id: int
+    quarter: str
+    ticker: str
+    company_name: str
+    company_type: CompanyType
+    labels: Optional[List[str]] = None
+    pe: Optional[float] = None
+    pb: Optional[float] = None
+    ps: Optional[float] = None
+    roe: Optional[float] = None
+    roic: Optional[float] = None
+    wacc: Optional[float] = None
+    revenue_yoy: Optional[float] = None
+    gross_margin: Optional[float] = None
+    fcf_margin: Optional[float] = None
+    capex_ratio: Optional[float] = None
+    quality_score: Optional[float] = None
+    valuation_score: Optional[float] = None
+    trend_score: Optional[float] = None
+
+
+class ScreenResponse(BaseModel):
+    query: str
+    quarter: str
+    company_type: Optional[CompanyType] = None
+    count: int
+    items: List[ScreenResultItem] = []
+
+
+# 全文检索Schema
+class SearchHit(BaseModel):
+    kind: str  # quarter_ai / system_summary / comprehensive_ai
+    company_id: int
+    ticker: str
+    company_name: str
+    quarter_id: Optional[int] = None
+    quarter: Optional[str] = None
+    rank: Optional[float] = None  # 仅 PostgreSQL 提供
+    snippet: str
+    highlights: List[List[int]] = []  # 摘录内的命中区间 [开始, 结束)
+    updated_at: Optional[datetime] = None
+
+
+class SearchResponse(BaseModel):
+    query: str
+    terms: List[str]
+    kinds: List[str]
+    count: int
+    items: List[SearchHit] = []
+
+
+# 变更日志Schema
+class ChangeRecord(BaseModel):
+    cursor: str
+    entity: str  # company / quarter / system_analysis / quarter_ai / comprehensive_ai
+    action: str  # created / updated / deleted / upserted
+    entity_id: int  # 公司、季度的 id；系统分析与单季度AI分析为 quarter_id，综合分析为 company_id
+    company_id: Optional[int] = None
+    quarter_id: Optional[int] = None
+    data: Optional[Dict] = None  # 写入时的快照（删除时只有关键字段）
+    changed_at: Optional[datetime] = None
+
+
+class ChangeFeedResponse(BaseModel):
+    changes: List[ChangeRecord] = []
+    next_cursor: str  # 下次请求原样传回；没有新记录时与请求的游标相同
+    has_more: bool
+
+
+# 行业聚合统计Schema
+class SectorHistogram(BaseModel):
+    edges: List[float] = []
+    counts: List[int] = []
+
+
+class SectorMetricStats(BaseModel):
+    count: int
+    min: Optional[float] = None
+    p25: Optional[float] = None
+    median: Optional[float] = None
+    p75: Optional[float] = None
+    max: Optional[float] = None
+    histogram: SectorHistogram
+
+
+class LabelCount(BaseModel):
+    label: str
+    count: int
+
+
+class LabelFacetGroup(BaseModel):
+    company_type: CompanyType
+    quarter: str
+    label: str
+    count: int
+
+
+class LabelFacetResponse(BaseModel):
+    quarter: str
+    company_type: Optional[CompanyType] = None
+    totals: List[LabelCount] = []
+    groups: List[LabelFacetGroup] = []
+    updated_at: Optional[datetime] = None
+
+
+class SectorStatsResponse(BaseModel):
+    company_type: CompanyType
+    quarter: str
+    available_quarters: List[str] = []
+    updated_at: Optional[datetime] = None
+    metrics: Dict[str, SectorMetricStats] = {}
+
+
+# 时间序列Schema
+class CompanySeriesResponse(BaseModel):
+    company_id: int
+    metrics: List[str]
+    periods: List[str] = []
+    series: Dict[str, List[Optional[float]]] = {}
+    total_points: int
+    downsampled: bool = False
+
+
+# 组合相关Schema
+class PortfolioMemberInput(BaseModel):
+    company_id: int
+    weight: float = Field(1.0, gt=0)
+
+
+class PortfolioCreate(BaseModel):
+    name: str = Field(..., min_length=1)
+    description: Optional[str] = None
+    members: List[PortfolioMemberInput] = []
+
+
+class PortfolioUpdate(BaseModel):
+    name: Optional[str] = Field(None, min_length=1)
+    description: Optional[str] = None
+
+
+class PortfolioWeight(BaseModel):
+    weight: float = Field(..., gt=0)
+
+
+class PortfolioAggregates(BaseModel):
+    """成员最新季度按权重的加权平均（只计该指标非空的成员）"""
+    quality_score: Optional[float] = None
+    valuation_score: Optional[float] = None
+    trend_score: Optional[float] = None
+    roic_wacc_spread: Optional[float] = None
+
+
+class PortfolioSummaryResponse(BaseModel):
+    id: int
+    name: str
+    description: Optional[str] = None
+    member_count: int
+    total_weight: float
+    aggregates: PortfolioAggregates
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+
+class PortfolioMemberResponse(BaseModel):
+    company_id: int
+    ticker: str
+    company_name: str
+    company_type: CompanyType
+    weight: float
+    weight_share: Optional[float] = None
+    latest_quarter: Optional[str] = None
+    quality_score: Optional[float] = None
+    valuation_score: Optional[float] = None
+    trend_score: Optional[float] = None
+    roic_wacc_spread: Optional[float] = None
+    added_at: Optional[datetime] = None
+
+
+class PortfolioDetailResponse(PortfolioSummaryResponse):
+    members: List[PortfolioMemberResponse] = []
@@ -0,0 +1,586 @@
+"""筛选器 - 小型过滤表达式语言，编译为SQL在数据库中执行
+
+表达式示例：
+    roic - wacc > 5 and valuation_score > 70 and trend_score rising
+    quality_score >= 80 or labels has "基本面走弱"
+
+支持：
+- 字段：Quarter 的财务指标与 SystemAnalysis 的三项得分（不区分大小写）
+- 运算：+ - * /、比较 > >= < <= = == !=、and / or / not、括号
+- 趋势：<字段> rising / <字段> falling（与同公司上一季度比较）
+- 标签：labels has "标签"
+"""
+import re
+from typing import Optional, List, Dict, Tuple, Any
+import numpy as np
+from sqlalchemy.orm import Session
+from sqlalchemy import select, func, and_, or_, not_, desc, asc, literal, ARRAY, Text
+import models
+from quarter_metrics import METRIC_FIELDS
+
+
+class ScreenQueryError(ValueError):
+    """筛选表达式错误"""
+
+
+SCORE_FIELDS = ("quality_score", "valuation_score", "trend_score")
+NUMERIC_FIELDS = METRIC_FIELDS + SCORE_FIELDS
+
+KEYWORDS = {"and", "or", "not", "rising", "falling", "has", "labels"}
+
+_TOKEN_RE = re.compile(r"""
+    \s*(?:
+        (?P<number>\d+(?:\.\d+)?)
+      | (?P<string>"[^"]*"|'[^']*')
+      | (?P<op>>=|<=|==|!=|[-+*/()<>=])
+      | (?P<name>[A-Za-z_][A-Za-z0-9_]*)
+    )""", re.VERBOSE)
+
+
+def tokenize(text: str) -> List[Tuple[str, str]]:
+    """将表达式切分为 (类型, 值) 列表"""
+    # 兼容从文档中复制的全角/数学符号
+    text = text.replace("−", "-").replace("＞", ">").replace("＜", "<").replace("＝", "=")
+    tokens = []
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        match = _TOKEN_RE.match(text, pos)
+        if not match or match.end() == pos:
+            raise ScreenQueryError(f"无法解析的字符：{text[pos:].strip()[:10]}")
+        pos = match.end()
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == "name":
+            value = value.lower()
+            if value in KEYWORDS:
+                kind = "keyword"
+            elif value not in NUMERIC_FIELDS:
+                raise ScreenQueryError(f"未知字段：{value}")
+        elif kind == "string":
+            value = value[1:-1]
+        tokens.append((kind, value))
+    return tokens
+
+
+class _Parser:
+    """递归下降解析器，输出元组形式的语法树
+
+    语法：
+        expr       := and_expr ("or" and_expr)*
+        and_expr   := not_expr ("and" not_expr)*
+        not_expr   := "not" not_expr | predicate
+        predicate  := "(" expr ")" | "labels" "has" STRING
+                    | arith ("rising" | "falling" | CMP arith)
+        arith      := term (("+" | "-") term)*
+        term       := factor (("*" | "/") factor)*
+        factor     := NUMBER | FIELD | "-" factor | "(" arith ")"
+    """
+
+    COMPARISONS = {">", ">=", "<", "<=", "=", "==", "!="}
+
+    def __init__(self, tokens: List[Tuple[str, str]]):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self) -> Optional[Tuple[str, str]]:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def advance(self) -> Tuple[str, str]:
+        token = self.peek()
+        if token is None:
+            raise ScreenQueryError("表达式不完整")
+        self.pos += 1
+        return token
+
+    def accept(self, kind: str, value: Optional[str] = None) -> bool:
+        token = self.peek()
+        if token and token[0] == kind and (value is None or token[1] == value):
+            self.pos += 1
+            return True
+        return False
+
+    def expect(self, kind: str, value: Optional[str] = None) -> Tuple[str, str]:
+        token = self.advance()
+        if token[0] != kind or (value is not None and token[1] != value):
+            raise ScreenQueryError(f"此处需要 {value or kind}，实际为 {token[1]}")
+        return token
+
+    def parse(self):
+        node = self.expr()
+        if self.peek() is not None:
+            raise ScreenQueryError(f"多余的内容：{self.peek()[1]}")
+        return node
+
+    def expr(self):
+        node = self.and_expr()
+        while self.accept("keyword", "or"):
+            node = ("or", node, self.and_expr())
+        return node
+
+    def and_expr(self):
+        node = self.not_expr()
+        while self.accept("keyword", "and"):
+            node = ("and", node, self.not_expr())
+        return node
+
+    def not_expr(self):
+        if self.accept("keyword", "not"):
+            return ("not", self.not_expr())
+        return self.predicate()
+
+    def predicate(self):
+        # 括号既可能包裹布尔表达式，也可能包裹算术表达式，先按布尔表达式尝试
+        if self.peek() == ("op", "("):
+            start = self.pos
+            self.advance()
+            try:
+                node = self.expr()
+                self.expect("op", ")")
+                return node
+            except ScreenQueryError:
+                self.pos = start
+
+        if self.accept("keyword", "labels"):
+            self.expect("keyword", "has")
+            return ("has", self.expect("string")[1])
+
+        left = self.arith()
+        if self.accept("keyword", "rising"):
+            return ("trend", ">", self._trend_field(left))
+        if self.accept("keyword", "falling"):
+            return ("trend", "<", self._trend_field(left))
+
+        token = self.advance()
+        if token[0] != "op" or token[1] not in self.COMPARISONS:
+            raise ScreenQueryError(f"此处需要比较运算符，实际为 {token[1]}")
+        return ("cmp", token[1], left, self.arith())
+
+    def _trend_field(self, node) -> str:
+        if node[0] != "field":
+            raise ScreenQueryError("rising / falling 只能作用于单个字段")
+        return node[1]
+
+    def arith(self):
+        node = self.term()
+        while self.peek() in (("op", "+"), ("op", "-")):
+            node = ("arith", self.advance()[1], node, self.term())
+        return node
+
+    def term(self):
+        node = self.factor()
+        while self.peek() in (("op", "*"), ("op", "/")):
+            node = ("arith", self.advance()[1], node, self.factor())
+        return node
+
+    def factor(self):
+        token = self.advance()
+        kind, value = token
+        if kind == "number":
+            return ("number", float(value))
+        if kind == "name":
+            return ("field", value)
+        if token == ("op", "-"):
+            return ("neg", self.factor())
+        if token == ("op", "("):
+            node = self.arith()
+            self.expect("op", ")")
+            return node
+        raise ScreenQueryError(f"此处需要数值或字段，实际为 {value}")
+
+
+def parse(text: str):
+    """解析筛选表达式，空表达式返回 None"""
+    if not text or not text.strip():
+        return None
+    return _Parser(tokenize(text)).parse()
+
+
+def trend_fields(node) -> List[str]:
+    """收集语法树中需要与上一季度比较的字段"""
+    if node is None:
+        return []
+    if node[0] == "trend":
+        return [node[2]]
+    fields = []
+    for child in node[1:]:
+        if isinstance(child, tuple):
+            fields.extend(f for f in trend_fields(child) if f not in fields)
+    return fields
+
+
+def uses_labels(node) -> bool:
+    """表达式是否引用了标签（列式快照中不含标签，需走SQL）"""
+    if node is None:
+        return False
+    if node[0] == "has":
+        return True
+    return any(isinstance(child, tuple) and uses_labels(child) for child in node[1:])
+
+
+def required_labels(node) -> List[str]:
+    """顶层 and 链中的 labels has 条件：命中的季度必须同时带有这些标签"""
+    if node is None:
+        return []
+    if node[0] == "has":
+        return [node[1]]
+    if node[0] == "and":
+        return list(dict.fromkeys(required_labels(node[1]) + required_labels(node[2])))
+    return []
+
+
+def _compile_arith(node, columns):
+    kind = node[0]
+    if kind == "number":
+        return literal(node[1])
+    if kind == "field":
+        return columns[node[1]]
+    if kind == "neg":
+        return -_compile_arith(node[1], columns)
+    op, left, right = node[1], _compile_arith(node[2], columns), _compile_arith(node[3], columns)
+    if op == "+":
+        return left + right
+    if op == "-":
+        return left - right
+    if op == "*":
+        return left * right
+    # 除数为0时返回NULL，而不是让整条查询报错
+    return left / func.nullif(right, 0)
+
+
+def labels_contain(column, labels: List[str], dialect: str = "postgresql"):
+    """标签列包含全部给定标签
+
+    PostgreSQL 为 labels @> ARRAY[...]（system_analyses.labels 上可用 GIN 索引）；
+    SQLite 的标签存为 JSON 数组，经 json_each 展开后逐个判断。
+    """
+    if dialect == "sqlite":
+        conditions = []
+        for label in labels:
+            elements = func.json_each(column).table_valued("value")
+            conditions.append(select(elements.c.value).where(elements.c.value == label).exists())
+        return and_(*conditions)
+    return column.op("@>")(literal(labels, type_=ARRAY(Text)))
+
+
+def compile_condition(node, columns, dialect: str = "postgresql"):
+    """将语法树编译为基于 columns（字段名 -> 列）的SQL条件"""
+    kind = node[0]
+    if kind == "and":
+        return and_(compile_condition(node[1], columns, dialect), compile_condition(node[2], columns, dialect))
+    if kind == "or":
+        return or_(compile_condition(node[1], columns, dialect), compile_condition(node[2], columns, dialect))
+    if kind == "not":
+        return not_(compile_condition(node[1], columns, dialect))
+    if kind == "has":
+        return labels_contain(columns["labels"], [node[1]], dialect)
+    if kind == "trend":
+        current, previous = columns[node[2]], columns[f"prev_{node[2]}"]
+        return current > previous if node[1] == ">" else current < previous
+
+    op, left, right = node[1], _compile_arith(node[2], columns), _compile_arith(node[3], columns)
+    if op == ">":
+        return left > right
+    if op == ">=":
+        return left >= right
+    if op == "<":
+        return left < right
+    if op == "<=":
+        return left <= right
+    if op == "!=":
+        return left != right
+    return left == right
+
+
+def _evaluate_arith(node, columns) -> np.ndarray:
+    kind = node[0]
+    if kind == "number":
+        return np.float64(node[1])
+    if kind == "field":
+        return columns[node[1]]
+    if kind == "neg":
+        return -_evaluate_arith(node[1], columns)
+    op, left, right = node[1], _evaluate_arith(node[2], columns), _evaluate_arith(node[3], columns)
+    if op == "+":
+        return left + right
+    if op == "-":
+        return left - right
+    if op == "*":
+        return left * right
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(right == 0, np.nan, left / right)
+
+
+def evaluate_condition(node, columns) -> Tuple[np.ndarray, np.ndarray]:
+    """在列式数组上求值，返回 (确定为真, 确定为假) 两个布尔数组
+
+    按SQL三值逻辑处理 NaN（即NULL）：含NULL的比较既不为真也不为假，
+    这样 not / or 的结果与 compile_condition 生成的SQL一致。
+    """
+    kind = node[0]
+    if kind == "and":
+        true1, false1 = evaluate_condition(node[1], columns)
+        true2, false2 = evaluate_condition(node[2], columns)
+        return true1 & true2, false1 | false2
+    if kind == "or":
+        true1, false1 = evaluate_condition(node[1], columns)
+        true2, false2 = evaluate_condition(node[2], columns)
+        return true1 | true2, false1 & false2
+    if kind == "not":
+        true, false = evaluate_condition(node[1], columns)
+        return false, true
+    if kind == "has":
+        raise ScreenQueryError("列式快照不支持标签条件")
+
+    if kind == "trend":
+        op, left, right = node[1], columns[node[2]], columns[f"prev_{node[2]}"]
+    else:
+        op, left, right = node[1], _evaluate_arith(node[2], columns), _evaluate_arith(node[3], columns)
+    known = ~(np.isnan(left) | np.isnan(right))
+    with np.errstate(invalid="ignore"):
+        if op == ">":
+            result = left > right
+        elif op == ">=":
+            result = left >= right
+        elif op == "<":
+            result = left < right
+        elif op == "<=":
+            result = left <= right
+        elif op == "!=":
+            result = left != right
+        else:
+            result = left == right
+    result = np.broadcast_to(result, known.shape)
+    return result & known, ~result & known
+
+
+def sort_field(sort: Optional[str]) -> Optional[str]:
+    """校验排序参数，返回字段名（前缀 - 表示倒序）"""
+    if not sort:
+        return None
+    field = sort.lstrip("-").lower()
+    if field not in NUMERIC_FIELDS:
+        raise ScreenQueryError(f"不支持的排序字段：{field}")
+    return field
+
+
+def build_screen_query(
+    tree,
+    quarter: str = "latest",
+    company_type: Optional[models.CompanyType] = None,
+    sort: Optional[str] = None,
+    limit: int = 100,
+    dialect: str = "postgresql",
+):
+    """构建筛选查询
+
+    先在 (公司, 季度) 粒度上用窗口函数计算上一季度取值与最新季度序号，
+    再在外层应用季度范围与过滤条件，整个筛选在一条SQL中完成。
+    dialect 只影响标签条件的写法（见 labels_contain）。
+    """
+    previous = trend_fields(tree)
+
+    order_by_quarter = models.Quarter.quarter
+    partition = models.Quarter.company_id
+    source_columns = {name: getattr(models.Quarter, name) for name in METRIC_FIELDS}
+    source_columns.update({name: getattr(models.SystemAnalysis, name) for name in SCORE_FIELDS})
+
+    base = select(
+        models.Quarter.id.label("quarter_id"),
+        models.Quarter.company_id,
+        models.Quarter.quarter,
+        models.Company.ticker,
+        models.Company.company_name,
+        models.Company.company_type,
+        models.SystemAnalysis.labels,
+        *[column.label(name) for name, column in source_columns.items()],
+        *[
+            func.lag(source_columns[name]).over(partition_by=partition, order_by=order_by_quarter).label(f"prev_{name}")
+            for name in previous
+        ],
+        func.row_number().over(partition_by=partition, order_by=desc(order_by_quarter)).label("recency"),
+    ).join(models.Company, models.Company.id == models.Quarter.company_id)\
+        .outerjoin(models.SystemAnalysis, models.SystemAnalysis.quarter_id == models.Quarter.id)
+
+    if company_type:
+        base = base.where(models.Company.company_type == company_type)
+
+    # 必需的标签先经 GIN 索引（labels @> ARRAY[...]）找出候选公司，窗口函数只在这些公司的
+    # 季度上计算；候选公司的全部季度都保留，上一季度与最新季度的判定不受影响
+    labels = required_labels(tree)
+    if labels:
+        candidates = select(models.Quarter.company_id)\
+            .join(models.SystemAnalysis, models.SystemAnalysis.quarter_id == models.Quarter.id)\
+            .where(labels_contain(models.SystemAnalysis.labels, labels, dialect))
+        base = base.where(models.Quarter.company_id.in_(candidates))
+
+    snapshot = base.subquery("snapshot")
+    columns = snapshot.c
+
+    query = select(
+        columns.quarter_id, columns.company_id, columns.quarter,
+        columns.ticker, columns.company_name, columns.company_type, columns.labels,
+        *[columns[name] for name in NUMERIC_FIELDS],
+    )
+
+    if quarter == "latest":
+        query = query.where(columns.recency == 1)
+    elif quarter != "all":
+        query = query.where(columns.quarter == quarter)
+
+    if tree is not None:
+        query = query.where(compile_condition(tree, columns, dialect))
+
+    field = sort_field(sort)
+    if field:
+        direction = desc if sort.startswith("-") else asc
+        query = query.order_by(direction(columns[field]).nulls_last(), columns.ticker, desc(columns.quarter))
+    else:
+        query = query.order_by(columns.ticker, desc(columns.quarter))
+
+    return query.limit(limit)
+
+
+def _run_on_store(
+    db: Session,
+    store,
+    tree,
+    quarter: str,
+    company_type: Optional[models.CompanyType],
+    sort: Optional[str],
+    limit: int,
+) -> List[Dict[str, Any]]:
+    """在列式指标快照上求值，只对命中的行回表查询公司信息与标签"""
+    matrix = store.ensure_loaded(db)
+    company_ids = store.column(matrix, "company_id")
+    periods = store.column(matrix, "period")
+    columns = {name: store.column(matrix, name) for name in NUMERIC_FIELDS}
+
+    # 行已按 (company_id, 季度) 排序：company_id 变化的位置即公司分界
+    first_of_company = np.ones(len(company_ids), dtype=bool)
+    first_of_company[1:] = company_ids[1:] != company_ids[:-1]
+    last_of_company = np.ones(len(company_ids), dtype=bool)
+    last_of_company[:-1] = first_of_company[1:]
+
+    for name in trend_fields(tree):
+        previous = np.empty(len(company_ids))
+        previous[1:] = columns[name][:-1]
+        previous[first_of_company] = np.nan
+        columns[f"prev_{name}"] = previous
+
+    mask = np.ones(len(company_ids), dtype=bool)
+    if company_type:
+        mask &= store.column(matrix, "company_type") == store.type_code(company_type)
+    if quarter == "latest":
+        mask &= last_of_company
+    elif quarter != "all":
+        mask &= periods == store.period_code(quarter)
+    if tree is not None:
+        mask &= evaluate_condition(tree, columns)[0]
+
+    rows = np.flatnonzero(mask)
+    field = sort_field(sort)
+    if field:
+        # NaN 在升序和倒序下都排在最后，与SQL的 NULLS LAST 一致
+        values = -columns[field][rows] if sort.startswith("-") else columns[field][rows]
+        if 0 < limit < len(rows):
+            # 只保留前 limit 个值及与第 limit 个并列的行，回表取 ticker 的范围不随命中数增长
+            cutoff = np.partition(values, limit - 1)[limit - 1]
+            if not np.isnan(cutoff):
+                keep = values <= cutoff
+                rows, values = rows[keep], values[keep]
+
+    matched_companies = {int(company_id) for company_id in company_ids[rows]}
+    companies = {
+        row.id: row for row in db.query(
+            models.Company.id, models.Company.ticker, models.Company.company_name, models.Company.company_type
+        ).filter(models.Company.id.in_(matched_companies)).all()
+    } if matched_companies else {}
+
+    # 与SQL路径相同的顺序：排序字段、ticker、季度从新到旧
+    tickers = np.array([companies[int(company_id)].ticker for company_id in company_ids[rows]], dtype=str)
+    sort_keys = (-periods[rows], tickers) + ((values,) if field else ())
+    rows = rows[np.lexsort(sort_keys)][:limit]
+
+    quarter_ids = [int(store.column(matrix, "quarter_id")[r]) for r in rows]
+    labels = dict(
+        db.query(models.SystemAnalysis.quarter_id, models.SystemAnalysis.labels)
+        .filter(models.SystemAnalysis.quarter_id.in_(quarter_ids)).all()
+    ) if quarter_ids else {}
+
+    items = []
+    for r, quarter_id in zip(rows, quarter_ids):
+        company = companies[int(company_ids[r])]
+        item = {
+            "quarter_id": quarter_id,
+            "company_id": company.id,
+            "quarter": store.period_label(periods[r]),
+            "ticker": company.ticker,
+            "company_name": company.company_name,
+            "company_type": company.company_type,
+            "labels": labels.get(quarter_id),
+        }
+        for name in NUMERIC_FIELDS:
+            value = columns[name][r]
+            item[name] = None if np.isnan(value) else float(value)
+        items.append(item)
+    return items
+
+
+def run_screen(
+    db: Session,
+    expression: Optional[str],
+    quarter: str = "latest",
+    company_type: Optional[models.CompanyType] = None,
+    sort: Optional[str] = None,
+    limit: int = 100,
+    store=None,
+) -> List[Dict[str, Any]]:
+    """执行筛选，返回命中的 (公司, 季度) 行
+
+    传入 store（metrics_store.MetricsStore）时在列式快照上求值；
+    表达式含标签条件时仍走SQL。
+    """
+    tree = parse(expression)
+    if store is not None and not uses_labels(tree):
+        return _run_on_store(db, store, tree, quarter, company_type, sort, limit)
+
+    query = build_screen_query(tree, quarter, company_type, sort, limit, db.get_bind().dialect.name)
+    items = []
+    for row in db.execute(query).mappings():
+        item = dict(row)
+        for name in NUMERIC_FIELDS:
+            value = item[name]
+            item[name] = float(value) if value is not None else None
+        items.append(item)
+    return items
+
+
+# 列式快照与SQL两条路径的一致性检查（python manage.py check-screener-parity）
+PARITY_EXPRESSIONS = (
+    None,
+    "roic > wacc",
+    "roic - wacc > 5 and valuation_score > 70",
+    "quality_score >= 80 or pe < 15",
+    "trend_score rising",
+    "not (roe falling)",
+)
+PARITY_SORTS = (None, "roic", "-roic", "pe", "-quality_score")
+PARITY_QUARTERS = ("latest", "all")
+
+
+def parity_mismatches(db: Session, store, limit: int = 50) -> List[Dict[str, Any]]:
+    """同一组表达式、排序与季度分别在列式快照和SQL上执行，返回结果（含顺序）不一致的组合"""
+    mismatches = []
+    for expression in PARITY_EXPRESSIONS:
+        for sort in PARITY_SORTS:
+            for quarter in PARITY_QUARTERS:
+                expected = run_screen(db, expression, quarter, None, sort, limit)
+                actual = run_screen(db, expression, quarter, None, sort, limit, store=store)
+                if actual != expected:
+                    mismatches.append({
+                        "expression": expression, "sort": sort, "quarter": quarter,
+                        "sql": [(item["ticker"], item["quarter"]) for item in expected],
+                        "store": [(item["ticker"], item["quarter"]) for item in actual],
+                    })
+    return mismatches
@@ -0,0 +1,254 @@
+"""全文检索 - 单季度AI分析、系统摘要与综合AI分析的倒排索引、排序与摘录高亮
+
+PostgreSQL 自带的分词配置不切分中文，因此写入时先在 Python 中分词：连续的汉字切成
+重叠的二元组（"资本开支" → 资本 本开 开支），字母数字按词小写，再以 'simple' 配置
+生成 tsvector 存入 search_documents.tsv（GIN 索引）。查询按同样规则切分，每个检索词的
+二元组以 <-> 相邻短语匹配，相当于原文子串匹配；多个检索词之间为 AND。单个汉字的检索词
+以前缀匹配任何以它开头的二元组。结果按 ts_rank_cd 排序，摘录在 Python 中从原文截取，
+返回高亮区间而不是 HTML。
+
+其他数据库没有 tsvector，退化为对原文的 LIKE 子串匹配（检索词的各字串分别匹配），
+按更新时间排序。
+
+写入路径在保存分析文本的同一事务中更新对应文档；删除季度或公司时由外键级联删除。
+首次部署或修复索引：python manage.py reindex
+"""
+import re
+from typing import Optional, List, Dict, Iterable, Tuple
+from sqlalchemy.orm import Session
+from sqlalchemy import desc, func, and_, literal, insert, bindparam
+import models
+from database import dialect_insert
+
+KINDS = ("quarter_ai", "system_summary", "comprehensive_ai")
+MAX_TERMS = 8
+MAX_QUERY_LENGTH = 200
+SNIPPET_CHARS = 120
+REBUILD_BATCH = 500
+
+_CJK = "\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff"
+_RUN_RE = re.compile(rf"[{_CJK}]+|[^\W_{_CJK}]+")
+_CJK_RE = re.compile(rf"[{_CJK}]")
+
+
+class SearchQueryError(ValueError):
+    """检索词错误"""
+
+
+def _runs(text: str) -> List[str]:
+    """按汉字串、字母数字串切分"""
+    return _RUN_RE.findall(text)
+
+
+def tokenize(text: str) -> List[str]:
+    """写入与查询共用的分词：汉字串切为重叠二元组（单字保留本身），其余小写"""
+    tokens = []
+    for run in _runs(text or ""):
+        if _CJK_RE.match(run):
+            if len(run) == 1:
+                tokens.append(run)
+            else:
+                tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run.lower())
+    return tokens
+
+
+def parse_query(query: str) -> List[str]:
+    """拆分检索词（空白分隔，去重保序）"""
+    query = (query or "").strip()
+    if not query:
+        raise SearchQueryError("检索词不能为空")
+    if len(query) > MAX_QUERY_LENGTH:
+        raise SearchQueryError(f"检索词不能超过 {MAX_QUERY_LENGTH} 个字符")
+    terms = [term for term in dict.fromkeys(query.split()) if tokenize(term)]
+    if not terms:
+        raise SearchQueryError("检索词需要包含文字或数字")
+    if len(terms) > MAX_TERMS:
+        raise SearchQueryError(f"最多 {MAX_TERMS} 个检索词")
+    return terms
+
+
+def to_tsquery_text(terms: List[str]) -> str:
+    """检索词 → to_tsquery('simple', …) 的查询串：词内短语相邻，词间 AND"""
+    clauses = []
+    for term in terms:
+        tokens = tokenize(term)
+        if len(tokens) == 1 and _CJK_RE.fullmatch(tokens[0]):
+            clauses.append(f"{tokens[0]}:*")
+        else:
+            clauses.append("(" + " <-> ".join(tokens) + ")")
+    return " & ".join(clauses)
+
+
+def _is_postgres(db: Session) -> bool:
+    return db.get_bind().dialect.name == "postgresql"
+
+
+def _tsvector(text: str):
+    return func.to_tsvector("simple", " ".join(tokenize(text)))
+
+
+def index_document(db: Session, kind: str, company_id: int, quarter_id: Optional[int], text: Optional[str]) -> None:
+    """写入或更新一个文档（不提交）；文本为空时删除
+
+    subject 为季度类文档的 quarter_id、综合分析的 company_id，(kind, subject_id) 唯一。
+    """
+    document = models.SearchDocument
+    subject_id = quarter_id if quarter_id is not None else company_id
+    if not text or not text.strip():
+        db.query(document)\
+            .filter(document.kind == kind, document.subject_id == subject_id)\
+            .delete(synchronize_session=False)
+        return
+
+    values = {
+        "kind": kind, "subject_id": subject_id, "company_id": company_id, "quarter_id": quarter_id,
+        "body": text, "updated_at": func.now(),
+    }
+    if _is_postgres(db):
+        values["tsv"] = _tsvector(text)
+    insert = dialect_insert(db)(document).values(**values)
+    db.execute(insert.on_conflict_do_update(
+        index_elements=["kind", "subject_id"],
+        set_={name: getattr(insert.excluded, name) for name in values if name not in ("kind", "subject_id")}
+    ))
+
+
+def _source_rows(db: Session) -> Iterable[Tuple[str, int, Optional[int], Optional[str]]]:
+    """(kind, company_id, quarter_id, text)，逐个来源表读取"""
+    quarter = models.Quarter
+    ai = models.QuarterAIAnalysis
+    system = models.SystemAnalysis
+    comprehensive = models.CompanyComprehensiveAI
+    sources = (
+        ("quarter_ai", db.query(quarter.company_id, ai.quarter_id, ai.analysis_text)
+            .join(quarter, quarter.id == ai.quarter_id).order_by(ai.quarter_id)),
+        ("system_summary", db.query(quarter.company_id, system.quarter_id, system.system_summary)
+            .join(quarter, quarter.id == system.quarter_id).order_by(system.quarter_id)),
+        ("comprehensive_ai", db.query(comprehensive.company_id, literal(None), comprehensive.analysis_text)
+            .order_by(comprehensive.company_id)),
+    )
+    for kind, query in sources:
+        for company_id, quarter_id, text in query.all():
+            yield kind, company_id, quarter_id, text
+
+
+def rebuild(db: Session) -> int:
+    """清空并按来源表全量重建索引（不提交），返回文档数"""
+    document = models.SearchDocument
+    db.query(document).delete(synchronize_session=False)
+
+    postgres = _is_postgres(db)
+    statement = insert(document)
+    if postgres:
+        statement = statement.values(tsv=func.to_tsvector("simple", bindparam("tokens")))
+    batch, count = [], 0
+    for kind, company_id, quarter_id, text in _source_rows(db):
+        if not text or not text.strip():
+            continue
+        params = {
+            "kind": kind, "subject_id": quarter_id if quarter_id is not None else company_id,
+            "company_id": company_id, "quarter_id": quarter_id, "body": text,
+        }
+        if postgres:
+            params["tokens"] = " ".join(tokenize(text))
+        batch.append(params)
+        if len(batch) >= REBUILD_BATCH:
+            db.execute(statement, batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        db.execute(statement, batch)
+        count += len(batch)
+    return count
+
+
+def _match_pattern(terms: List[str]) -> re.Pattern:
+    """原文中的命中位置：检索词的各字串之间允许空白与标点（与分词规则一致）"""
+    alternatives = [r"[\W_]*".join(re.escape(run) for run in _runs(term)) for term in terms]
+    return re.compile("|".join(f"(?:{alt})" for alt in sorted(alternatives, key=len, reverse=True)), re.IGNORECASE)
+
+
+def snippet(text: str, pattern: re.Pattern, width: int = SNIPPET_CHARS) -> Tuple[str, List[List[int]]]:
+    """以第一个命中为中心截取摘录，返回 (摘录, 摘录内的高亮区间 [开始, 结束))"""
+    first = pattern.search(text)
+    center = first.start() if first else 0
+    start = max(0, min(center - width // 3, len(text) - width))
+    end = min(len(text), start + width)
+    prefix = "…" if start > 0 else ""
+    suffix = "…" if end < len(text) else ""
+    excerpt = prefix + text[start:end].replace("\n", " ") + suffix
+
+    offset = len(prefix) - start
+    highlights = [
+        [m.start() + offset, m.end() + offset]
+        for m in pattern.finditer(text, start, end)
+        if m.end() > m.start()
+    ]
+    return excerpt, highlights
+
+
+def search(
+    db: Session,
+    query: str,
+    kinds: Optional[List[str]] = None,
+    company_id: Optional[int] = None,
+    limit: int = 20
+) -> Dict:
+    """检索并返回按相关度排序的命中（含摘录与高亮区间）"""
+    terms = parse_query(query)
+    kinds = list(dict.fromkeys(kinds)) if kinds else list(KINDS)
+    unknown = [kind for kind in kinds if kind not in KINDS]
+    if unknown:
+        raise SearchQueryError(f"未知的检索范围：{', '.join(unknown)}，可选 {', '.join(KINDS)}")
+
+    document = models.SearchDocument
+    company = models.Company
+    quarter = models.Quarter
+    columns = [
+        document.kind, document.company_id, document.quarter_id, document.body, document.updated_at,
+        company.ticker, company.company_name, quarter.quarter,
+    ]
+    filters = [document.kind.in_(kinds)]
+    if company_id is not None:
+        filters.append(document.company_id == company_id)
+
+    if _is_postgres(db):
+        tsquery = func.to_tsquery("simple", to_tsquery_text(terms))
+        rank = func.ts_rank_cd(document.tsv, tsquery)
+        filters.append(document.tsv.op("@@")(tsquery))
+        order = [desc(rank), desc(document.updated_at)]
+    else:
+        # 检索词的每个字串都须出现（不检查相邻），与分词规则一致地忽略中间的空白与标点
+        rank = literal(None)
+        for run in dict.fromkeys(run.lower() for term in terms for run in _runs(term)):
+            escaped = run.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            filters.append(func.lower(document.body).like(f"%{escaped}%", escape="\\"))
+        order = [desc(document.updated_at)]
+
+    rows = db.query(*columns, rank.label("rank"))\
+        .join(company, company.id == document.company_id)\
+        .outerjoin(quarter, quarter.id == document.quarter_id)\
+        .filter(and_(*filters))\
+        .order_by(*order, desc(document.id))\
+        .limit(limit)\
+        .all()
+
+    pattern = _match_pattern(terms)
+    items = []
+    for row in rows:
+        excerpt, highlights = snippet(row.body, pattern)
+        items.append({
+            "kind": row.kind,
+            "company_id": row.company_id,
+            "ticker": row.ticker,
+            "company_name": row.company_name,
+            "quarter_id": row.quarter_id,
+            "quarter": row.quarter,
+            "rank": round(float(row.rank), 6) if row.rank is not None else None,
+            "snippet": excerpt,
+            "highlights": highlights,
+            "updated_at": row.updated_at,
+        })
+    return {"query": query, "terms": terms, "kinds": kinds, "count": len(items), "items": items}
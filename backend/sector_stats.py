@@ -0,0 +1,248 @@
+"""行业聚合统计 - 按公司类型与季度预计算指标分布（中位数、四分位、直方图）与标签计数
+
+写入路径只刷新受影响的 (公司类型, 季度) 分组，每组只涉及同类型公司在该季度的
+少量行；refresh_all 用于首次建表或数据修复时全量重建。统计行以 upsert 写入，
+并发刷新同一分组不会产生唯一键冲突；分组清空后保留 sample_count=0 的行。
+
+标签计数（sector_label_counts）按同样的分组维护，另有 quarter 为 latest 的分组统计
+各公司最新季度的标签，类型内任一季度变化时一并刷新；不再出现的标签计数归零。
+
+全量重建：python manage.py refresh-sector-stats
+"""
+import math
+from collections import defaultdict, Counter
+from typing import Optional, List, Dict, Iterable, Tuple
+from sqlalchemy.orm import Session
+from sqlalchemy import desc, func, and_
+import models
+from database import dialect_insert
+from quarter_metrics import to_float
+from screener import SCORE_FIELDS
+
+STAT_METRICS = ("roic", "gross_margin", "fcf_margin", "pe", "pb", "ps") + SCORE_FIELDS
+HISTOGRAM_BINS = 10
+LATEST = "latest"  # 标签计数中“各公司最新季度”的分组
+
+
+def quantile(sorted_values: List[float], q: float) -> float:
+    """线性插值分位数（与 numpy 默认方法一致）"""
+    position = (len(sorted_values) - 1) * q
+    lower = math.floor(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def histogram_edges(min_value: float, max_value: float, bins: int = HISTOGRAM_BINS) -> List[float]:
+    width = (max_value - min_value) / bins
+    return [min_value + width * i for i in range(bins + 1)]
+
+
+def summarize(values: List[float]) -> Dict:
+    """单个指标的分布摘要；无样本时只返回数量"""
+    if not values:
+        return {"sample_count": 0, "min_value": None, "p25": None, "median": None,
+                "p75": None, "max_value": None, "histogram": None}
+
+    values = sorted(values)
+    low, high = values[0], values[-1]
+    counts = [0] * HISTOGRAM_BINS
+    width = (high - low) / HISTOGRAM_BINS
+    for value in values:
+        index = int((value - low) / width) if width else 0
+        counts[min(index, HISTOGRAM_BINS - 1)] += 1
+
+    return {
+        "sample_count": len(values),
+        "min_value": low,
+        "p25": quantile(values, 0.25),
+        "median": quantile(values, 0.5),
+        "p75": quantile(values, 0.75),
+        "max_value": high,
+        "histogram": counts,
+    }
+
+
+def _group_rows(db: Session, company_type: Optional[models.CompanyType] = None, quarter: Optional[str] = None):
+    """查询 (公司类型, 季度, 各统计指标) 行，只取需要的列"""
+    query = db.query(
+        models.Company.company_type,
+        models.Quarter.quarter,
+        *[getattr(models.Quarter, name) for name in STAT_METRICS if name not in SCORE_FIELDS],
+        *[getattr(models.SystemAnalysis, name) for name in SCORE_FIELDS]
+    ).join(models.Company, models.Company.id == models.Quarter.company_id)\
+        .outerjoin(models.SystemAnalysis, models.SystemAnalysis.quarter_id == models.Quarter.id)
+    if company_type is not None:
+        query = query.filter(models.Company.company_type == company_type)
+    if quarter is not None:
+        query = query.filter(models.Quarter.quarter == quarter)
+    return query.all()
+
+
+def _write_group(db: Session, company_type: models.CompanyType, quarter: str, rows: List[tuple]) -> None:
+    insert = dialect_insert(db)
+    for index, metric in enumerate(STAT_METRICS, start=2):
+        summary = summarize([to_float(row[index]) for row in rows if row[index] is not None])
+        statement = insert(models.SectorPeriodStat).values(
+            company_type=company_type,
+            quarter=quarter,
+            metric=metric,
+            **summary
+        )
+        db.execute(statement.on_conflict_do_update(
+            index_elements=["company_type", "quarter", "metric"],
+            set_={**summary, "updated_at": func.now()}
+        ))
+
+
+def _label_rows(db: Session, company_type: models.CompanyType, quarter: str) -> List[Optional[List[str]]]:
+    """分组内各季度的标签；quarter 为 LATEST 时取该类型各公司的最新季度"""
+    query = db.query(models.SystemAnalysis.labels)\
+        .join(models.Quarter, models.Quarter.id == models.SystemAnalysis.quarter_id)\
+        .join(models.Company, models.Company.id == models.Quarter.company_id)\
+        .filter(models.Company.company_type == company_type)
+    if quarter == LATEST:
+        latest = db.query(models.Quarter.company_id, func.max(models.Quarter.quarter).label("quarter"))\
+            .join(models.Company, models.Company.id == models.Quarter.company_id)\
+            .filter(models.Company.company_type == company_type)\
+            .group_by(models.Quarter.company_id)\
+            .subquery()
+        query = query.join(latest, and_(
+            latest.c.company_id == models.Quarter.company_id, latest.c.quarter == models.Quarter.quarter
+        ))
+    else:
+        query = query.filter(models.Quarter.quarter == quarter)
+    return [labels for (labels,) in query.all()]
+
+
+def _write_label_group(db: Session, company_type: models.CompanyType, quarter: str,
+                       label_lists: List[Optional[List[str]]]) -> None:
+    table = models.SectorLabelCount
+    counts = Counter(label for labels in label_lists for label in set(labels or ()))
+    insert = dialect_insert(db)
+    for label, count in counts.items():
+        statement = insert(table).values(company_type=company_type, quarter=quarter, label=label, company_count=count)
+        db.execute(statement.on_conflict_do_update(
+            index_elements=["company_type", "quarter", "label"],
+            set_={"company_count": count, "updated_at": func.now()}
+        ))
+
+    stale = db.query(table)\
+        .filter(table.company_type == company_type, table.quarter == quarter, table.company_count > 0)
+    if counts:
+        stale = stale.filter(table.label.notin_(list(counts)))
+    stale.update({"company_count": 0, "updated_at": func.now()}, synchronize_session=False)
+
+
+def refresh_groups(db: Session, groups: Iterable[Tuple[models.CompanyType, str]]) -> None:
+    """刷新指定 (公司类型, 季度) 分组及对应类型的最新季度标签计数（不提交，调用前需 flush 本事务中的改动）"""
+    groups = set(groups)
+    for company_type, quarter in groups:
+        _write_group(db, company_type, quarter, _group_rows(db, company_type, quarter))
+        _write_label_group(db, company_type, quarter, _label_rows(db, company_type, quarter))
+    for company_type in {company_type for company_type, _ in groups}:
+        _write_label_group(db, company_type, LATEST, _label_rows(db, company_type, LATEST))
+
+
+def refresh_all(db: Session) -> int:
+    """全量重建所有分组（不提交），返回分组数"""
+    grouped = defaultdict(list)
+    for row in _group_rows(db):
+        grouped[(row[0], row[1])].append(row)
+
+    for (company_type, quarter), rows in grouped.items():
+        _write_group(db, company_type, quarter, rows)
+
+    # 已不存在任何季度数据的分组
+    for company_type, quarter in db.query(models.SectorPeriodStat.company_type, models.SectorPeriodStat.quarter).distinct().all():
+        if (company_type, quarter) not in grouped:
+            db.query(models.SectorPeriodStat)\
+                .filter(models.SectorPeriodStat.company_type == company_type)\
+                .filter(models.SectorPeriodStat.quarter == quarter)\
+                .delete(synchronize_session=False)
+
+    db.query(models.SectorLabelCount).delete(synchronize_session=False)
+    for company_type, quarter in grouped:
+        _write_label_group(db, company_type, quarter, _label_rows(db, company_type, quarter))
+    for company_type in {company_type for company_type, _ in grouped}:
+        _write_label_group(db, company_type, LATEST, _label_rows(db, company_type, LATEST))
+    return len(grouped)
+
+
+def get_label_facets(db: Session, company_type: Optional[models.CompanyType] = None, quarter: str = LATEST) -> Dict:
+    """读取预计算的标签计数
+
+    quarter 为 latest（各公司最新季度）、具体季度或 all（所有季度，计数为公司-季度数）。
+    返回各标签合计与按 (公司类型, 季度) 的明细。
+    """
+    table = models.SectorLabelCount
+    query = db.query(table.company_type, table.quarter, table.label, table.company_count, table.updated_at)\
+        .filter(table.company_count > 0)
+    if company_type is not None:
+        query = query.filter(table.company_type == company_type)
+    if quarter == "all":
+        query = query.filter(table.quarter != LATEST)
+    else:
+        query = query.filter(table.quarter == quarter)
+    rows = query.all()
+
+    totals = Counter()
+    for row in rows:
+        totals[row.label] += row.company_count
+    return {
+        "quarter": quarter,
+        "company_type": company_type,
+        "totals": [{"label": label, "count": count}
+                   for label, count in sorted(totals.items(), key=lambda item: (-item[1], item[0]))],
+        "groups": [
+            {"company_type": row.company_type, "quarter": row.quarter, "label": row.label, "count": row.company_count}
+            for row in sorted(rows, key=lambda r: (r.company_type.value, r.quarter, -r.company_count, r.label))
+        ],
+        "updated_at": max((row.updated_at for row in rows if row.updated_at is not None), default=None),
+    }
+
+
+def get_sector_stats(db: Session, company_type: models.CompanyType, quarter: Optional[str] = None) -> Optional[Dict]:
+    """读取预计算的分布；quarter 为空时取该类型最新的季度"""
+    available = [
+        q for (q,) in db.query(models.SectorPeriodStat.quarter)
+        .filter(models.SectorPeriodStat.company_type == company_type)
+        .filter(models.SectorPeriodStat.sample_count > 0)
+        .distinct()
+        .order_by(desc(models.SectorPeriodStat.quarter))
+        .all()
+    ]
+    if not available:
+        return None
+    quarter = quarter or available[0]
+
+    stats = db.query(models.SectorPeriodStat)\
+        .filter(models.SectorPeriodStat.company_type == company_type)\
+        .filter(models.SectorPeriodStat.quarter == quarter)\
+        .all()
+    if not stats:
+        return None
+
+    metrics = {}
+    for stat in stats:
+        low, high = to_float(stat.min_value), to_float(stat.max_value)
+        metrics[stat.metric] = {
+            "count": stat.sample_count,
+            "min": low,
+            "p25": to_float(stat.p25),
+            "median": to_float(stat.median),
+            "p75": to_float(stat.p75),
+            "max": high,
+            "histogram": {
+                "edges": histogram_edges(low, high) if stat.histogram else [],
+                "counts": stat.histogram or [],
+            },
+        }
+
+    return {
+        "company_type": company_type,
+        "quarter": quarter,
+        "available_quarters": available,
+        "updated_at": max(stat.updated_at for stat in stats),
+        "metrics": metrics,
+    }
+
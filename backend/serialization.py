@@ -0,0 +1,97 @@
+"""读取接口的快速序列化 - 字段选择与直接输出JSON
+
+详情接口原先先用 Pydantic 把每行 model_validate().model_dump() 成字典，FastAPI 再按
+response_model 校验、序列化一遍。这里直接从查询结果构建与响应 Schema 相同结构的
+字典，并由 FastJSONResponse 一次编码（安装了 orjson 时使用 orjson，否则退回标准库
+json），跳过重复校验。
+
+字段选择：
+- fields：季度级字段白名单（如 quarter,roic,wacc），id 总会返回
+- include：可选的重量级部分，取值见 INCLUDE_PARTS；缺省时全部返回，传空值表示都不要
+"""
+import json
+from datetime import datetime, date
+from decimal import Decimal
+from enum import Enum
+from typing import Optional, Set, Dict, Any, Iterable
+from fastapi.responses import Response
+import schemas
+
+try:
+    import orjson
+except ImportError:  # 未安装 orjson 时使用标准库 json
+    orjson = None
+
+QUARTER_FIELDS = tuple(schemas.QuarterResponse.model_fields)
+SYSTEM_ANALYSIS_FIELDS = tuple(schemas.SystemAnalysisResponse.model_fields)
+AI_ANALYSIS_FIELDS = tuple(schemas.QuarterAIAnalysisResponse.model_fields)
+COMPREHENSIVE_AI_FIELDS = tuple(schemas.CompanyComprehensiveAIResponse.model_fields)
+COMPANY_FIELDS = tuple(schemas.CompanyResponse.model_fields)
+
+INCLUDE_PARTS = ("system_analysis", "system_summary", "ai_analysis", "comprehensive_ai")
+
+
+class FieldSelectorError(ValueError):
+    """fields / include 中包含未知字段"""
+
+
+def parse_selector(value: Optional[str], allowed: Iterable[str], name: str) -> Optional[Set[str]]:
+    """解析逗号分隔的字段列表；None 表示未指定（返回全部）"""
+    if value is None:
+        return None
+    selected = {part.strip() for part in value.split(",") if part.strip()}
+    unknown = selected - set(allowed)
+    if unknown:
+        raise FieldSelectorError(f"{name} 包含未知字段: {', '.join(sorted(unknown))}")
+    return selected
+
+
+def parse_fields(value: Optional[str]) -> Optional[Set[str]]:
+    fields = parse_selector(value, QUARTER_FIELDS, "fields")
+    return fields | {"id"} if fields is not None else None
+
+
+def parse_include(value: Optional[str]) -> Set[str]:
+    include = parse_selector(value, INCLUDE_PARTS, "include")
+    return set(INCLUDE_PARTS) if include is None else include
+
+
+def quarter_columns(fields: Optional[Set[str]]) -> tuple:
+    """按 Schema 字段顺序返回需要查询的季度列名"""
+    return tuple(name for name in QUARTER_FIELDS if fields is None or name in fields)
+
+
+def plain(value: Any) -> Any:
+    """Numeric 列读出的 Decimal 转 float，与 Pydantic 的 Optional[float] 输出一致"""
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+def row_to_dict(row: Any, names: Iterable[str]) -> Dict[str, Any]:
+    """从 ORM 对象或按列查询的结果行取出指定字段"""
+    return {name: plain(getattr(row, name)) for name in names}
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, Enum):
+        return value.value
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, default=_default)
+    return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(Response):
+    """直接编码已构建好的字典，不经过 response_model 校验"""
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,199 @@
+"""AI生成的 single-flight 去重 - 相同输入的并发生成只调用一次LLM
+
+键为 (作用域, 输入指纹)：作用域如 quarter:12 / company:3，指纹是完整 Prompt 的哈希，
+因此输入变化后的生成不会被旧结果顶替。
+
+- 进程内：同一个键只有一个线程（leader）调用LLM，其余线程等待并共享其结果
+- 跨进程：leader 在 ai_generation_locks 表中以 upsert 抢占带租约的锁行，完成后把结果
+  写回该行；其他进程轮询取结果。租约过期（持锁进程退出）后由等待者接管。
+
+只合并进行中的生成，不缓存已完成的结果：结果只交给生成完成时已在等待的调用方，
+之后到来的请求（包括手动重新生成）会重新调用LLM。生成失败（抛出异常或返回
+ai_service 的失败提示文本）时删除锁行，失败文本不会交给其他进程的等待者。
+
+锁表的读写都在独立的短事务中完成，等待期间不占用数据库连接（不使用会话级
+advisory lock，否则持锁期间必须一直占着一个连接）。
+"""
+import os
+import time
+import socket
+import hashlib
+import uuid
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional
+from sqlalchemy import and_, or_
+import models
+from ai_service import is_fallback_text
+from config import settings
+from database import SessionLocal, dialect_insert
+from instrumentation import AI_DEDUPLICATED
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = 0.5
+
+
+def fingerprint(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Optional[str] = None
+        self.error: Optional[BaseException] = None
+
+
+_calls: Dict[str, _Call] = {}
+_calls_lock = threading.Lock()
+
+
+def run(scope: str, prompt: str, generate: Callable[[], str]) -> str:
+    """执行或复用一次生成：相同 (scope, prompt) 正在生成时等待并返回同一结果"""
+    key = f"{scope}:{fingerprint(prompt)}"
+    kind = scope.split(":", 1)[0]
+
+    with _calls_lock:
+        call = _calls.get(key)
+        leader = call is None
+        if leader:
+            call = _calls[key] = _Call()
+
+    if not leader:
+        AI_DEDUPLICATED.inc((kind, "thread"))
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    try:
+        call.result = _run_across_processes(key, kind, generate)
+        return call.result
+    except BaseException as e:
+        call.error = e
+        raise
+    finally:
+        with _calls_lock:
+            _calls.pop(key, None)
+        call.done.set()
+
+
+def _owner() -> str:
+    """每次生成唯一的持锁者标识，等待者据此认出自己等待的那一次生成"""
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}:{uuid.uuid4().hex[:8]}"
+
+
+def _run_across_processes(key: str, kind: str, generate: Callable[[], str]) -> str:
+    if not settings.ai_singleflight_enabled:
+        return generate()
+
+    owner = _owner()
+    waiting_for = None
+    deadline = time.monotonic() + settings.ai_singleflight_wait_seconds
+    while True:
+        try:
+            acquired, result, waiting_for = _acquire(key, owner, waiting_for)
+        except Exception as e:
+            # 锁表不可用（如未执行 migrate）时退化为不去重
+            logger.warning(f"AI single-flight lock unavailable, generating without dedupe: {e}")
+            return generate()
+
+        if result is not None:
+            AI_DEDUPLICATED.inc((kind, "process"))
+            return result
+        if acquired:
+            break
+        if time.monotonic() >= deadline:
+            logger.warning(f"Timed out waiting for in-flight generation {key}, generating independently")
+            return generate()
+        time.sleep(POLL_INTERVAL)
+
+    try:
+        result = generate()
+    except BaseException:
+        _release(key, owner)
+        raise
+    if is_fallback_text(result):
+        _release(key, owner)
+    else:
+        _complete(key, owner, result)
+    return result
+
+
+def _acquire(key: str, owner: str, waiting_for: Optional[str]) -> tuple:
+    """抢占锁行，返回 (是否成为 leader, 等待的那次生成的结果, 正在等待的持锁者)
+
+    waiting_for 为上次轮询时看到的进行中的持锁者。可接管的情况：行不存在；上一个持锁者
+    租约已过期且未完成；行已完成且不是本调用方等待的那一次生成。
+    """
+    now = datetime.utcnow()
+    lock = models.AIGenerationLock
+    db = SessionLocal()
+    try:
+        insert = dialect_insert(db)(lock).values(
+            lock_key=key, owner=owner, acquired_at=now,
+            expires_at=now + timedelta(seconds=settings.ai_singleflight_lease_seconds),
+            result_text=None, completed_at=None
+        )
+        finished = lock.completed_at.is_not(None)
+        if waiting_for is not None:
+            finished = and_(finished, lock.owner != waiting_for)
+        stale = or_(and_(lock.completed_at.is_(None), lock.expires_at < now), finished)
+        statement = insert.on_conflict_do_update(
+            index_elements=["lock_key"],
+            set_={name: getattr(insert.excluded, name)
+                  for name in ("owner", "acquired_at", "expires_at", "result_text", "completed_at")},
+            where=stale
+        ).returning(lock.owner)
+        acquired = db.execute(statement).first() is not None
+        if acquired:
+            db.commit()
+            return True, None, None
+
+        row = db.query(lock.owner, lock.result_text, lock.completed_at).filter(lock.lock_key == key).first()
+        db.commit()
+        if row is None:
+            return False, None, None
+        if row.completed_at is not None:
+            return False, row.result_text, row.owner
+        return False, None, row.owner
+    finally:
+        db.close()
+
+
+def _complete(key: str, owner: str, result: str) -> None:
+    lock = models.AIGenerationLock
+    db = SessionLocal()
+    try:
+        db.query(lock)\
+            .filter(lock.lock_key == key, lock.owner == owner)\
+            .update({"result_text": result, "completed_at": datetime.utcnow()}, synchronize_session=False)
+        # 顺带清理早已过期的行
+        cutoff = datetime.utcnow() - timedelta(
+            seconds=max(settings.ai_singleflight_lease_seconds, settings.ai_singleflight_result_ttl_seconds) * 2
+        )
+        db.query(lock).filter(lock.expires_at < cutoff).delete(synchronize_session=False)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"Failed to record AI single-flight result for {key}: {e}")
+    finally:
+        db.close()
+
+
+def _release(key: str, owner: str) -> None:
+    """生成失败时删除锁行，让等待者立即接管"""
+    lock = models.AIGenerationLock
+    db = SessionLocal()
+    try:
+        db.query(lock).filter(lock.lock_key == key, lock.owner == owner).delete(synchronize_session=False)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"Failed to release AI single-flight lock {key}: {e}")
+    finally:
+        db.close()
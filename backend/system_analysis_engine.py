@@ -1,7 +1,10 @@
 """系统分析引擎 - 完全确定性计算模块"""
-from typing import Optional, List, Dict, Tuple
-from decimal import Decimal
+from typing import Optional, List, Dict, Tuple, Union
 from models import CompanyType
+from quarter_metrics import QuarterMetrics
+from instrumentation import timed
+
+_EMPTY_METRICS = QuarterMetrics()
 
 
 def normalize(value: Optional[float], low: float, mid: float, high: float) -> float:
@@ -471,89 +474,91 @@ class SystemAnalysisEngine:
         }
     
     @staticmethod
+    @timed("engine")
     def analyze(
         company_type: CompanyType,
-        quarter_data: Dict,
-        previous_quarter_data: Optional[Dict] = None
+        quarter_data: Union[QuarterMetrics, Dict],
+        previous_quarter_data: Optional[Union[QuarterMetrics, Dict]] = None
     ) -> Dict:
         """
         主分析函数
         
         Args:
             company_type: 公司类型
-            quarter_data: 当前季度数据字典
-            previous_quarter_data: 上一季度数据字典（用于计算trend）
+            quarter_data: 当前季度数据（QuarterMetrics，或同名键的字典）
+            previous_quarter_data: 上一季度数据（用于计算trend）
         """
-        prev = previous_quarter_data or {}
+        cur = QuarterMetrics.from_mapping(quarter_data)
+        prev = QuarterMetrics.from_mapping(previous_quarter_data) or _EMPTY_METRICS
         
         if company_type == CompanyType.TECH_PLATFORM:
             return SystemAnalysisEngine.analyze_tech_platform(
-                pe=quarter_data.get("pe"),
-                pb=quarter_data.get("pb"),
-                ps=quarter_data.get("ps"),
-                roic=quarter_data.get("roic"),
-                wacc=quarter_data.get("wacc"),
-                gross_margin=quarter_data.get("gross_margin"),
-                fcf_margin=quarter_data.get("fcf_margin"),
-                capex_ratio=quarter_data.get("capex_ratio"),
-                prev_roic=prev.get("roic"),
-                prev_gross_margin=prev.get("gross_margin"),
-                prev_capex_ratio=prev.get("capex_ratio")
+                pe=cur.pe,
+                pb=cur.pb,
+                ps=cur.ps,
+                roic=cur.roic,
+                wacc=cur.wacc,
+                gross_margin=cur.gross_margin,
+                fcf_margin=cur.fcf_margin,
+                capex_ratio=cur.capex_ratio,
+                prev_roic=prev.roic,
+                prev_gross_margin=prev.gross_margin,
+                prev_capex_ratio=prev.capex_ratio
             )
         elif company_type == CompanyType.TECH_MATURE:
             return SystemAnalysisEngine.analyze_tech_mature(
-                pe=quarter_data.get("pe"),
-                pb=quarter_data.get("pb"),
-                ps=quarter_data.get("ps"),
-                roic=quarter_data.get("roic"),
-                fcf_margin=quarter_data.get("fcf_margin"),
-                roe=quarter_data.get("roe"),
-                revenue_yoy=quarter_data.get("revenue_yoy"),
-                prev_roic=prev.get("roic"),
-                prev_revenue_yoy=prev.get("revenue_yoy")
+                pe=cur.pe,
+                pb=cur.pb,
+                ps=cur.ps,
+                roic=cur.roic,
+                fcf_margin=cur.fcf_margin,
+                roe=cur.roe,
+                revenue_yoy=cur.revenue_yoy,
+                prev_roic=prev.roic,
+                prev_revenue_yoy=prev.revenue_yoy
             )
         elif company_type == CompanyType.PHARMA_INNOVATION:
             return SystemAnalysisEngine.analyze_pharma_innovation(
-                pe=quarter_data.get("pe"),
-                pb=quarter_data.get("pb"),
-                ps=quarter_data.get("ps"),
-                roic=quarter_data.get("roic"),
-                wacc=quarter_data.get("wacc"),
-                fcf_margin=quarter_data.get("fcf_margin"),
-                roe=quarter_data.get("roe"),
-                gross_margin=quarter_data.get("gross_margin"),
-                prev_roic=prev.get("roic"),
-                prev_fcf_margin=prev.get("fcf_margin"),
-                prev_gross_margin=prev.get("gross_margin")
+                pe=cur.pe,
+                pb=cur.pb,
+                ps=cur.ps,
+                roic=cur.roic,
+                wacc=cur.wacc,
+                fcf_margin=cur.fcf_margin,
+                roe=cur.roe,
+                gross_margin=cur.gross_margin,
+                prev_roic=prev.roic,
+                prev_fcf_margin=prev.fcf_margin,
+                prev_gross_margin=prev.gross_margin
             )
         elif company_type == CompanyType.PHARMA_MATURE:
             return SystemAnalysisEngine.analyze_pharma_mature(
-                pe=quarter_data.get("pe"),
-                pb=quarter_data.get("pb"),
-                roe=quarter_data.get("roe"),
-                fcf_margin=quarter_data.get("fcf_margin"),
-                gross_margin=quarter_data.get("gross_margin"),
-                prev_roe=prev.get("roe"),
-                prev_fcf_margin=prev.get("fcf_margin")
+                pe=cur.pe,
+                pb=cur.pb,
+                roe=cur.roe,
+                fcf_margin=cur.fcf_margin,
+                gross_margin=cur.gross_margin,
+                prev_roe=prev.roe,
+                prev_fcf_margin=prev.fcf_margin
             )
         elif company_type == CompanyType.FINANCIAL:
             return SystemAnalysisEngine.analyze_financial(
-                pb=quarter_data.get("pb"),
-                roe=quarter_data.get("roe"),
-                fcf_margin=quarter_data.get("fcf_margin"),
-                prev_roe=prev.get("roe")
+                pb=cur.pb,
+                roe=cur.roe,
+                fcf_margin=cur.fcf_margin,
+                prev_roe=prev.roe
             )
         elif company_type == CompanyType.MANUFACTURING:
             return SystemAnalysisEngine.analyze_manufacturing(
-                pb=quarter_data.get("pb"),
-                ps=quarter_data.get("ps"),
-                roic=quarter_data.get("roic"),
-                gross_margin=quarter_data.get("gross_margin"),
-                fcf_margin=quarter_data.get("fcf_margin"),
-                revenue_yoy=quarter_data.get("revenue_yoy"),
-                prev_roic=prev.get("roic"),
-                prev_gross_margin=prev.get("gross_margin"),
-                prev_revenue_yoy=prev.get("revenue_yoy")
+                pb=cur.pb,
+                ps=cur.ps,
+                roic=cur.roic,
+                gross_margin=cur.gross_margin,
+                fcf_margin=cur.fcf_margin,
+                revenue_yoy=cur.revenue_yoy,
+                prev_roic=prev.roic,
+                prev_gross_margin=prev.gross_margin,
+                prev_revenue_yoy=prev.revenue_yoy
             )
         else:
             raise ValueError(f"不支持的公司类型: {company_type}")
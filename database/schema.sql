@@ -37,6 +37,7 @@ CREATE TABLE quarters (
     fcf_margin DECIMAL,         -- %
     capex_ratio DECIMAL,        -- CapEx / Revenue %
     created_at TIMESTAMP DEFAULT NOW(),
+    updated_at TIMESTAMP DEFAULT NOW(),  -- 指标最后修改时间（综合AI分析过期判断）
     UNIQUE(company_id, quarter)
 );
 
@@ -53,12 +54,31 @@ CREATE TABLE system_analyses (
     UNIQUE(quarter_id)
 );
 
--- 单季度 AI 分析结果（持久化）
+-- AI 分析历史版本（只追加；文本压缩存储，同一对象内容相同的版本只存一份）
+CREATE TABLE IF NOT EXISTS ai_analysis_versions (
+    id SERIAL PRIMARY KEY,
+    kind TEXT NOT NULL,         -- quarter / comprehensive
+    company_id INTEGER NOT NULL REFERENCES companies(id) ON DELETE CASCADE,
+    quarter_id INTEGER REFERENCES quarters(id) ON DELETE CASCADE,  -- 仅 quarter
+    content_hash TEXT NOT NULL, -- 原文 sha256
+    codec TEXT NOT NULL,        -- zstd / zlib / raw
+    text_blob BYTEA NOT NULL,
+    raw_size INTEGER NOT NULL,
+    stored_size INTEGER NOT NULL,
+    main_label TEXT,
+    risk_label TEXT,
+    based_quarters TEXT[],
+    created_at TIMESTAMP DEFAULT NOW()
+);
+
+-- 单季度 AI 分析结果（持久化，只保存当前版本）
 CREATE TABLE quarter_ai_analyses (
     id SERIAL PRIMARY KEY,
     quarter_id INTEGER REFERENCES quarters(id) ON DELETE CASCADE,
     analysis_text TEXT NOT NULL,
+    current_version_id INTEGER REFERENCES ai_analysis_versions(id) ON DELETE SET NULL,
     created_at TIMESTAMP DEFAULT NOW(),
+    updated_at TIMESTAMP DEFAULT NOW(),
     UNIQUE(quarter_id)
 );
 
@@ -70,13 +90,140 @@ CREATE TABLE company_comprehensive_ai (
     main_label TEXT,
     risk_label TEXT,
     based_quarters TEXT[],      -- 记录用到的 quarter
+    current_version_id INTEGER REFERENCES ai_analysis_versions(id) ON DELETE SET NULL,
     updated_at TIMESTAMP DEFAULT NOW(),
     UNIQUE(company_id)
 );
 
+-- 行业聚合统计（按公司类型与季度预计算，写入季度时增量刷新）
+CREATE TABLE IF NOT EXISTS sector_period_stats (
+    id SERIAL PRIMARY KEY,
+    company_type company_type NOT NULL,
+    quarter TEXT NOT NULL,
+    metric TEXT NOT NULL,       -- roic / gross_margin / ... / trend_score
+    sample_count INTEGER NOT NULL DEFAULT 0,
+    min_value NUMERIC(14,4),
+    p25 NUMERIC(14,4),
+    median NUMERIC(14,4),
+    p75 NUMERIC(14,4),
+    max_value NUMERIC(14,4),
+    histogram INTEGER[],        -- 等宽分箱计数（min_value 到 max_value）
+    updated_at TIMESTAMP DEFAULT NOW(),
+    CONSTRAINT sector_period_stats_group_key UNIQUE(company_type, quarter, metric)
+);
+
+-- 行业标签计数（带该标签的公司数，随行业统计一起刷新；quarter 为 'latest' 时统计各公司最新季度）
+CREATE TABLE IF NOT EXISTS sector_label_counts (
+    id SERIAL PRIMARY KEY,
+    company_type company_type NOT NULL,
+    quarter TEXT NOT NULL,
+    label TEXT NOT NULL,
+    company_count INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT NOW(),
+    CONSTRAINT sector_label_counts_group_key UNIQUE(company_type, quarter, label)
+);
+
+-- 变更日志（事务性 outbox）：写入业务表的同一事务中追加，/api/changes 按 (txid, id) 游标增量读取
+-- 不设外键，实体删除后其变更记录仍保留；过期记录由 python manage.py prune-changes 清理
+CREATE TABLE IF NOT EXISTS change_log (
+    id SERIAL PRIMARY KEY,
+    txid BIGINT NOT NULL DEFAULT 0,  -- 写入事务号 txid_current()
+    entity TEXT NOT NULL,            -- company / quarter / system_analysis / quarter_ai / comprehensive_ai
+    action TEXT NOT NULL,            -- created / updated / deleted / upserted
+    entity_id INTEGER NOT NULL,      -- 系统分析与单季度AI分析为 quarter_id，综合分析为 company_id
+    company_id INTEGER,
+    quarter_id INTEGER,
+    data JSON,                       -- 写入时的快照
+    changed_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+-- AI生成的跨进程去重锁（相同输入的并发生成只调用一次LLM）
+CREATE TABLE IF NOT EXISTS ai_generation_locks (
+    lock_key TEXT PRIMARY KEY,  -- quarter:<id>:<输入指纹> / company:<id>:<输入指纹>
+    owner TEXT NOT NULL,        -- 主机:进程:线程
+    acquired_at TIMESTAMP NOT NULL,
+    expires_at TIMESTAMP NOT NULL,  -- 租约到期后其他进程可接管
+    result_text TEXT,
+    completed_at TIMESTAMP
+);
+
+-- 组合（自选）：聚合列为 Σ(权重×成员最新季度的值) 与该指标非空成员的 Σ权重，加权平均 = sum / weight
+CREATE TABLE IF NOT EXISTS portfolios (
+    id SERIAL PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    description TEXT,
+    member_count INTEGER NOT NULL DEFAULT 0,
+    total_weight DOUBLE PRECISION NOT NULL DEFAULT 0,
+    quality_score_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+    quality_score_weight DOUBLE PRECISION NOT NULL DEFAULT 0,
+    valuation_score_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+    valuation_score_weight DOUBLE PRECISION NOT NULL DEFAULT 0,
+    trend_score_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+    trend_score_weight DOUBLE PRECISION NOT NULL DEFAULT 0,
+    roic_wacc_spread_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+    roic_wacc_spread_weight DOUBLE PRECISION NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT NOW(),
+    updated_at TIMESTAMP DEFAULT NOW()
+);
+
+-- 组合成员：权重与公司最新季度的快照（季度写入后增量更新所属组合的聚合列）
+CREATE TABLE IF NOT EXISTS portfolio_members (
+    id SERIAL PRIMARY KEY,
+    portfolio_id INTEGER NOT NULL REFERENCES portfolios(id) ON DELETE CASCADE,
+    company_id INTEGER NOT NULL REFERENCES companies(id) ON DELETE CASCADE,
+    weight DOUBLE PRECISION NOT NULL DEFAULT 1,
+    latest_quarter TEXT,
+    quality_score DOUBLE PRECISION,
+    valuation_score DOUBLE PRECISION,
+    trend_score DOUBLE PRECISION,
+    roic_wacc_spread DOUBLE PRECISION,
+    added_at TIMESTAMP DEFAULT NOW(),
+    updated_at TIMESTAMP DEFAULT NOW(),
+    CONSTRAINT portfolio_members_portfolio_company_key UNIQUE (portfolio_id, company_id)
+);
+
+-- 全文检索文档：单季度AI分析、系统摘要、综合AI分析各一行
+-- tsv 由应用把汉字切为重叠二元组后以 'simple' 配置生成（见 backend/search_index.py）
+CREATE TABLE IF NOT EXISTS search_documents (
+    id SERIAL PRIMARY KEY,
+    kind TEXT NOT NULL,         -- quarter_ai / system_summary / comprehensive_ai
+    subject_id INTEGER NOT NULL, -- 季度类为 quarter_id，综合分析为 company_id
+    company_id INTEGER NOT NULL REFERENCES companies(id) ON DELETE CASCADE,
+    quarter_id INTEGER REFERENCES quarters(id) ON DELETE CASCADE,
+    body TEXT NOT NULL,
+    tsv TSVECTOR,
+    updated_at TIMESTAMP DEFAULT NOW(),
+    CONSTRAINT search_documents_kind_subject_key UNIQUE (kind, subject_id)
+);
+
+-- 按日累计的 LLM token 用量（综合AI分析定时刷新的每日预算）
+CREATE TABLE IF NOT EXISTS ai_token_usage (
+    usage_date DATE NOT NULL,
+    scope TEXT NOT NULL,        -- comprehensive-refresh
+    tokens BIGINT NOT NULL DEFAULT 0,
+    calls INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT NOW(),
+    PRIMARY KEY (usage_date, scope)
+);
+
 -- 创建索引以优化查询性能
 CREATE INDEX idx_quarters_company_id ON quarters(company_id);
 CREATE INDEX idx_quarters_quarter ON quarters(quarter DESC);
 CREATE INDEX idx_system_analyses_quarter_id ON system_analyses(quarter_id);
 CREATE INDEX idx_quarter_ai_analyses_quarter_id ON quarter_ai_analyses(quarter_id);
+-- 后续新增的表与索引均带 IF NOT EXISTS，对已有数据库重复执行这些语句是安全的
+CREATE INDEX IF NOT EXISTS idx_portfolio_members_company_id ON portfolio_members(company_id);
+CREATE INDEX IF NOT EXISTS idx_ai_analysis_versions_subject ON ai_analysis_versions(company_id, kind, quarter_id, content_hash);
+CREATE INDEX IF NOT EXISTS idx_system_analyses_labels ON system_analyses USING GIN (labels);
+CREATE INDEX IF NOT EXISTS idx_sector_label_counts_quarter ON sector_label_counts(quarter, company_type);
+CREATE INDEX IF NOT EXISTS idx_search_documents_company_id ON search_documents(company_id);
+CREATE INDEX IF NOT EXISTS idx_search_documents_tsv ON search_documents USING GIN (tsv);
+CREATE INDEX IF NOT EXISTS idx_change_log_position ON change_log(txid, id);
+CREATE INDEX IF NOT EXISTS idx_change_log_changed_at ON change_log(changed_at);
+
+-- 时间序列接口的覆盖索引（index-only scan，无需回表）
+CREATE INDEX IF NOT EXISTS idx_quarters_company_series ON quarters(company_id, quarter)
+    INCLUDE (pe, pb, ps, roe, roic, wacc, revenue_yoy, gross_margin, fcf_margin, capex_ratio);
+CREATE INDEX IF NOT EXISTS idx_system_analyses_series ON system_analyses(quarter_id)
+    INCLUDE (quality_score, valuation_score, trend_score);
 
@@ -1,5 +1,8 @@
 /** API客户端 */
 import axios from 'axios';
+import type {
+  AppEvent, AppEventType, BatchResult, CompanyDetail, CompanyType, LabelFacets, QuarterDetail, SearchKind, SearchResponse,
+} from './types';
 
 const API_BASE_URL = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000';
 
@@ -13,12 +16,20 @@ const api = axios.create({
 // 公司相关API
 export const companyApi = {
   getAll: () => api.get('/companies'),
-  getById: (id: number) => api.get(`/companies/${id}`),
+  getById: (id: number, params?: { fields?: string; include?: string }) =>
+    api.get(`/companies/${id}`, { params }),
+  // 一次请求取多家公司的详情，结果按 id 索引（每次最多 200 个）；供需要多家公司详情的列表视图使用
+  getByIds: (ids: number[], params: { fields?: string; include?: string } = {}) =>
+    api.post<BatchResult<CompanyDetail>>('/companies/batch', { ids, ...params }),
   create: (data: { ticker: string; company_name: string; company_type: string }) =>
     api.post('/companies', data),
   update: (id: number, data: { ticker?: string; company_name?: string; company_type?: string }) =>
     api.put(`/companies/${id}`, data),
   delete: (id: number) => api.delete(`/companies/${id}`),
+  getSeries: (id: number, params: { metrics?: string[]; from?: string; to?: string; max_points?: number } = {}) =>
+    api.get(`/companies/${id}/series`, {
+      params: { ...params, metrics: params.metrics?.join(',') },
+    }),
 };
 
 // 季度数据相关API
@@ -50,16 +61,87 @@ export const quarterApi = {
     fcf_margin?: number;
     capex_ratio?: number;
   }) => api.put(`/quarters/${id}`, data),
-  getById: (id: number) => api.get(`/quarters/${id}`),
+  getById: (id: number, params?: { fields?: string; include?: string }) =>
+    api.get(`/quarters/${id}`, { params }),
+  // 一次请求取多个季度（含系统分析与AI分析），结果按 id 索引（每次最多 200 个）；供需要多个季度详情的列表视图使用
+  getByIds: (ids: number[], params: { fields?: string; include?: string } = {}) =>
+    api.get<BatchResult<QuarterDetail>>('/quarters', { params: { ids: ids.join(','), ...params } }),
+  upsert: (companyId: number, quarter: string, data: {
+    pe?: number;
+    pb?: number;
+    ps?: number;
+    roe?: number;
+    roic?: number;
+    wacc?: number;
+    revenue_yoy?: number;
+    gross_margin?: number;
+    fcf_margin?: number;
+    capex_ratio?: number;
+  }) => api.put(`/companies/${companyId}/quarters/${quarter}`, data),
   delete: (id: number) => api.delete(`/quarters/${id}`),
   getAI: (id: number) => api.get(`/quarters/${id}/ai`),
   generateAI: (id: number) => api.post(`/quarters/${id}/ai/generate`),
+  getAIVersions: (id: number) => api.get(`/quarters/${id}/ai/versions`),
+  getAIVersion: (id: number, versionId: number) => api.get(`/quarters/${id}/ai/versions/${versionId}`),
+};
+
+// 组合API
+export const portfolioApi = {
+  getAll: () => api.get('/portfolios'),
+  getById: (id: number) => api.get(`/portfolios/${id}`),
+  create: (data: { name: string; description?: string; members?: { company_id: number; weight?: number }[] }) =>
+    api.post('/portfolios', data),
+  update: (id: number, data: { name?: string; description?: string }) => api.put(`/portfolios/${id}`, data),
+  delete: (id: number) => api.delete(`/portfolios/${id}`),
+  setMember: (id: number, companyId: number, weight: number) =>
+    api.put(`/portfolios/${id}/members/${companyId}`, { weight }),
+  removeMember: (id: number, companyId: number) => api.delete(`/portfolios/${id}/members/${companyId}`),
+};
+
+// 标签分面：quarter 为 latest（各公司最新季度）、all 或具体季度
+export const labelApi = {
+  getFacets: (params: { quarter?: string; companyType?: CompanyType } = {}) =>
+    api.get<LabelFacets>('/labels', { params: { quarter: params.quarter, company_type: params.companyType } }),
+};
+
+// 全文检索API：q 为空白分隔的检索词（须同时命中）
+export const searchApi = {
+  search: (q: string, options: { kinds?: SearchKind[]; companyId?: number; limit?: number } = {}) =>
+    api.get<SearchResponse>('/search', {
+      params: {
+        q,
+        kind: options.kinds?.length ? options.kinds.join(',') : undefined,
+        company_id: options.companyId,
+        limit: options.limit,
+      },
+    }),
 };
 
 // 综合AI分析API
 export const comprehensiveAIApi = {
   get: (companyId: number) => api.get(`/companies/${companyId}/comprehensive-ai`),
   generate: (companyId: number) => api.post(`/companies/${companyId}/comprehensive-ai/generate`),
+  getVersions: (companyId: number) => api.get(`/companies/${companyId}/comprehensive-ai/versions`),
+  getVersion: (companyId: number, versionId: number) =>
+    api.get(`/companies/${companyId}/comprehensive-ai/versions/${versionId}`),
+};
+
+// 变更事件推送（SSE），返回取消订阅函数
+export const subscribeEvents = (
+  onEvent: (event: AppEvent) => void,
+  options: { companyIds?: number[]; types?: AppEventType[] } = {},
+) => {
+  const params = new URLSearchParams();
+  if (options.companyIds?.length) params.set('company_id', options.companyIds.join(','));
+  if (options.types?.length) params.set('types', options.types.join(','));
+  const query = params.toString();
+  const source = new EventSource(`/api/events${query ? `?${query}` : ''}`);
+
+  const handler = (message: MessageEvent) => onEvent(JSON.parse(message.data));
+  for (const type of ['analysis-completed', 'quarter-changed', 'company-changed', 'resync']) {
+    source.addEventListener(type, handler);
+  }
+  return () => source.close();
 };
 
 export default api;
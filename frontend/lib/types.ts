@@ -58,6 +58,7 @@ export interface QuarterAIAnalysis {
   id: number;
   quarter_id: number;
   analysis_text: string;
+  current_version_id?: number;
   created_at: string;
 }
 
@@ -68,9 +69,28 @@ export interface CompanyComprehensiveAI {
   main_label?: string;
   risk_label?: string;
   based_quarters?: string[];
+  current_version_id?: number;
   updated_at: string;
 }
 
+// AI分析历史版本（列表不含文本，单个版本含 analysis_text）
+export interface AIAnalysisVersion {
+  id: number;
+  kind: 'quarter' | 'comprehensive';
+  company_id: number;
+  quarter_id?: number;
+  content_hash: string;
+  codec: 'zstd' | 'zlib' | 'raw';
+  raw_size: number;
+  stored_size: number;
+  main_label?: string;
+  risk_label?: string;
+  based_quarters?: string[];
+  created_at?: string;
+  is_current: boolean;
+  analysis_text?: string;
+}
+
 export interface CompanyCard {
   id: number;
   ticker: string;
@@ -84,11 +104,113 @@ export interface CompanyCard {
   comprehensive_ai?: CompanyComprehensiveAI;
 }
 
+export interface QuarterDetail extends Quarter {
+  system_analysis?: SystemAnalysis;
+  ai_analysis?: QuarterAIAnalysis;
+}
+
 export interface CompanyDetail extends Company {
-  quarters: Array<Quarter & {
-    system_analysis?: SystemAnalysis;
-    ai_analysis?: QuarterAIAnalysis;
-  }>;
+  quarters: QuarterDetail[];
   comprehensive_ai?: CompanyComprehensiveAI;
 }
 
+// 批量读取：items 以 id 为键，不存在的 id 列在 missing
+export interface BatchResult<T> {
+  items: Record<string, T>;
+  missing: number[];
+}
+
+
+// 组合：aggregates 为成员最新季度按权重的加权平均
+export interface PortfolioAggregates {
+  quality_score?: number;
+  valuation_score?: number;
+  trend_score?: number;
+  roic_wacc_spread?: number;
+}
+
+export interface PortfolioMember {
+  company_id: number;
+  ticker: string;
+  company_name: string;
+  company_type: CompanyType;
+  weight: number;
+  weight_share?: number;
+  latest_quarter?: string;
+  quality_score?: number;
+  valuation_score?: number;
+  trend_score?: number;
+  roic_wacc_spread?: number;
+  added_at?: string;
+}
+
+export interface Portfolio {
+  id: number;
+  name: string;
+  description?: string;
+  member_count: number;
+  total_weight: number;
+  aggregates: PortfolioAggregates;
+  created_at?: string;
+  updated_at?: string;
+  members?: PortfolioMember[];
+}
+
+// 标签分面计数（预计算）：totals 为合计，groups 为按公司类型与季度的明细
+export interface LabelCount {
+  label: string;
+  count: number;
+}
+
+export interface LabelFacetGroup extends LabelCount {
+  company_type: CompanyType;
+  quarter: string;
+}
+
+export interface LabelFacets {
+  quarter: string;
+  company_type?: CompanyType;
+  totals: LabelCount[];
+  groups: LabelFacetGroup[];
+  updated_at?: string;
+}
+
+// 全文检索：highlights 为 snippet 内的命中区间 [开始, 结束)
+export type SearchKind = 'quarter_ai' | 'system_summary' | 'comprehensive_ai';
+
+export interface SearchHit {
+  kind: SearchKind;
+  company_id: number;
+  ticker: string;
+  company_name: string;
+  quarter_id?: number;
+  quarter?: string;
+  rank?: number;
+  snippet: string;
+  highlights: [number, number][];
+  updated_at?: string;
+}
+
+export interface SearchResponse {
+  query: string;
+  terms: string[];
+  kinds: SearchKind[];
+  count: number;
+  items: SearchHit[];
+}
+
+export type AppEventType = 'analysis-completed' | 'quarter-changed' | 'company-changed';
+
+export interface AppEvent {
+  id: number;
+  type: AppEventType | 'resync';  // resync：推送积压被丢弃，需要整体刷新
+  company_id: number | null;
+  ts: number;
+  action?: 'created' | 'updated' | 'deleted';
+  kind?: 'quarter' | 'comprehensive';
+  quarter_id?: number;
+  quarter?: string;
+  rescored_quarter_ids?: number[];
+  main_label?: string | null;
+  risk_label?: string | null;
+}